@@ -0,0 +1,226 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, Optional, Sequence, Tuple
+
+
+class OverloadedError(Exception):
+    """服务繁忙：排队已满或排队超时"""
+
+
+class RateLimiter:
+    """按键（用户ID、会话ID）的令牌桶：每秒补充rate个令牌，最多积累burst个
+
+    每个键只保存(令牌数, 上次更新时间)，检查为O(1)；桶的数量超过上次清理后的两倍时，
+    丢弃已经补满的桶（它们与新建的桶等价），内存只随活跃的键增长。
+    rate为0时不限制。
+    """
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.clock = clock
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._prune_at = 1024
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: str) -> float:
+        """取一个令牌，成功返回0，否则返回需要等待的秒数（不扣令牌）"""
+        wait = self.wait_time(key)
+        if wait:
+            self.limited += 1
+            return wait
+        self.take(key)
+        return 0.0
+
+    def wait_time(self, key: str) -> float:
+        """有令牌时返回0，否则返回需要等待的秒数；不扣令牌"""
+        if not self.rate:
+            return 0.0
+        tokens = self._tokens(key, self.clock())
+        return 0.0 if tokens >= 1.0 else (1.0 - tokens) / self.rate
+
+    def take(self, key: str):
+        """扣一个令牌（调用前应已确认有令牌）"""
+        if not self.rate:
+            return
+        now = self.clock()
+        self._buckets[key] = (self._tokens(key, now) - 1.0, now)
+        if len(self._buckets) > self._prune_at:
+            self._prune(now)
+
+    def _tokens(self, key: str, now: float) -> float:
+        tokens, stamp = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - stamp) * self.rate)
+
+    def _prune(self, now: float):
+        full_after = self.burst / self.rate
+        self._buckets = {
+            key: (tokens, stamp) for key, (tokens, stamp) in self._buckets.items()
+            if now - stamp < full_after
+        }
+        self._prune_at = max(1024, 2 * len(self._buckets))
+
+    def stats(self) -> Dict:
+        return {"rate_per_minute": self.rate * 60, "burst": self.burst, "keys": len(self._buckets), "limited": self.limited}
+
+
+def acquire_all(limits: Sequence[Tuple[RateLimiter, str, str]]) -> Optional[Tuple[str, float]]:
+    """依次检查(令牌桶, 键, 限流范围)，都有令牌时才各扣一个并返回None；
+    否则不扣任何令牌，返回(第一个拒绝的限流范围, 需要等待的秒数)
+
+    被拒绝的请求不会消耗其他桶的令牌，例如被用户限流拒绝的消息不占用共享会话的额度。
+    """
+    for limiter, key, scope in limits:
+        wait = limiter.wait_time(key)
+        if wait:
+            limiter.limited += 1
+            return scope, wait
+    for limiter, key, _ in limits:
+        limiter.take(key)
+    return None
+
+
+class AdmissionController:
+    """全局并发上限与有界的公平排队
+
+    每个请求先登记（admit）：排队总数或该会话的排队数已满时立即拒绝，不让请求一直等到超时。
+    真正调用LLM前再申请并发名额（slot）：名额已满时按会话分别排队，释放名额时在有请求等待的会话之间轮转分配，
+    同一个群刷屏只会排在自己的队列里，不会挤占其他群的名额。等待超过queue_timeout秒同样以繁忙拒绝。
+    max_in_flight为0时不限制。
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue: int = 100,
+        max_queue_per_conversation: int = 5,
+        queue_timeout: float = 10.0,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_conversation = max_queue_per_conversation
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # 已登记但尚未结束的请求数（总数与按会话）
+        self.admitted = 0
+        self._admitted_by_conversation: Dict[str, int] = {}
+        # 等待名额的请求：按会话的FIFO队列，以及有请求等待的会话的轮转顺序
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self._rotation: Deque[str] = deque()
+        self.waiting = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_in_flight > 0
+
+    def check(self, conversation_id: str):
+        """排队总数或该会话的排队数已满时抛出OverloadedError"""
+        if not self.enabled:
+            return
+        pending = self._admitted_by_conversation.get(conversation_id, 0)
+        if self.admitted >= self.max_in_flight + self.max_queue or pending >= self.max_queue_per_conversation:
+            self.shed_queue_full += 1
+            raise OverloadedError("服务繁忙，排队已满")
+
+    @asynccontextmanager
+    async def admit(self, conversation_id: str):
+        """登记一个请求，排队已满时抛出OverloadedError"""
+        if not self.enabled:
+            yield
+            return
+        self.check(conversation_id)
+        self.admitted += 1
+        self._admitted_by_conversation[conversation_id] = self._admitted_by_conversation.get(conversation_id, 0) + 1
+        try:
+            yield
+        finally:
+            self.admitted -= 1
+            remaining = self._admitted_by_conversation[conversation_id] - 1
+            if remaining:
+                self._admitted_by_conversation[conversation_id] = remaining
+            else:
+                del self._admitted_by_conversation[conversation_id]
+
+    @asynccontextmanager
+    async def slot(self, conversation_id: str):
+        """占用一个并发名额，名额已满时公平排队，超时抛出OverloadedError"""
+        if not self.enabled:
+            yield
+            return
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            self.in_flight += 1
+        else:
+            await self._wait(conversation_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _wait(self, conversation_id: str):
+        future = asyncio.get_running_loop().create_future()
+        queue = self._waiters.get(conversation_id)
+        if queue is None:
+            queue = self._waiters[conversation_id] = deque()
+            self._rotation.append(conversation_id)
+        queue.append(future)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done():
+                # 超时的同时被分配了名额，照常使用
+                return
+            self._discard(conversation_id, future)
+            self.shed_timeout += 1
+            raise OverloadedError("服务繁忙，排队超时")
+        except BaseException:
+            if future.done():
+                self._release()
+            else:
+                self._discard(conversation_id, future)
+            raise
+
+    def _discard(self, conversation_id: str, future: asyncio.Future):
+        future.cancel()
+        queue = self._waiters.get(conversation_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self._waiters[conversation_id]
+                self._rotation.remove(conversation_id)
+
+    def _release(self):
+        """释放名额：有请求等待时直接转交给轮转到的会话，名额数不变"""
+        while self._rotation:
+            conversation_id = self._rotation.popleft()
+            queue = self._waiters[conversation_id]
+            future = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self._rotation.append(conversation_id)
+            else:
+                del self._waiters[conversation_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "waiting_conversations": len(self._rotation),
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+        }
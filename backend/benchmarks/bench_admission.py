@@ -0,0 +1,139 @@
+"""限流与准入控制：限流器自身的开销，以及刷屏群存在时其他群的延迟
+
+开销：令牌桶检查（按用户和会话各一次）与准入控制（登记 + 无竞争时占用名额）的单次耗时，
+以及10万个不同用户时令牌桶的内存占用。
+刷屏场景：若干个刷屏群同时发送大量消息，稍后其他群各发送一条消息，
+比较不限制与开启限流 + 准入控制时正常群的延迟、刷屏消息被拒绝的数量和最慢的刷屏消息耗时。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_admission --spam-groups 6 --spam-messages 15 --normal-groups 8
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+import aiohttp
+
+from admission import AdmissionController, RateLimiter, acquire_all
+from benchmarks.common import ThreadedServer, free_port, start_backend_process, stop_backend_process, wait_ready
+from benchmarks.fake_dashscope import FakeDashScope
+
+LIMITS = {
+    "RATE_LIMIT_USER_PER_MINUTE": 20,
+    "RATE_LIMIT_USER_BURST": 5,
+    "RATE_LIMIT_CONVERSATION_PER_MINUTE": 30,
+    "RATE_LIMIT_CONVERSATION_BURST": 6,
+    "ADMISSION_MAX_IN_FLIGHT": 4,
+    "ADMISSION_MAX_QUEUE": 40,
+    "ADMISSION_MAX_QUEUE_PER_CONVERSATION": 3,
+    "ADMISSION_QUEUE_TIMEOUT": 5,
+}
+
+
+def bench_overhead(iterations: int):
+    user_limiter = RateLimiter(1000, 1000)
+    conversation_limiter = RateLimiter(1000, 1000)
+    admission = AdmissionController(max_in_flight=64)
+    disabled = AdmissionController(max_in_flight=0)
+
+    start = time.perf_counter()
+    for index in range(iterations):
+        acquire_all((
+            (conversation_limiter, f"group_{index % 200}", "conversation"),
+            (user_limiter, f"user{index % 1000}", "user"),
+        ))
+    bucket_us = (time.perf_counter() - start) / iterations * 1e6
+
+    async def admitted(controller: AdmissionController):
+        begin = time.perf_counter()
+        for index in range(iterations):
+            conversation_id = f"group_{index % 200}"
+            async with controller.admit(conversation_id):
+                async with controller.slot(conversation_id):
+                    pass
+        return (time.perf_counter() - begin) / iterations * 1e6
+
+    admission_us = asyncio.run(admitted(admission))
+    disabled_us = asyncio.run(admitted(disabled))
+
+    limiter = RateLimiter(1, 5)
+    tracemalloc.start()
+    for index in range(100000):
+        limiter.acquire(f"user{index}")
+    bucket_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return bucket_us, admission_us, disabled_us, bucket_memory, limiter.stats()["keys"]
+
+
+async def spam_scenario(url: str, args):
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        async def send(conversation_id: str, user_id: str):
+            start = time.perf_counter()
+            async with session.post(url + "/chat", json={
+                "user_id": user_id, "user_name": "玩家", "message": "我对房间进行侦查", "conversation_id": conversation_id
+            }) as resp:
+                await resp.read()
+                return resp.status, time.perf_counter() - start
+
+        spam = [
+            asyncio.create_task(send(f"spam_{group}", f"spammer{group}_{index % 3}"))
+            for group in range(args.spam_groups) for index in range(args.spam_messages)
+        ]
+        await asyncio.sleep(0.05)
+        normal = [asyncio.create_task(send(f"normal_{group}", f"player{group}")) for group in range(args.normal_groups)]
+        return await asyncio.gather(*spam), await asyncio.gather(*normal)
+
+
+def run_config(upstream_url: str, args, overrides):
+    port = free_port()
+    process = start_backend_process(port, upstream_url, LLM_MAX_CONCURRENCY=4, **overrides)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_ready(url))
+        return asyncio.run(spam_scenario(url, args))
+    finally:
+        stop_backend_process(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--spam-groups", type=int, default=6)
+    parser.add_argument("--spam-messages", type=int, default=15, help="每个刷屏群同时发送的消息数")
+    parser.add_argument("--normal-groups", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟DashScope单次调用延迟（秒）")
+    args = parser.parse_args()
+
+    bucket_us, admission_us, disabled_us, bucket_memory, keys = bench_overhead(args.iterations)
+    print(f"令牌桶检查（用户 + 会话）: {bucket_us:.2f}µs")
+    print(f"准入控制（登记 + 占用名额，无竞争）: {admission_us:.2f}µs，关闭时 {disabled_us:.2f}µs")
+    print(f"10万个用户的令牌桶: {bucket_memory / 1e6:.1f}MB（{keys}个桶）")
+    print()
+
+    fake = FakeDashScope(latency=args.latency, chunk_interval=0)
+    rows = []
+    with ThreadedServer(fake.app) as upstream:
+        for name, overrides in (("不限制", {}), ("限流 + 准入控制", LIMITS)):
+            spam, normal = run_config(upstream.url, args, overrides)
+            normal_latencies = sorted(elapsed for status, elapsed in normal if status == 200)
+            rows.append((
+                name,
+                sum(1 for status, _ in spam if status == 200),
+                sum(1 for status, _ in spam if status in (429, 503)),
+                max(elapsed for _, elapsed in spam),
+                len(normal_latencies),
+                normal_latencies[len(normal_latencies) // 2] if normal_latencies else float("nan"),
+                normal_latencies[-1] if normal_latencies else float("nan"),
+            ))
+
+    total_spam = args.spam_groups * args.spam_messages
+    print(f"{args.spam_groups}个刷屏群共{total_spam}条消息，{args.normal_groups}个正常群各1条，"
+          f"LLM并发4，上游延迟{args.latency}s")
+    print(f"{'配置':<16}{'刷屏成功':>10}{'刷屏拒绝':>10}{'刷屏最慢(s)':>12}{'正常成功':>10}{'正常p50(s)':>12}{'正常最慢(s)':>12}")
+    for name, spam_ok, spam_shed, spam_max, normal_ok, normal_p50, normal_max in rows:
+        print(f"{name:<16}{spam_ok:>10}{spam_shed:>10}{spam_max:>12.2f}{normal_ok:>10}{normal_p50:>12.2f}{normal_max:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""角色数据访问基准：对比每次请求重新解析characters.json与常驻内存的CharacterRegistry
+
+随会话数增长，分别测量读取会话角色描述与切换会话角色的单次延迟。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_character_registry --sessions 100 1000 10000 50000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from character_registry import CharacterRegistry
+
+DEFAULT_DESCRIPTION = "你是一个友善的AI助手，正在参与TRPG（桌上角色扮演游戏）。"
+
+
+def legacy_load(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def legacy_get_description(path: str, conversation_id: str) -> str:
+    data = legacy_load(path)
+    current_char = data.get("session_characters", {}).get(conversation_id, "default")
+    characters = data.get("characters", {})
+    if current_char in characters:
+        return characters[current_char]["description"]
+    return characters.get("default", {}).get("description", DEFAULT_DESCRIPTION)
+
+
+def legacy_set_session(path: str, conversation_id: str, character_name: str):
+    data = legacy_load(path)
+    data.setdefault("session_characters", {})[conversation_id] = character_name
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def write_fixture(path: str, sessions: int):
+    data = {
+        "session_characters": {f"group_{i}": ("kp" if i % 3 else "default") for i in range(sessions)},
+        "characters": {
+            "default": {"name": "默认助手", "description": DEFAULT_DESCRIPTION},
+            "kp": {"name": "kp", "description": "你是一名经验丰富的克苏鲁的呼唤守秘人。" * 20},
+        },
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def per_call_us(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench(sessions: int, iterations: int):
+    workdir = tempfile.mkdtemp(prefix="sealdice-chars-")
+    path = os.path.join(workdir, "characters.json")
+
+    write_fixture(path, sessions)
+    legacy_read = per_call_us(lambda i: legacy_get_description(path, f"group_{i % sessions}"), iterations)
+    legacy_write = per_call_us(lambda i: legacy_set_session(path, f"group_{i % sessions}", "kp"), max(1, iterations // 10))
+
+    write_fixture(path, sessions)
+    registry = CharacterRegistry(path, DEFAULT_DESCRIPTION, save_delay=1.0)
+    registry.get_description("warmup")
+    registry_read = per_call_us(lambda i: registry.get_description(f"group_{i % sessions}"), iterations)
+    registry_write = per_call_us(lambda i: registry.set_session_character(f"group_{i % sessions}", "default"), iterations)
+    start = time.perf_counter()
+    registry.flush()
+    flush_ms = (time.perf_counter() - start) * 1000
+
+    return legacy_read, registry_read, legacy_write, registry_write, flush_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'会话数':>8} | {'读取(旧) us':>12} {'读取(新) us':>12} | {'切换(旧) us':>12} {'切换(新) us':>12} | {'落盘 ms':>8}")
+    for sessions in args.sessions:
+        legacy_read, registry_read, legacy_write, registry_write, flush_ms = bench(sessions, args.iterations)
+        print(f"{sessions:>8} | {legacy_read:>12.1f} {registry_read:>12.2f} | {legacy_write:>12.1f} {registry_write:>12.2f} | {flush_ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""批量聊天接口：同样数量的消息逐条请求/chat与按批请求/chat/batch的HTTP请求数与总耗时
+
+消息分散在多个群中，逐条模式按插件的行为每条消息一个并发请求，批量模式每--batch-size条消息一个请求。
+上游延迟默认很小，结果主要反映每个HTTP请求本身（连接、JSON解析、pydantic校验）的开销。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_chat_batch --messages 400 --batch-size 20
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+from benchmarks.common import ThreadedServer, prepare_backend_env
+from benchmarks.fake_dashscope import FakeDashScope
+
+
+def make_messages(count: int, groups: int, prefix: str):
+    return [{
+        "user_id": f"user{index % 20}",
+        "user_name": "玩家",
+        "message": f"我对第{index}个房间进行侦查",
+        "conversation_id": f"{prefix}group_{index % groups}",
+    } for index in range(count)]
+
+
+async def send_individually(session: aiohttp.ClientSession, url: str, messages):
+    async def one(payload):
+        async with session.post(url + "/chat", json=payload) as resp:
+            return (await resp.json())["success"]
+    results = await asyncio.gather(*(one(payload) for payload in messages))
+    return sum(results), len(messages)
+
+
+async def send_batched(session: aiohttp.ClientSession, url: str, messages, batch_size: int):
+    async def one(batch):
+        async with session.post(url + "/chat/batch", json={"requests": batch}) as resp:
+            return (await resp.json())["succeeded"]
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+    results = await asyncio.gather(*(one(batch) for batch in batches))
+    return sum(results), len(batches)
+
+
+async def run(url: str, args):
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+        rows = []
+        for mode in ("逐条/chat", "批量/chat/batch"):
+            messages = make_messages(args.messages, args.groups, prefix=f"{len(rows)}_")
+            start = time.perf_counter()
+            if mode.startswith("逐条"):
+                ok, http_requests = await send_individually(session, url, messages)
+            else:
+                ok, http_requests = await send_batched(session, url, messages, args.batch_size)
+            rows.append((mode, http_requests, ok, time.perf_counter() - start))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--groups", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--connections", type=int, default=20, help="客户端最大连接数")
+    parser.add_argument("--latency", type=float, default=0.01, help="模拟DashScope单次调用延迟（秒）")
+    args = parser.parse_args()
+
+    fake = FakeDashScope(latency=args.latency, chunk_interval=0)
+    with ThreadedServer(fake.app) as upstream:
+        prepare_backend_env(
+            upstream.url, LLM_MAX_CONCURRENCY=64, CHAT_BATCH_CONCURRENCY=args.batch_size,
+            CHAT_BATCH_MAX_ITEMS=max(args.batch_size, 50)
+        )
+        import main as backend
+
+        with ThreadedServer(backend.app) as server:
+            rows = asyncio.run(run(server.url, args))
+
+    print(f"{args.messages}条消息，{args.groups}个群，批大小{args.batch_size}，上游延迟{args.latency}s")
+    print(f"{'模式':<16}{'HTTP请求数':>12}{'成功':>8}{'总耗时':>10}{'每条消息(ms)':>14}")
+    for mode, http_requests, ok, elapsed in rows:
+        print(f"{mode:<16}{http_requests:>12}{ok:>8}{elapsed:>9.2f}s{elapsed / args.messages * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
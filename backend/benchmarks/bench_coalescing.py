@@ -0,0 +1,119 @@
+"""同一会话并发请求的串行化与合并测试：使用模拟LLM，在多个群内制造突发消息
+
+检查每个群的历史记录中用户消息保持提交顺序、每条AI回复前都有对应的用户消息，
+并对比关闭/开启合并（CONVERSATION_COALESCE）时的LLM调用次数与总耗时。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_coalescing --groups 8 --burst 10 --latency 0.5
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+import aiohttp
+
+from benchmarks.common import ThreadedServer, prepare_backend_env
+from benchmarks.fake_dashscope import FakeDashScope
+
+
+async def post_chat(session: aiohttp.ClientSession, url: str, group: str, index: int) -> dict:
+    payload = {
+        "user_id": f"user{index}",
+        "user_name": f"玩家{index}",
+        "message": f"{group}-msg{index:03d}",
+        "conversation_id": group,
+        "user_permission": 0,
+    }
+    async with session.post(url + "/chat", json=payload) as resp:
+        return await resp.json()
+
+
+async def burst(session: aiohttp.ClientSession, url: str, group: str, size: int, gap: float) -> List[dict]:
+    """按固定间隔依次发出请求（不等待回复），模拟群内的连续发言"""
+    tasks = []
+    for index in range(size):
+        tasks.append(asyncio.ensure_future(post_chat(session, url, group, index)))
+        await asyncio.sleep(gap)
+    return await asyncio.gather(*tasks)
+
+
+async def run(url: str, groups: List[str], size: int, gap: float):
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(burst(session, url, group, size, gap) for group in groups))
+        return time.perf_counter() - start, dict(zip(groups, results))
+
+
+def check_history(history: List[Dict], group: str, size: int) -> List[str]:
+    """返回顺序问题列表（为空表示正常）"""
+    problems = []
+    dialog = [m for m in history if m["role"] in ("user", "assistant")]
+    expected = [f"{group}-msg{index:03d}" for index in range(size)]
+    seen = [next((e for e in expected if e in m["content"]), None) for m in dialog if m["role"] == "user"]
+    if seen != expected:
+        problems.append(f"{group}: 用户消息顺序不符 {seen}")
+    previous = "assistant"
+    for message in dialog:
+        if message["role"] == "assistant" and previous != "user":
+            problems.append(f"{group}: AI回复前没有对应的用户消息")
+        previous = message["role"]
+    if previous != "assistant":
+        problems.append(f"{group}: 最后的用户消息没有得到回复")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--groups", type=int, default=8)
+    parser.add_argument("--burst", type=int, default=10, help="每个群的连续消息数")
+    parser.add_argument("--gap", type=float, default=0.02, help="群内相邻消息的发送间隔（秒）")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟DashScope单次调用延迟（秒）")
+    args = parser.parse_args()
+
+    fake = FakeDashScope(latency=args.latency)
+    with ThreadedServer(fake.app) as upstream:
+        prepare_backend_env(
+            upstream.url,
+            LLM_MAX_CONCURRENCY=max(args.groups, 1),
+            MAX_CONVERSATION_HISTORY=args.burst * 4,
+            CONTEXT_TOKEN_BUDGET=0,
+        )
+        import main as backend
+
+        rows = []
+        with ThreadedServer(backend.app) as server:
+            for coalesce in (False, True):
+                backend.conversation_coordinator.coalesce = coalesce
+                label = "合并" if coalesce else "串行"
+                groups = [f"{label}_group{i}" for i in range(args.groups)]
+                calls_before = fake.calls
+                elapsed, results = asyncio.run(run(server.url, groups, args.burst, args.gap))
+                problems = []
+                for group in groups:
+                    problems += check_history(backend.conversation_store.build_context(group), group, args.burst)
+                replies = [r for group_results in results.values() for r in group_results]
+                rows.append((
+                    label,
+                    fake.calls - calls_before,
+                    sum(1 for r in replies if r.get("success")),
+                    sum(1 for r in replies if r.get("coalesced")),
+                    elapsed,
+                    problems,
+                ))
+
+    total = args.groups * args.burst
+    print(f"{args.groups}个群 x 每群{args.burst}条突发消息 = {total}个请求，单次调用延迟 {args.latency}s")
+    print(f"{'模式':<6}{'LLM调用':>10}{'成功':>8}{'被合并':>8}{'总耗时':>10}  顺序检查")
+    for label, calls, ok, coalesced, elapsed, problems in rows:
+        status = "通过" if not problems else f"失败({len(problems)})"
+        print(f"{label:<6}{calls:>10}{ok:>8}{coalesced:>8}{elapsed:>9.2f}s  {status}")
+        for problem in problems[:5]:
+            print(f"    {problem}")
+    serial_calls, coalesced_calls = rows[0][1], rows[1][1]
+    if coalesced_calls:
+        print(f"合并后LLM调用减少 {(1 - coalesced_calls / serial_calls) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""并发/chat压测：验证N个并发请求的总耗时接近单次调用而不是N倍
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_concurrent_chat --concurrency 16 --latency 1.0
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+from benchmarks.common import ThreadedServer, prepare_backend_env
+from benchmarks.fake_dashscope import FakeDashScope
+
+
+async def post_chat(session: aiohttp.ClientSession, url: str, index: int) -> dict:
+    payload = {
+        "user_id": f"user{index}",
+        "user_name": f"玩家{index}",
+        "message": "投个侦查",
+        "conversation_id": f"group_{index}",
+        "user_permission": 0,
+    }
+    async with session.post(url + "/chat", json=payload) as resp:
+        return await resp.json()
+
+
+async def probe_health(session: aiohttp.ClientSession, url: str) -> float:
+    start = time.perf_counter()
+    async with session.get(url + "/health") as resp:
+        await resp.read()
+    return time.perf_counter() - start
+
+
+async def run(url: str, concurrency: int):
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        start = time.perf_counter()
+        await post_chat(session, url, -1)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chats = asyncio.gather(*(post_chat(session, url, i) for i in range(concurrency)))
+        await asyncio.sleep(0.1)
+        health_latency = await probe_health(session, url)
+        results = await chats
+        elapsed = time.perf_counter() - start
+    return single, elapsed, health_latency, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=1.0, help="模拟DashScope单次调用延迟（秒）")
+    args = parser.parse_args()
+
+    fake = FakeDashScope(latency=args.latency)
+    with ThreadedServer(fake.app) as upstream:
+        prepare_backend_env(upstream.url, LLM_MAX_CONCURRENCY=max(args.concurrency, 1))
+        import main as backend
+
+        with ThreadedServer(backend.app) as server:
+            single, elapsed, health_latency, results = asyncio.run(run(server.url, args.concurrency))
+
+    ok = sum(1 for r in results if r.get("success"))
+    print(f"单次调用耗时:        {single:.3f}s")
+    print(f"{args.concurrency}个并发请求耗时:   {elapsed:.3f}s  (串行预期约 {single * args.concurrency:.3f}s)")
+    print(f"加速比:              {single * args.concurrency / elapsed:.1f}x")
+    print(f"压测期间/health延迟: {health_latency * 1000:.1f}ms")
+    print(f"成功: {ok}/{len(results)}  上游最大并发: {fake.max_concurrent}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""生成参数档位：自适应档位对短消息延迟与回复token数的影响
+
+模拟一局跑团中的混合流量：大量简短的闲聊/判定消息、少量要求描述场景的长消息和定时任务消息，
+所有消息同时发往不同会话。模拟上游按回复长度计时（主模型每秒token_rate个token，快速模型更快），
+闲聊的回复长度大多很短，但有一部分会"话多"；长消息的回复较长。比较三种配置：
+默认档位、自适应小预算、自适应小预算 + 快速模型，输出各类消息的客户端延迟、回复token数，
+以及后端 /conversations/stats 中按档位统计的延迟与token分布。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_generation_profiles --short 60 --long 15 --tasks 5
+"""
+import argparse
+import asyncio
+import random
+import time
+import zlib
+from typing import Dict, List
+
+import aiohttp
+
+from benchmarks.common import ThreadedServer, free_port, start_backend_process, stop_backend_process, wait_ready
+from benchmarks.fake_dashscope import NO_TASK_BLOCK, FakeDashScope
+from task_detection import TASK_START_MARKER
+
+MAIN_MODEL = "qwen-plus"
+FAST_MODEL = "qwen-turbo"
+SHORT_MESSAGES = ["哈哈哈这骰子太黑了", "KP我要过侦查", "我先躲到门后面", "有人吗？", "我们继续吧", "骰子给我一个大成功", "我看一眼窗外"]
+LONG_MESSAGE = "请详细描述一下我们推开地下室大门之后看到的景象，包括气味、声音和墙上的壁画，以及地上那具尸体的状态"
+TASK_MESSAGE = "每天早上8点提醒我吃药"
+FILLER = "油灯的光在潮湿的墙上投下摇晃的影子，远处传来若有若无的低语。"
+
+CONFIGS = (
+    ("默认档位", {"GENERATION_ADAPTIVE": "false"}),
+    ("自适应小预算", {"GENERATION_ADAPTIVE": "true", "GENERATION_PROFILES": "short:150"}),
+    ("自适应小预算 + 快速模型", {"GENERATION_ADAPTIVE": "true", "GENERATION_PROFILES": f"short:150::{FAST_MODEL}"}),
+)
+
+
+def reply_length(message: str) -> int:
+    """按消息内容确定回复长度，三种配置下同一条消息的"本来会写多长"保持一致"""
+    rng = random.Random(zlib.crc32(message.encode("utf-8")))
+    if len(message) > 30:
+        return rng.randint(400, 700)
+    # 闲聊：七成简短，三成话多
+    return rng.randint(20, 80) if rng.random() < 0.7 else rng.randint(200, 500)
+
+
+def build_reply(messages: List[Dict]) -> str:
+    last_user = next(m["content"] for m in reversed(messages) if m.get("role") == "user")
+    length = reply_length(last_user)
+    body = (FILLER * (length // len(FILLER) + 1))[:length]
+    if any(m.get("role") == "system" and TASK_START_MARKER in m.get("content", "") for m in messages):
+        return body + NO_TASK_BLOCK
+    return body
+
+
+async def run_traffic(url: str, args) -> Dict[str, List]:
+    plan = [("闲聊", f"{SHORT_MESSAGES[index % len(SHORT_MESSAGES)]}{index}") for index in range(args.short)]
+    plan += [("长描述", f"{LONG_MESSAGE}{index}") for index in range(args.long)]
+    plan += [("定时任务", TASK_MESSAGE) for _ in range(args.tasks)]
+    results: Dict[str, List] = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300)) as session:
+        async def send(index: int, kind: str, message: str):
+            start = time.perf_counter()
+            async with session.post(url + "/chat", json={
+                "user_id": f"player{index}", "user_name": "玩家", "message": message,
+                "conversation_id": f"group_{index}", "user_permission": 100
+            }) as resp:
+                body = await resp.json()
+            results.setdefault(kind, []).append((time.perf_counter() - start, len(body.get("reply", "")), body.get("success")))
+
+        await asyncio.gather(*(send(index, kind, message) for index, (kind, message) in enumerate(plan)))
+        async with session.get(url + "/conversations/stats") as resp:
+            generation = (await resp.json())["generation"]
+    return {"results": results, "generation": generation}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--short", type=int, default=60, help="闲聊消息数")
+    parser.add_argument("--long", type=int, default=15, help="要求描述场景的长消息数")
+    parser.add_argument("--tasks", type=int, default=5, help="定时任务消息数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟DashScope首包延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=100, help="主模型每秒生成的token数")
+    parser.add_argument("--fast-token-rate", type=float, default=300, help="快速模型每秒生成的token数")
+    args = parser.parse_args()
+
+    print(f"{args.short}条闲聊、{args.long}条长描述、{args.tasks}条定时任务同时发送；"
+          f"首包{args.latency}s，{MAIN_MODEL} {args.token_rate:.0f} token/s，{FAST_MODEL} {args.fast_token_rate:.0f} token/s")
+    for name, overrides in CONFIGS:
+        fake = FakeDashScope(
+            latency=args.latency, chunk_size=8, token_rate=args.token_rate,
+            model_token_rates={FAST_MODEL: args.fast_token_rate}
+        )
+        fake.build_reply = build_reply
+        with ThreadedServer(fake.app) as upstream:
+            port = free_port()
+            process = start_backend_process(
+                port, upstream.url, DASHSCOPE_MODEL=MAIN_MODEL, LLM_MAX_CONCURRENCY=128, RESPONSE_CACHE_ENABLED="false",
+                **overrides
+            )
+            url = f"http://127.0.0.1:{port}"
+            try:
+                asyncio.run(wait_ready(url))
+                outcome = asyncio.run(run_traffic(url, args))
+            finally:
+                stop_backend_process(process)
+
+        print()
+        print(f"[{name}] 上游截断 {fake.truncated} 次，各模型调用 {fake.model_calls}")
+        print(f"  {'消息类型':<10}{'成功':>6}{'p50(s)':>10}{'p95(s)':>10}{'平均回复字数':>14}")
+        for kind in ("闲聊", "长描述", "定时任务"):
+            rows = outcome["results"].get(kind, [])
+            if not rows:
+                continue
+            latencies = [elapsed for elapsed, _, _ in rows]
+            print(f"  {kind:<10}{sum(1 for row in rows if row[2]):>6}{percentile(latencies, 0.5):>10.2f}"
+                  f"{percentile(latencies, 0.95):>10.2f}{sum(length for _, length, _ in rows) / len(rows):>14.0f}")
+        print(f"  {'档位':<10}{'调用':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'平均token':>12}{'p95 token':>12}  选择原因")
+        for profile, entry in outcome["generation"]["profiles"].items():
+            if not entry.get("calls"):
+                continue
+            print(f"  {profile:<10}{entry['calls']:>6}{entry['latency_p50_ms']:>10.0f}{entry['latency_p95_ms']:>10.0f}"
+                  f"{entry['output_tokens_avg']:>12.0f}{entry['output_tokens_p95']:>12}  {entry['selected']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""对话历史持久化后端基准：写入吞吐与冷启动耗时
+
+对每种后端写入 N 个会话（每个会话若干条消息），测量：
+- 写入吞吐：请求路径入队耗时与后台落盘完成耗时
+- 冷启动：重新打开后端的耗时，以及随机加载活跃会话的单次延迟
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_history_backend --conversations 100000 --messages 6
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from history_backend import JsonlHistoryBackend, SQLiteHistoryBackend
+
+BACKENDS = {
+    "sqlite": lambda root: SQLiteHistoryBackend(os.path.join(root, "history.db")),
+    "jsonl": lambda root: JsonlHistoryBackend(os.path.join(root, "history_log")),
+}
+
+
+def bench(name: str, conversations: int, messages: int, samples: int):
+    root = tempfile.mkdtemp(prefix=f"sealdice-history-{name}-")
+    try:
+        backend = BACKENDS[name](root)
+        total = conversations * messages
+        start = time.perf_counter()
+        for i in range(messages):
+            role = "user" if i % 2 == 0 else "assistant"
+            for c in range(conversations):
+                backend.append(f"group_{c}", role, f"[用户 玩家{c}]: 第{i}条消息，投掷1d100=42，侦查成功。")
+        enqueue = time.perf_counter() - start
+        backend.flush()
+        durable = time.perf_counter() - start
+        backend.close()
+
+        start = time.perf_counter()
+        backend = BACKENDS[name](root)
+        open_time = time.perf_counter() - start
+        ids = random.sample(range(conversations), min(samples, conversations))
+        start = time.perf_counter()
+        for c in ids:
+            assert backend.load(f"group_{c}")
+        load_us = (time.perf_counter() - start) / len(ids) * 1e6
+        backend.close()
+        return total, enqueue, durable, open_time, load_us
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=6, help="每个会话的消息数")
+    parser.add_argument("--samples", type=int, default=1000, help="冷启动后随机加载的会话数")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    args = parser.parse_args()
+
+    print(f"{'后端':>6} | {'消息数':>9} {'入队 msg/s':>12} {'落盘 msg/s':>12} | {'冷启动 ms':>10} {'加载会话 us':>12}")
+    for name in args.backends:
+        total, enqueue, durable, open_time, load_us = bench(name, args.conversations, args.messages, args.samples)
+        print(f"{name:>6} | {total:>9} {total / enqueue:>12.0f} {total / durable:>12.0f} | {open_time * 1000:>10.1f} {load_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""LLM调用的重试、熔断与备用模型：对注入故障的模拟DashScope比较不同配置下的成功率与失败耗时
+
+场景：
+- 临时故障：主模型按--error-rate随机返回503，比较不重试与重试时的成功率
+- 主模型宕机：主模型全部返回503，比较不熔断（每个请求都要等重试失败）、熔断（快速失败）与备用模型
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_llm_resilience --requests 200 --error-rate 0.3
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+from benchmarks.common import ThreadedServer, prepare_backend_env
+from benchmarks.fake_dashscope import FakeDashScope
+
+PRIMARY_MODEL = "qwen-plus"
+FALLBACK_MODEL = "qwen-turbo"
+MESSAGES = [{"role": "user", "content": "帮我投一个侦查"}]
+
+
+async def run_scenario(client_kwargs: Dict, requests: int, concurrency: int) -> Dict:
+    from llm_client import LLMClient
+
+    client = LLMClient(max_concurrency=concurrency, timeout=30, **client_kwargs)
+    ok_latencies: List[float] = []
+    failed_latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.generate(MESSAGES, model=PRIMARY_MODEL)
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            (ok_latencies if ok else failed_latencies).append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    stats = client.stats()
+    breaker = stats["breakers"].get(PRIMARY_MODEL, {})
+    return {
+        "success_rate": len(ok_latencies) / requests,
+        "ok_ms": sum(ok_latencies) / len(ok_latencies) * 1000 if ok_latencies else None,
+        "failed_ms": sum(failed_latencies) / len(failed_latencies) * 1000 if failed_latencies else None,
+        "retries": stats["retries"],
+        "fallbacks": stats["fallbacks"],
+        "rejections": breaker.get("rejections", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1, help="模拟DashScope首包延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.3, help="临时故障场景下主模型的错误率")
+    args = parser.parse_args()
+
+    retry = {"retry_attempts": 2, "retry_base_delay": 0.05, "retry_max_delay": 0.5}
+    transient = [
+        ("不重试", {}),
+        ("重试2次", retry),
+    ]
+    outage = [
+        ("重试、不熔断", retry),
+        ("重试 + 熔断", dict(retry, breaker_failure_threshold=5, breaker_reset_timeout=60)),
+        ("重试 + 熔断 + 备用模型", dict(retry, breaker_failure_threshold=5, breaker_reset_timeout=60,
+                                     fallback_models=[FALLBACK_MODEL])),
+    ]
+
+    rows = []
+    for scenario, error_rate, configs in (("临时故障", args.error_rate, transient), ("主模型宕机", 1.0, outage)):
+        for name, kwargs in configs:
+            fake = FakeDashScope(
+                latency=args.latency, chunk_interval=0, error_rate=error_rate, error_status=503,
+                error_models={PRIMARY_MODEL}, seed=1
+            )
+            with ThreadedServer(fake.app) as upstream:
+                prepare_backend_env(upstream.url)
+                # config只在首次导入时读取环境变量，之后的场景直接修改DashScope的接口地址
+                import dashscope
+                dashscope.api_key = "fake-key"
+                dashscope.base_http_api_url = upstream.url + "/api/v1"
+                result = asyncio.run(run_scenario(kwargs, args.requests, args.concurrency))
+            result["upstream_calls"] = fake.calls
+            rows.append((scenario, name, result))
+
+    print(f"{args.requests}个请求，并发{args.concurrency}，上游延迟{args.latency}s，临时故障错误率{args.error_rate:.0%}")
+    print(f"{'场景':<10}{'配置':<24}{'成功率':>8}{'成功耗时(ms)':>14}{'失败耗时(ms)':>14}"
+          f"{'重试':>6}{'切换':>6}{'熔断拒绝':>10}{'上游调用':>10}")
+    for scenario, name, r in rows:
+        ok_ms = f"{r['ok_ms']:.1f}" if r["ok_ms"] is not None else "-"
+        failed_ms = f"{r['failed_ms']:.1f}" if r["failed_ms"] is not None else "-"
+        print(f"{scenario:<10}{name:<24}{r['success_rate']:>8.1%}{ok_ms:>14}{failed_ms:>14}"
+              f"{r['retries']:>6}{r['fallbacks']:>6}{r['rejections']:>10}{r['upstream_calls']:>10}")
+
+
+if __name__ == "__main__":
+    main()
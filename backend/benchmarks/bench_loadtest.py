@@ -0,0 +1,318 @@
+"""群聊流量负载测试：按泊松到达的开环流量混合请求/chat、/characters/set、/clear_history
+
+后端以子进程（serve.py）运行在临时目录中，上游为本地模拟DashScope（可配置首包延迟、生成速度和错误注入）。
+群的活跃度按Zipf分布，少数群贡献大部分消息，消息内容取自benchmarks/chat_log_sample.jsonl。
+延迟从计划发送时刻算起，后端排队不会因压测端等待而被低估。
+
+结果（各接口p50/p95/p99延迟、吞吐、错误数、按时间采样的RSS）写入JSON文件，
+用--compare与之前某次提交的结果对比。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_loadtest --duration 30 --rate 20
+    uv run python -m benchmarks.bench_loadtest --error-rate 0.05 --env RESPONSE_CACHE_ENABLED=true
+    uv run python -m benchmarks.bench_loadtest --compare benchmarks/results/loadtest-abc1234.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.common import (
+    BACKEND_DIR, ThreadedServer, free_port_block, start_backend_process, stop_backend_process, wait_ready
+)
+from benchmarks.fake_dashscope import FakeDashScope
+
+DEFAULT_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_log_sample.jsonl")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_MIX = "chat=0.9,set_character=0.04,clear_history=0.06"
+# 压测开始前添加的角色，/characters/set在它和default之间切换
+EXTRA_CHARACTER = ("kp", "你是这场克苏鲁的呼唤跑团的守秘人，描述简洁而阴森。")
+USERS_PER_GROUP = 8
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"chat", "set_character", "clear_history"}
+    if unknown:
+        raise ValueError(f"未知的请求类型: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """最近秩百分位数"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """进程及其子进程（多worker）的RSS之和（字节），非Linux返回None"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for tid in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{tid}/children", "r") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR, capture_output=True, text=True
+        ).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class TrafficGenerator:
+    """按配置的混合比例生成请求：(类型, 路径, 请求体)"""
+
+    def __init__(self, mix: Dict[str, float], groups: int, messages: List[str], seed: int):
+        self.rng = random.Random(seed)
+        self.kinds = list(mix)
+        self.kind_weights = [mix[kind] for kind in self.kinds]
+        self.groups = [f"group_{index}" for index in range(groups)]
+        self.group_weights = [1 / (rank + 1) for rank in range(groups)]
+        self.messages = messages
+
+    def next(self):
+        kind = self.rng.choices(self.kinds, self.kind_weights)[0]
+        group = self.rng.choices(self.groups, self.group_weights)[0]
+        if kind == "chat":
+            user = self.rng.randrange(USERS_PER_GROUP)
+            return kind, "/chat", {
+                "user_id": f"{group}_user{user}",
+                "user_name": f"玩家{user}",
+                "message": self.rng.choice(self.messages),
+                "conversation_id": group,
+                "user_permission": 0,
+            }
+        if kind == "set_character":
+            character = self.rng.choice(["default", EXTRA_CHARACTER[0]])
+            return kind, "/characters/set", {"character_name": character, "conversation_id": group}
+        return kind, "/clear_history", {"conversation_id": group}
+
+
+async def send(session: aiohttp.ClientSession, url: str, kind: str, path: str, payload: Dict,
+               scheduled: float, results: Dict[str, List]):
+    ok = False
+    try:
+        async with session.post(url + path, json=payload) as resp:
+            body = await resp.json(content_type=None)
+            ok = resp.status == 200 and bool(body.get("success"))
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        pass
+    results[kind].append((time.perf_counter() - scheduled, ok))
+
+
+async def sample_rss(pid: int, started: float, interval: float, results: Dict[str, List],
+                     timeline: List[Dict], stop: asyncio.Event):
+    while True:
+        rss = process_tree_rss(pid)
+        timeline.append({
+            "t": round(time.perf_counter() - started, 2),
+            "rss_mb": round(rss / 1024 / 1024, 1) if rss is not None else None,
+            "completed": sum(len(values) for values in results.values()),
+        })
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(url: str, pid: int, generator: TrafficGenerator, args) -> Dict:
+    results: Dict[str, List] = defaultdict(list)
+    timeline: List[Dict] = []
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        async with session.post(url + "/characters/add", json={
+            "character_name": EXTRA_CHARACTER[0], "character_description": EXTRA_CHARACTER[1]
+        }) as resp:
+            await resp.read()
+
+        stop = asyncio.Event()
+        started = time.perf_counter()
+        sampler = asyncio.create_task(sample_rss(pid, started, args.sample_interval, results, timeline, stop))
+        tasks = []
+        scheduled = started
+        deadline = started + args.duration
+        while True:
+            scheduled += generator.rng.expovariate(args.rate)
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind, path, payload = generator.next()
+            tasks.append(asyncio.create_task(send(session, url, kind, path, payload, scheduled, results)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+        async with session.get(url + "/conversations/stats") as resp:
+            backend_stats = await resp.json()
+    return {"results": results, "timeline": timeline, "elapsed": elapsed, "backend_stats": backend_stats}
+
+
+def summarize(run: Dict, args, upstream: Dict) -> Dict:
+    endpoints = {}
+    total = errors = 0
+    for kind, values in sorted(run["results"].items()):
+        latencies = sorted(latency for latency, _ in values)
+        failed = sum(1 for _, ok in values if not ok)
+        total += len(values)
+        errors += failed
+        endpoints[kind] = {
+            "count": len(values),
+            "errors": failed,
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1),
+        }
+    rss = [sample["rss_mb"] for sample in run["timeline"] if sample["rss_mb"] is not None]
+    return {
+        "benchmark": "loadtest",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "summary": {
+            "requests": total,
+            "errors": errors,
+            "elapsed_s": round(run["elapsed"], 2),
+            "throughput_rps": round(total / run["elapsed"], 2),
+        },
+        "endpoints": endpoints,
+        "rss_mb": {"start": rss[0], "peak": max(rss), "end": rss[-1]} if rss else None,
+        "timeline": run["timeline"],
+        "upstream": upstream,
+        "backend_stats": run["backend_stats"],
+    }
+
+
+def flatten(report: Dict) -> Dict[str, float]:
+    """用于对比的指标"""
+    metrics = {"throughput_rps": report["summary"]["throughput_rps"], "errors": report["summary"]["errors"]}
+    for kind, values in report["endpoints"].items():
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            metrics[f"{kind}.{key}"] = values[key]
+    if report.get("rss_mb"):
+        metrics["rss_peak_mb"] = report["rss_mb"]["peak"]
+    return metrics
+
+
+def print_report(report: Dict):
+    summary = report["summary"]
+    params = report["params"]
+    print(f"提交 {report['commit']}：{params['duration']}s，目标{params['rate']} req/s，{params['groups']}个群，"
+          f"上游延迟{params['latency']}s，错误注入{params['error_rate']:.0%}")
+    print(f"完成{summary['requests']}个请求，失败{summary['errors']}，吞吐{summary['throughput_rps']} req/s")
+    print(f"{'接口':<16}{'请求数':>8}{'失败':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for kind, values in report["endpoints"].items():
+        print(f"{kind:<16}{values['count']:>8}{values['errors']:>6}{values['p50_ms']:>10}"
+              f"{values['p95_ms']:>10}{values['p99_ms']:>10}{values['max_ms']:>10}")
+    if report["rss_mb"]:
+        rss = report["rss_mb"]
+        print(f"RSS：开始{rss['start']}MB，峰值{rss['peak']}MB，结束{rss['end']}MB")
+
+
+def print_comparison(baseline: Dict, report: Dict):
+    before, after = flatten(baseline), flatten(report)
+    print(f"\n对比基线 {baseline['commit']}（{baseline['timestamp']}）")
+    print(f"{'指标':<28}{'基线':>12}{'本次':>12}{'变化':>10}")
+    for key in sorted(set(before) | set(after)):
+        old, new = before.get(key), after.get(key)
+        change = f"{(new - old) / old:+.1%}" if old and new is not None else "-"
+        print(f"{key:<28}{str(old):>12}{str(new):>12}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="发送请求的时长（秒）")
+    parser.add_argument("--rate", type=float, default=20, help="平均到达速率（req/s）")
+    parser.add_argument("--groups", type=int, default=40, help="群（会话）数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="请求类型比例")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟DashScope首包延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=80, help="模拟DashScope每秒生成的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="上游注入错误的概率")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的HTTP状态码（如429）")
+    parser.add_argument("--workers", type=int, default=1, help="后端worker数（>1时使用SQLite共享状态）")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="传给后端的额外环境变量")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="RSS采样间隔（秒）")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log", default=DEFAULT_LOG, help="消息内容来源（JSONL聊天记录）")
+    parser.add_argument("--output", help="结果文件，默认 benchmarks/results/loadtest-<提交>.json")
+    parser.add_argument("--compare", help="用于对比的基线结果文件")
+    args = parser.parse_args()
+
+    with open(args.log, "r", encoding="utf-8") as f:
+        messages = [json.loads(line)["message"] for line in f if line.strip()]
+    generator = TrafficGenerator(parse_mix(args.mix), args.groups, messages, args.seed)
+    overrides = dict(item.split("=", 1) for item in args.env)
+    if args.workers > 1:
+        overrides.setdefault("SHARED_STATE", "sqlite")
+
+    fake = FakeDashScope(
+        latency=args.latency, token_rate=args.token_rate, error_rate=args.error_rate,
+        error_status=args.error_status, seed=args.seed
+    )
+    with ThreadedServer(fake.app) as upstream:
+        port = free_port_block(args.workers + 1)
+        url = f"http://127.0.0.1:{port}"
+        process = start_backend_process(port, upstream.url, WORKERS=args.workers, **overrides)
+        try:
+            asyncio.run(wait_ready(url))
+            run = asyncio.run(run_load(url, process.pid, generator, args))
+        finally:
+            stop_backend_process(process)
+        report = summarize(run, args, fake.stats())
+
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_report(report)
+    print(f"结果已写入 {output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""指标埋点开销：一次/chat请求经过的全部记录点（各阶段计时、token、HTTP请求）在开启/关闭指标时的耗时
+
+不经过HTTP，只测量埋点本身，与一次LLM调用（通常数百毫秒）相比应可忽略。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_metrics_overhead --requests 200000
+"""
+import argparse
+import time
+
+from metrics import Metrics
+
+# /chat非流式路径上的计时阶段（character_lookup只在新会话出现，这里按每次都有计算）
+CHAT_STAGES = ("validate", "character_lookup", "history", "cache_lookup", "llm_call", "parse_task_info", "finish")
+
+
+def simulate_request(metrics: Metrics):
+    for stage in CHAT_STAGES:
+        with metrics.stage(stage):
+            pass
+    metrics.record_tokens("default", 300, 60)
+    metrics.record_request("POST", "/chat", 200, 0.5)
+
+
+def baseline():
+    for stage in CHAT_STAGES:
+        pass
+
+
+def measure(func, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        func()
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200000)
+    args = parser.parse_args()
+
+    disabled = Metrics(enabled=False)
+    enabled = Metrics(enabled=True)
+    base = measure(baseline, args.requests)
+    off = measure(lambda: simulate_request(disabled), args.requests)
+    on = measure(lambda: simulate_request(enabled), args.requests)
+
+    start = time.perf_counter()
+    text = enabled.render()
+    render_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{args.requests}次模拟请求，每次{len(CHAT_STAGES)}个计时阶段")
+    print(f"{'模式':<10}{'每请求耗时(µs)':>16}{'相对基线(µs)':>16}")
+    print(f"{'无埋点':<10}{base * 1e6:>16.3f}{0:>16.3f}")
+    print(f"{'指标关闭':<10}{off * 1e6:>16.3f}{(off - base) * 1e6:>16.3f}")
+    print(f"{'指标开启':<10}{on * 1e6:>16.3f}{(on - base) * 1e6:>16.3f}")
+    print(f"/metrics渲染：{render_ms:.2f}ms，{len(text.splitlines())}行")
+
+
+if __name__ == "__main__":
+    main()
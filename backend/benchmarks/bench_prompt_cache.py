@@ -0,0 +1,113 @@
+"""角色前缀缓存：大量使用同一角色的会话下，系统消息的内存占用与每次请求的前缀开销
+
+场景：
+- 恢复会话：会话从SQLite历史后端加载（重启后、被内存上限淘汰后再次访问、多worker共享状态），
+  不使用缓存时每个会话各自保存一份角色描述，使用缓存时共用同一个编译好的前缀
+- 新建会话：为新会话写入系统消息，不使用缓存时每次都要计算一遍角色描述的token数
+- 任务检测：附加任务检测提示词的调用，不使用缓存时每次拼接一遍完整的系统消息
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_prompt_cache --conversations 5000 --description-chars 3000
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from conversation_store import ConversationStore
+from history_backend import SQLiteHistoryBackend
+from prompt_cache import PromptCache, prompt_digest
+from task_detection import TASK_DETECTION_SYSTEM_PROMPT
+from tokenizer import estimate_tokens
+
+PARAGRAPH = "你是一名经验丰富的克苏鲁的呼唤守秘人，擅长营造恐怖氛围，描述场景时注重细节与线索，判定前会说明所需技能。"
+
+
+def make_store(backend, cache):
+    return ConversationStore(max_history=20, backend=backend, prompt_cache=cache)
+
+
+def bench_restore(path: str, conversations: int, description: str, use_cache: bool):
+    backend = SQLiteHistoryBackend(path, flush_interval=0.05, batch_size=1024)
+    cache = PromptCache(estimate_tokens) if use_cache else None
+    if cache is not None:
+        cache.get("kp", prompt_digest(description), description)
+    store = make_store(backend, cache)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for index in range(conversations):
+        store.has_messages(f"group_{index}")
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    approx_bytes = store.stats()["approx_bytes"]
+    store.close()
+    return current, approx_bytes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=5000)
+    parser.add_argument("--description-chars", type=int, default=3000, help="角色描述的字符数")
+    parser.add_argument("--messages", type=int, default=4, help="每个会话中的对话消息数")
+    args = parser.parse_args()
+
+    description = (PARAGRAPH * (args.description_chars // len(PARAGRAPH) + 1))[:args.description_chars]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.db")
+        writer = make_store(SQLiteHistoryBackend(path, flush_interval=0.05, batch_size=1024), None)
+        for index in range(args.conversations):
+            conversation_id = f"group_{index}"
+            writer.add_message(conversation_id, "system", description)
+            for turn in range(args.messages):
+                role = "user" if turn % 2 == 0 else "assistant"
+                writer.add_message(conversation_id, role, f"第{turn}条消息：我对房间进行侦查")
+        writer.close()
+
+        restore = {use_cache: bench_restore(path, args.conversations, description, use_cache)
+                   for use_cache in (False, True)}
+
+    iterations = 20000
+    # 新建会话：写入系统消息（含token计数）
+    plain = make_store(None, None)
+    start = time.perf_counter()
+    for index in range(iterations):
+        plain.add_message(f"new_{index}", "system", description)
+    plain_new_us = (time.perf_counter() - start) / iterations * 1e6
+
+    cache = PromptCache(estimate_tokens)
+    cached = make_store(None, cache)
+    digest = prompt_digest(description)
+    start = time.perf_counter()
+    for index in range(iterations):
+        cached.add_message(f"new_{index}", "system", cache.get("kp", digest, description).content)
+    cached_new_us = (time.perf_counter() - start) / iterations * 1e6
+
+    # 任务检测：附加任务检测提示词组装上下文
+    for store in (plain, cached):
+        store.add_message("new_0", "user", "每天早上8点提醒我吃药")
+    timings = {}
+    for name, store in (("plain", plain), ("cached", cached)):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            store.build_context("new_0", extra_system=TASK_DETECTION_SYSTEM_PROMPT)
+        timings[name] = (time.perf_counter() - start) / iterations * 1e6
+
+    print(f"{args.conversations}个会话使用同一角色，角色描述{len(description)}字符，每个会话{args.messages}条对话消息")
+    print(f"{'恢复会话':<14}{'实际内存(MB)':>14}{'估算占用(MB)':>14}{'加载耗时':>10}")
+    for use_cache, label in ((False, "不使用缓存"), (True, "角色前缀缓存")):
+        current, approx_bytes, elapsed = restore[use_cache]
+        print(f"{label:<14}{current / 1e6:>14.2f}{approx_bytes / 1e6:>14.2f}{elapsed:>9.2f}s")
+    saved = restore[False][0] - restore[True][0]
+    print(f"节省内存: {saved / 1e6:.2f}MB（每个会话约{saved / args.conversations / 1024:.1f}KB）")
+    print(f"{'每次操作(µs)':<14}{'不使用缓存':>12}{'角色前缀缓存':>14}")
+    print(f"{'新建会话':<14}{plain_new_us:>12.2f}{cached_new_us:>14.2f}")
+    print(f"{'任务检测上下文':<14}{timings['plain']:>12.2f}{timings['cached']:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
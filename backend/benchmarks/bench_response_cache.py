@@ -0,0 +1,99 @@
+"""回复缓存：回放聊天记录，对比开启/关闭缓存时的LLM调用次数、命中率与延迟
+
+聊天记录为JSONL，每行包含conversation_id、user_id、user_name、message，同一会话内按顺序回放，
+不同会话并行回放。默认使用benchmarks/chat_log_sample.jsonl（跑团群常见的重复提问与行动描述混合）。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_response_cache --latency 0.3
+    uv run python -m benchmarks.bench_response_cache --log path/to/chat_log.jsonl --context-messages 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import aiohttp
+
+from benchmarks.common import ThreadedServer, prepare_backend_env
+from benchmarks.fake_dashscope import FakeDashScope
+
+DEFAULT_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_log_sample.jsonl")
+
+
+def load_log(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def replay_conversation(session: aiohttp.ClientSession, url: str, prefix: str, records: List[Dict]) -> List[tuple]:
+    results = []
+    for record in records:
+        payload = dict(record, conversation_id=prefix + record["conversation_id"], user_permission=0)
+        start = time.perf_counter()
+        async with session.post(url + "/chat", json=payload) as resp:
+            body = await resp.json()
+        assert body["success"], body
+        results.append((time.perf_counter() - start, body.get("cached", False)))
+    return results
+
+
+async def replay(url: str, prefix: str, records: List[Dict]) -> List[tuple]:
+    by_conversation = defaultdict(list)
+    for record in records:
+        by_conversation[record["conversation_id"]].append(record)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        groups = await asyncio.gather(*(
+            replay_conversation(session, url, prefix, items) for items in by_conversation.values()
+        ))
+    return [result for group in groups for result in group]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--log", default=DEFAULT_LOG, help="聊天记录JSONL文件")
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟DashScope单次调用延迟（秒）")
+    parser.add_argument("--context-messages", type=int, default=1, help="参与缓存键的上文消息条数")
+    args = parser.parse_args()
+
+    records = load_log(args.log)
+    fake = FakeDashScope(latency=args.latency)
+    with ThreadedServer(fake.app) as upstream:
+        prepare_backend_env(
+            upstream.url,
+            RESPONSE_CACHE_ENABLED="true",
+            RESPONSE_CACHE_CONTEXT_MESSAGES=args.context_messages,
+        )
+        import main as backend
+
+        cache = backend.response_cache
+        rows = []
+        with ThreadedServer(backend.app) as server:
+            for label, enabled in (("关闭缓存", False), ("开启缓存", True)):
+                backend.response_cache = cache if enabled else None
+                calls_before = fake.calls
+                start = time.perf_counter()
+                results = asyncio.run(replay(server.url, label, records))
+                elapsed = time.perf_counter() - start
+                latencies = [latency for latency, _ in results]
+                hit_latencies = [latency for latency, cached in results if cached]
+                rows.append((label, fake.calls - calls_before, sum(1 for _, cached in results if cached),
+                             statistics.mean(latencies), statistics.median(latencies), elapsed, hit_latencies))
+
+    print(f"回放 {len(records)} 条消息（{args.log}），单次调用延迟 {args.latency}s，上文条数 {args.context_messages}")
+    print(f"{'模式':<8}{'LLM调用':>8}{'缓存命中':>10}{'平均延迟':>12}{'p50延迟':>12}{'总耗时':>10}")
+    for label, calls, hits, mean_latency, p50, elapsed, _ in rows:
+        print(f"{label:<8}{calls:>8}{hits:>10}{mean_latency * 1000:>10.0f}ms{p50 * 1000:>10.0f}ms{elapsed:>9.1f}s")
+    (_, base_calls, _, base_mean, _, _, _), (_, calls, hits, mean_latency, _, _, hit_latencies) = rows
+    print(f"命中率 {hits / len(records) * 100:.1f}%，LLM调用减少 {(1 - calls / base_calls) * 100:.0f}%，"
+          f"平均延迟降低 {(base_mean - mean_latency) * 1000:.0f}ms")
+    if hit_latencies:
+        print(f"命中请求平均延迟 {statistics.mean(hit_latencies) * 1000:.1f}ms")
+    print(f"缓存统计: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""会话快照：大量会话的导出/导入耗时、快照大小与内存峰值
+
+与一次性生成整个JSON响应的做法对比：后者需要把全部会话同时放进内存，
+流式快照的额外内存只与单个会话和压缩缓冲区有关。
+内存为tracemalloc统计的Python分配：导出为导出期间的峰值，导入为峰值减去导入完成后存储本身的占用。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_snapshot --conversations 100000 --messages 6
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from character_registry import CharacterRegistry
+from conversation_store import ConversationStore
+from history_backend import SQLiteHistoryBackend
+from prompt_cache import PromptCache, prompt_digest
+from snapshot import export_snapshot, import_snapshot
+from tokenizer import estimate_tokens
+
+DESCRIPTION = "你是一名经验丰富的克苏鲁的呼唤守秘人，擅长营造恐怖氛围，描述场景时注重细节与线索。" * 8
+READ_CHUNK = 64 * 1024
+
+
+def make_store(backend=None) -> ConversationStore:
+    cache = PromptCache(estimate_tokens)
+    cache.get("kp", prompt_digest(DESCRIPTION), DESCRIPTION)
+    return ConversationStore(max_history=20, backend=backend, prompt_cache=cache)
+
+
+def build(conversations: int, messages: int, workdir: str):
+    store = make_store()
+    registry = CharacterRegistry(os.path.join(workdir, "characters.json"), DESCRIPTION, save_delay=3600)
+    registry.add_character("kp", DESCRIPTION)
+    assignments = {}
+    for index in range(conversations):
+        conversation_id = f"group_{index}"
+        store.add_message(conversation_id, "system", DESCRIPTION)
+        for turn in range(messages):
+            if turn % 2 == 0:
+                store.add_message(conversation_id, "user", f"[用户 玩家{index % 97}({index})]: 我对第{turn}个房间进行侦查")
+            else:
+                store.add_message(conversation_id, "assistant", f"你在房间里发现了一本旧日记，第{index % 13}页上写着奇怪的符号。")
+        if index % 5 == 0:
+            assignments[conversation_id] = "kp"
+    registry.import_data({}, assignments)
+    return store, registry
+
+
+async def write_snapshot(store, registry, path: str) -> int:
+    size = 0
+    with open(path, "wb") as f:
+        async for chunk in export_snapshot(store, registry):
+            f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+async def read_chunks(path: str):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+def traced(func):
+    """执行func，返回(结果, 耗时, 峰值内存, 结束时内存)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak, current
+
+
+def timed(func):
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def json_dump(store, registry) -> int:
+    """对照：一次性生成包含全部会话的JSON响应"""
+    body = json.dumps({
+        "characters": registry.get_characters(),
+        "session_characters": registry.get_session_characters(),
+        "conversations": {cid: store.export_conversation(cid) for cid in store.conversation_ids()},
+    }, ensure_ascii=False).encode("utf-8")
+    return len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=6, help="每个会话的对话消息数（不含系统消息）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        store, registry = build(args.conversations, args.messages, workdir)
+        print(f"构造{args.conversations}个会话（每个{args.messages}条消息 + 系统消息）: {time.perf_counter() - start:.1f}s，"
+              f"存储估算占用 {store.stats()['approx_bytes'] / 1e6:.0f}MB")
+        path = os.path.join(workdir, "conversations.snapshot.gz")
+
+        size, export_s = timed(lambda: asyncio.run(write_snapshot(store, registry, path)))
+        _, _, export_peak, _ = traced(lambda: asyncio.run(write_snapshot(store, registry, path)))
+        json_size, json_s = timed(lambda: json_dump(store, registry))
+        _, _, json_peak, _ = traced(lambda: json_dump(store, registry))
+
+        def restore(backend=None):
+            target = make_store(backend)
+            target_registry = CharacterRegistry(os.path.join(workdir, "restored.json"), DESCRIPTION, save_delay=3600)
+            counts = asyncio.run(import_snapshot(target, target_registry, read_chunks(path)))
+            if backend is not None:
+                backend.flush()
+            return target, counts
+
+        (restored, counts), import_s = timed(restore)
+        assert counts["conversations"] == args.conversations, counts
+        assert restored.export_conversation("group_1") == store.export_conversation("group_1")
+        del restored
+        _, _, import_peak, import_current = traced(restore)
+
+        sqlite_path = os.path.join(workdir, "history.db")
+        sqlite_backend = SQLiteHistoryBackend(sqlite_path, flush_interval=0.05, batch_size=1024)
+        (sqlite_store, _), sqlite_s = timed(lambda: restore(sqlite_backend))
+        sqlite_store.close()
+
+    per_conversation = size / args.conversations
+    print(f"{'方式':<22}{'耗时(s)':>10}{'大小(MB)':>10}{'内存峰值(MB)':>14}")
+    print(f"{'流式快照导出':<22}{export_s:>10.2f}{size / 1e6:>10.1f}{export_peak / 1e6:>14.1f}")
+    print(f"{'一次性JSON（对照）':<22}{json_s:>10.2f}{json_size / 1e6:>10.1f}{json_peak / 1e6:>14.1f}")
+    print(f"{'导入到内存存储':<22}{import_s:>10.2f}{'':>10}{(import_peak - import_current) / 1e6:>14.1f}")
+    print(f"{'导入到SQLite后端':<22}{sqlite_s:>10.2f}")
+    print(f"快照每个会话约{per_conversation:.0f}字节，压缩率 {size / json_size:.1%}（相对JSON），"
+          f"导出 {args.conversations / export_s:.0f} 会话/s，导入 {args.conversations / import_s:.0f} 会话/s")
+
+
+if __name__ == "__main__":
+    main()
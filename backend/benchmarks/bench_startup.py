@@ -0,0 +1,118 @@
+"""启动耗时：导入main的耗时分布，以及从启动进程到/health存活、/health/ready就绪、第一条聊天回复的时间
+
+导入耗时通过 python -X importtime 统计，列出main及几个较重的依赖的累计导入时间；
+启动时间以子进程运行serve.py（上游为模拟DashScope），每隔10ms轮询一次，多次运行取中位数。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.common import BACKEND_DIR, ThreadedServer, free_port, start_backend_process, stop_backend_process
+from benchmarks.fake_dashscope import FakeDashScope
+
+# 关注的模块（importtime中的顶层包名）
+WATCHED_MODULES = ("main", "fastapi", "pydantic", "dashscope", "aiohttp", "dotenv", "llm_client", "task_detection")
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def profile_imports(runs: int):
+    """多次以 -X importtime 导入main，返回各模块累计导入耗时（ms）的中位数和进程总耗时"""
+    samples = {name: [] for name in WATCHED_MODULES}
+    wall = []
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, DASHSCOPE_API_KEY="fake-key")
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", "import main"],
+                cwd=workdir, env=env, capture_output=True, text=True, check=True
+            )
+            wall.append(time.perf_counter() - start)
+        seen = {}
+        for line in result.stderr.splitlines():
+            match = IMPORT_LINE.match(line)
+            if match and match.group(4) in samples:
+                # 同一个模块只会真正导入一次，取出现的那一行
+                seen[match.group(4)] = int(match.group(2)) / 1000
+        for name in WATCHED_MODULES:
+            samples[name].append(seen.get(name, 0.0))
+    return {name: statistics.median(values) for name, values in samples.items()}, statistics.median(wall)
+
+
+async def time_startup(port: int, upstream_url: str):
+    """启动后端进程，返回(存活耗时, 就绪耗时, 第一条回复耗时, 第二条回复耗时)"""
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = start_backend_process(port, upstream_url)
+    live = ready = None
+    try:
+        async with aiohttp.ClientSession() as session:
+            while ready is None:
+                if time.perf_counter() - started > 60:
+                    raise RuntimeError("后端启动超时")
+                try:
+                    if live is None:
+                        async with session.get(url + "/health") as resp:
+                            if resp.status == 200:
+                                live = time.perf_counter() - started
+                    if live is not None:
+                        async with session.get(url + "/health/ready") as resp:
+                            if resp.status == 200:
+                                ready = time.perf_counter() - started
+                except aiohttp.ClientError:
+                    pass
+                if ready is None:
+                    await asyncio.sleep(0.01)
+
+            replies = []
+            for index in range(2):
+                begin = time.perf_counter()
+                async with session.post(url + "/chat", json={
+                    "user_id": "player", "user_name": "玩家", "message": f"我对房间进行侦查{index}",
+                    "conversation_id": "startup_group"
+                }) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        raise RuntimeError(f"聊天请求失败: HTTP {resp.status}")
+                replies.append(time.perf_counter() - begin)
+    finally:
+        stop_backend_process(process)
+    return live, ready, replies[0], replies[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    imports, wall = profile_imports(args.runs)
+    print(f"导入main（{args.runs}次中位数，含解释器启动的进程总耗时 {wall * 1000:.0f}ms）")
+    for name in WATCHED_MODULES:
+        print(f"  {name:<16}{imports[name]:>8.1f}ms")
+    print()
+
+    fake = FakeDashScope(latency=0, chunk_interval=0)
+    samples = []
+    with ThreadedServer(fake.app) as upstream:
+        for _ in range(args.runs):
+            samples.append(asyncio.run(time_startup(free_port(), upstream.url)))
+
+    print(f"启动serve.py（{args.runs}次中位数，上游无延迟）")
+    labels = ("/health 存活", "/health/ready 就绪", "第一条回复", "第二条回复")
+    for index, label in enumerate(labels):
+        print(f"  {label:<18}{statistics.median(sample[index] for sample in samples) * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
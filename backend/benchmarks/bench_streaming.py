@@ -0,0 +1,90 @@
+"""流式接口首字延迟：对比/chat（等待完整回复）与/chat/stream（SSE）的用户可见延迟
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_streaming --requests 20 --latency 0.5 --chunk-interval 0.05
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+from benchmarks.common import ThreadedServer, prepare_backend_env
+from benchmarks.fake_dashscope import FakeDashScope
+
+LONG_REPLY = "你们沿着潮湿的石阶走进地下室，油灯的光在墙上投下摇晃的影子。" * 6
+
+
+def payload(index: int) -> dict:
+    return {"user_id": f"user{index}", "user_name": f"玩家{index}", "message": "描述一下地下室", "conversation_id": f"group_{index}"}
+
+
+async def measure_chat(session, url: str, index: int) -> float:
+    start = time.perf_counter()
+    async with session.post(url + "/chat", json=payload(index)) as resp:
+        body = await resp.json()
+    assert body["success"], body
+    return time.perf_counter() - start
+
+
+async def measure_stream(session, url: str, index: int):
+    start = time.perf_counter()
+    ttft = None
+    text = ""
+    done = None
+    async with session.post(url + "/chat/stream", json=payload(index)) as resp:
+        event = None
+        async for raw in resp.content:
+            line = raw.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "delta":
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    text += data["text"]
+                elif event == "done":
+                    done = data
+                elif event == "error":
+                    raise RuntimeError(data)
+    total = time.perf_counter() - start
+    assert done is not None and text == done["reply"], "流式正文与最终回复不一致"
+    assert "TASK_DETECTION" not in text, "任务检测块泄露到流式输出"
+    return ttft, total
+
+
+async def run(url: str, requests: int):
+    async with aiohttp.ClientSession() as session:
+        chat = [await measure_chat(session, url, i) for i in range(requests)]
+        stream = [await measure_stream(session, url, requests + i) for i in range(requests)]
+        async with session.get(url + "/chat/stream/stats") as resp:
+            stats = await resp.json()
+    return chat, stream, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟首包延迟（秒）")
+    parser.add_argument("--chunk-interval", type=float, default=0.05, help="模拟分片间隔（秒）")
+    args = parser.parse_args()
+
+    fake = FakeDashScope(latency=args.latency, reply=LONG_REPLY, chunk_interval=args.chunk_interval)
+    with ThreadedServer(fake.app) as upstream:
+        prepare_backend_env(upstream.url)
+        import main as backend
+        with ThreadedServer(backend.app) as server:
+            chat, stream, stats = asyncio.run(run(server.url, args.requests))
+
+    ttfts = [ttft for ttft, _ in stream]
+    totals = [total for _, total in stream]
+    print(f"/chat        用户可见延迟 p50 {statistics.median(chat) * 1000:.0f}ms")
+    print(f"/chat/stream 首字延迟     p50 {statistics.median(ttfts) * 1000:.0f}ms，完整耗时 p50 {statistics.median(totals) * 1000:.0f}ms")
+    print(f"服务端TTFT统计(/chat/stream/stats): {stats}")
+
+
+if __name__ == "__main__":
+    main()
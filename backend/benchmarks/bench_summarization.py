@@ -0,0 +1,74 @@
+"""滚动摘要效果：在一场长时间跑团中对比开启/关闭摘要时每次请求发送的prompt token数
+
+直接驱动ConversationStore + ConversationSummarizer + LLMClient，上游为本地模拟DashScope服务。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_summarization --turns 200 --trigger 800
+"""
+import argparse
+import asyncio
+import statistics
+
+from benchmarks.common import ThreadedServer, prepare_backend_env
+from benchmarks.fake_dashscope import FakeDashScope
+
+SCENE = "调查员们推开古宅的木门，霉味扑面而来。{}号玩家举着油灯检查壁炉上的旧照片，发现照片背面写着一串日期和模糊的签名。"
+SYSTEM = "你是一名经验丰富的克苏鲁的呼唤守秘人，负责描述场景并推进剧情。" * 5
+
+
+async def play(turns: int, enabled: bool, trigger: int, budget: int, max_history: int):
+    from conversation_store import ConversationStore
+    from llm_client import LLMClient, load_dashscope
+    from summarizer import ConversationSummarizer
+    from tokenizer import estimate_tokens
+
+    load_dashscope()
+    store = ConversationStore(max_history=max_history, token_budget=budget)
+    client = LLMClient(max_concurrency=8, timeout=30)
+    summarizer = ConversationSummarizer(store, client, trigger_tokens=trigger) if enabled else None
+    conversation_id = "group_campaign"
+    store.add_message(conversation_id, "system", SYSTEM)
+    prompt_tokens = []
+    for i in range(turns):
+        store.add_message(conversation_id, "user", f"[用户 调查员{i % 4}]: " + SCENE.format(i % 4))
+        context = store.build_context(conversation_id)
+        prompt_tokens.append(sum(estimate_tokens(m["content"]) for m in context))
+        if summarizer is not None:
+            summarizer.record_request(conversation_id)
+        response = await client.generate(messages=context)
+        store.add_message(conversation_id, "assistant", response.output.choices[0].message.content)
+        if summarizer is not None:
+            summarizer.maybe_schedule(conversation_id)
+    if summarizer is not None:
+        await summarizer.close()
+    return prompt_tokens, summarizer.stats() if summarizer is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--trigger", type=int, default=800, help="SUMMARY_TRIGGER_TOKENS")
+    parser.add_argument("--budget", type=int, default=6000, help="CONTEXT_TOKEN_BUDGET")
+    parser.add_argument("--max-history", type=int, default=20, help="MAX_CONVERSATION_HISTORY")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟DashScope延迟（秒）")
+    args = parser.parse_args()
+
+    fake = FakeDashScope(latency=args.latency, reply="守秘人描述了壁炉后隐藏的暗格与一张泛黄的信纸。")
+    with ThreadedServer(fake.app) as upstream:
+        prepare_backend_env(upstream.url)
+        results = {}
+        for enabled in (False, True):
+            results[enabled] = asyncio.run(play(args.turns, enabled, args.trigger, args.budget, args.max_history))
+
+    baseline = statistics.mean(results[False][0])
+    for enabled, (tokens, stats) in results.items():
+        label = "开启摘要" if enabled else "关闭摘要"
+        mean = statistics.mean(tokens)
+        print(f"{label}: 每次请求prompt token 平均 {mean:.0f}，最后一次 {tokens[-1]}，合计 {sum(tokens)}"
+              + (f"（较关闭时减少 {(1 - mean / baseline) * 100:.1f}%）" if enabled else ""))
+        if stats:
+            print(f"  摘要统计: {stats}")
+
+
+if __name__ == "__main__":
+    main()
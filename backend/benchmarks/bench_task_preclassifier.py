@@ -0,0 +1,108 @@
+"""任务检测预分类：语料召回率，以及开启/关闭预分类时每次请求的prompt token数和延迟
+
+语料（task_corpus.jsonl）中的has_task标注为原有行为——每条消息都附加任务检测提示词时模型应给出的判断。
+召回率低于100%意味着有定时任务请求会被漏掉，脚本以非零状态退出。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_task_preclassifier --requests 40 --latency 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+import aiohttp
+
+from benchmarks.common import ThreadedServer, prepare_backend_env
+from benchmarks.fake_dashscope import FakeDashScope
+from task_detection import looks_like_task
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task_corpus.jsonl")
+
+
+def load_corpus() -> List[Dict]:
+    with open(CORPUS_PATH, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(corpus: List[Dict]) -> bool:
+    start = time.perf_counter()
+    predictions = [looks_like_task(item["message"]) for item in corpus]
+    per_message_us = (time.perf_counter() - start) / len(corpus) * 1e6
+    positives = [p for p, item in zip(predictions, corpus) if item["has_task"]]
+    negatives = [p for p, item in zip(predictions, corpus) if not item["has_task"]]
+    recall = sum(positives) / len(positives)
+    print(f"语料: {len(corpus)}条（定时任务 {len(positives)}，普通聊天 {len(negatives)}）")
+    print(f"召回率: {recall * 100:.1f}%  普通聊天误判率: {sum(negatives) / len(negatives) * 100:.1f}%  "
+          f"单条分类耗时: {per_message_us:.1f}µs")
+    for predicted, item in zip(predictions, corpus):
+        if item["has_task"] and not predicted:
+            print(f"    漏判: {item['message']}")
+    return recall == 1.0
+
+
+async def post_chat(session: aiohttp.ClientSession, url: str, group: str, message: str) -> float:
+    payload = {"user_id": "u1", "user_name": "玩家", "message": message, "conversation_id": group, "user_permission": 0}
+    start = time.perf_counter()
+    async with session.post(url + "/chat", json=payload) as resp:
+        body = await resp.json()
+    assert body["success"], body
+    return time.perf_counter() - start
+
+
+async def run(url: str, label: str, messages: List[str]) -> List[float]:
+    async with aiohttp.ClientSession() as session:
+        latencies = []
+        for index, message in enumerate(messages):
+            latencies.append(await post_chat(session, url, f"{label}_group{index % 4}", message))
+        return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟DashScope首包延迟（秒）")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    recall_ok = evaluate(corpus)
+    # 端到端流量按语料比例混合任务请求与普通聊天（固定随机种子，两种模式使用相同顺序）
+    shuffled = [item["message"] for item in corpus]
+    random.Random(0).shuffle(shuffled)
+    messages = [shuffled[i % len(shuffled)] for i in range(args.requests)]
+
+    fake = FakeDashScope(latency=args.latency)
+    with ThreadedServer(fake.app) as upstream:
+        prepare_backend_env(upstream.url)
+        import main as backend
+
+        rows = []
+        with ThreadedServer(backend.app) as server:
+            for enabled in (False, True):
+                backend.task_classifier.enabled = enabled
+                label = "预分类" if enabled else "每次附加"
+                first = len(fake.prompt_tokens)
+                latencies = asyncio.run(run(server.url, label, messages))
+                tokens = fake.prompt_tokens[first:]
+                rows.append((label, statistics.mean(tokens), statistics.mean(latencies), statistics.median(latencies)))
+        classifier_stats = backend.task_classifier.stats()
+
+    print(f"\n端到端: {args.requests}个请求，首包延迟 {args.latency}s")
+    print(f"{'模式':<8}{'平均prompt tokens':>18}{'平均延迟':>12}{'p50延迟':>12}")
+    for label, tokens, mean_latency, p50 in rows:
+        print(f"{label:<8}{tokens:>18.0f}{mean_latency * 1000:>10.0f}ms{p50 * 1000:>10.0f}ms")
+    (_, base_tokens, base_latency, _), (_, tokens, latency, _) = rows
+    print(f"每次请求节省 {base_tokens - tokens:.0f} prompt tokens（{(1 - tokens / base_tokens) * 100:.0f}%），"
+          f"平均延迟降低 {(base_latency - latency) * 1000:.0f}ms")
+    print(f"预分类统计: {classifier_stats}")
+    if not recall_ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
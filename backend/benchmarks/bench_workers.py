@@ -0,0 +1,105 @@
+"""多worker吞吐：分别以1/2/4/8个worker启动serve.py（SQLite共享状态），压测/chat吞吐并检查会话一致性
+
+每个worker数都在新的临时目录中启动，请求分散在多个会话上；结束后通过/conversations核对
+每个会话的消息数，验证不同worker写入的历史没有丢失。worker的扩展性受本机CPU核数限制。
+
+用法（在backend目录下）:
+    uv run python -m benchmarks.bench_workers --workers 1 2 4 8 --requests 800 --concurrency 64
+    uv run python -m benchmarks.bench_workers --affinity
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import time
+
+import aiohttp
+
+from benchmarks.common import ThreadedServer, free_port_block, start_backend_process, stop_backend_process, wait_ready
+from benchmarks.fake_dashscope import FakeDashScope
+
+
+def start_backend(workers: int, port: int, upstream_url: str, affinity: bool) -> subprocess.Popen:
+    return start_backend_process(
+        port,
+        upstream_url,
+        WORKERS=workers,
+        SHARED_STATE="sqlite",
+        WORKER_AFFINITY="true" if affinity else "false",
+        MAX_CONVERSATION_HISTORY=10000,
+        CONTEXT_TOKEN_BUDGET=0,
+        LLM_MAX_CONCURRENCY=256,
+    )
+
+
+async def load(url: str, requests: int, concurrency: int, conversations: int):
+    queue = asyncio.Queue()
+    for index in range(requests):
+        queue.put_nowait(index)
+    errors = 0
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        while not queue.empty():
+            index = queue.get_nowait()
+            payload = {
+                "user_id": f"user{index % 50}",
+                "user_name": "玩家",
+                "message": f"我对第{index}个房间进行侦查",
+                "conversation_id": f"group_{index % conversations}",
+            }
+            async with session.post(url + "/chat", json=payload) as resp:
+                body = await resp.json()
+                if not body.get("success"):
+                    errors += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        async with session.get(url + "/conversations") as resp:
+            counts = (await resp.json())["conversations"]
+    return elapsed, errors, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=800)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--conversations", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟DashScope单次调用延迟（秒）")
+    parser.add_argument("--affinity", action="store_true", help="使用会话亲和路由（WORKER_AFFINITY）")
+    args = parser.parse_args()
+
+    fake = FakeDashScope(latency=args.latency, chunk_interval=0)
+    rows = []
+    with ThreadedServer(fake.app) as upstream:
+        for workers in args.workers:
+            port = free_port_block(workers + 1)
+            url = f"http://127.0.0.1:{port}"
+            process = start_backend(workers, port, upstream.url, args.affinity)
+            try:
+                asyncio.run(wait_ready(url))
+                elapsed, errors, counts = asyncio.run(load(url, args.requests, args.concurrency, args.conversations))
+            finally:
+                stop_backend_process(process)
+            # 每个会话：1条系统消息 + 每个请求的用户消息和AI回复
+            expected = {
+                f"group_{c}": 1 + 2 * len(range(c, args.requests, args.conversations))
+                for c in range(min(args.conversations, args.requests))
+            }
+            consistent = counts == expected
+            rows.append((workers, args.requests / elapsed, elapsed, errors, consistent))
+
+    mode = "会话亲和路由" if args.affinity else "SQLite共享状态"
+    print(f"{mode}：{args.requests}个请求，并发{args.concurrency}，{args.conversations}个会话，"
+          f"上游延迟{args.latency}s，本机CPU核数{os.cpu_count()}")
+    print(f"{'workers':>8}{'吞吐(req/s)':>14}{'耗时':>10}{'失败':>6}  历史一致性")
+    for workers, throughput, elapsed, errors, consistent in rows:
+        print(f"{workers:>8}{throughput:>14.1f}{elapsed:>9.2f}s{errors:>6}  {'通过' if consistent else '不一致'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""基准测试公共工具：在后台线程中运行uvicorn服务、以子进程启动后端、准备隔离的运行环境"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ThreadedServer:
+    """在后台线程中运行的uvicorn服务"""
+
+    def __init__(self, app, port: int = 0):
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError("服务启动超时")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def prepare_backend_env(dashscope_url: str, **overrides):
+    """在导入main之前设置环境变量，并切换到临时目录避免写入真实的characters.json"""
+    os.environ["DASHSCOPE_API_KEY"] = "fake-key"
+    os.environ["DASHSCOPE_BASE_URL"] = dashscope_url + "/api/v1"
+    for key, value in overrides.items():
+        os.environ[key] = str(value)
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="sealdice-bench-")
+    os.chdir(workdir)
+    return workdir
+
+
+def free_port_block(count: int) -> int:
+    """找到连续count个可用端口（亲和模式下worker使用PORT+1起的端口），避开系统的临时端口范围"""
+    rng = random.Random()
+    while True:
+        base = rng.randrange(20000, 30000)
+        try:
+            for port in range(base, base + count):
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                    sock.bind(("127.0.0.1", port))
+            return base
+        except OSError:
+            continue
+
+
+def start_backend_process(port: int, dashscope_url: str, **overrides) -> subprocess.Popen:
+    """在临时目录中以子进程运行serve.py，overrides为额外的环境变量"""
+    env = dict(
+        os.environ,
+        PYTHONPATH=BACKEND_DIR,
+        DASHSCOPE_API_KEY="fake-key",
+        DASHSCOPE_BASE_URL=dashscope_url + "/api/v1",
+        HOST="127.0.0.1",
+        PORT=str(port),
+    )
+    env.update({key: str(value) for key, value in overrides.items()})
+    workdir = tempfile.mkdtemp(prefix="sealdice-bench-")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "serve.py")],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def stop_backend_process(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def wait_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url + "/health") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("后端启动超时")
@@ -0,0 +1,198 @@
+"""本地模拟的DashScope Generation接口，用于压测与基准测试
+
+也可以单独启动，把后端的DASHSCOPE_BASE_URL指向它手动调试：
+    uv run python -m benchmarks.fake_dashscope --port 8000 --latency 0.5 --token-rate 50 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import uuid
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from task_detection import TASK_START_MARKER
+from tokenizer import estimate_tokens as count_tokens
+
+GENERATION_PATH = "/api/v1/services/aigc/text-generation/generation"
+
+NO_TASK_BLOCK = (
+    '[TASK_DETECTION_START]{"has_task": false, "task_type": null, "task_value": null, '
+    '"task_description": null, "task_action": null}[TASK_DETECTION_END]'
+)
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    return sum(count_tokens(m.get("content", "")) for m in messages)
+
+
+class FakeDashScope:
+    """可配置延迟、生成速度和错误注入的模拟服务
+
+    latency为首包耗时，之后每生成一个分片（chunk_size个字符）耗时chunk_interval秒；
+    指定token_rate（每秒生成的token数，按一个字符一个token计）时由它换算chunk_interval。
+    非流式调用在全部分片生成后一次性返回。
+    model_token_rates按模型覆盖token_rate（模拟更快的小模型）；回复超过请求的max_tokens时截断，finish_reason为length。
+    error_rate为注入错误的概率，命中时在首包延迟后返回error_status及DashScope格式的错误体；
+    指定error_models时只对这些模型注入错误（用于模拟主模型故障、备用模型正常）。
+    fail_next按顺序为接下来的调用指定错误状态码，用于需要确定结果的测试。
+    """
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        reply: str = "骰子落下，结果是20点，大成功！",
+        chunk_interval: float = 0.02,
+        chunk_size: int = 4,
+        token_rate: Optional[float] = None,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        error_models: Optional[Iterable[str]] = None,
+        model_token_rates: Optional[Dict[str, float]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_size / token_rate if token_rate else chunk_interval
+        self.model_chunk_intervals = {model: chunk_size / rate for model, rate in (model_token_rates or {}).items()}
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_models = set(error_models) if error_models is not None else None
+        self._random = random.Random(seed)
+        # {模型（None为任意模型）: 接下来依次返回的错误状态码}
+        self._scripted_errors: Dict[Optional[str], Deque[int]] = {}
+        self.calls = 0
+        self.errors_injected = 0
+        self.truncated = 0
+        self.model_calls: Dict[str, int] = {}
+        self.prompt_tokens: List[int] = []
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self.app = FastAPI()
+        self.app.post(GENERATION_PATH)(self.generation)
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors_injected": self.errors_injected,
+            "truncated": self.truncated,
+            "model_calls": dict(self.model_calls),
+            "max_concurrent": self.max_concurrent,
+        }
+
+    def fail_next(self, *statuses: int, model: Optional[str] = None):
+        """接下来对model（为空时为任意模型）的调用依次返回这些错误状态码，之后恢复正常"""
+        self._scripted_errors.setdefault(model, deque()).extend(statuses)
+
+    def build_reply(self, messages: List[Dict]) -> str:
+        # 与真实模型一致：只有系统消息中带有任务检测提示词时才输出任务检测块
+        if any(m.get("role") == "system" and TASK_START_MARKER in m.get("content", "") for m in messages):
+            return f"{self.reply}{NO_TASK_BLOCK}"
+        return self.reply
+
+    async def generation(self, request: Request):
+        body = await request.json()
+        messages = body.get("input", {}).get("messages", [])
+        model = body.get("model", "")
+        self.calls += 1
+        self.model_calls[model] = self.model_calls.get(model, 0) + 1
+        self.prompt_tokens.append(estimate_tokens(messages))
+        content = self.build_reply(messages)
+        max_tokens = body.get("parameters", {}).get("max_tokens")
+        finish_reason = "stop"
+        if max_tokens and len(content) > max_tokens:
+            content, finish_reason = content[:max_tokens], "length"
+            self.truncated += 1
+        chunk_interval = self.model_chunk_intervals.get(model, self.chunk_interval)
+        streaming = request.headers.get("X-DashScope-SSE") == "enable"
+        scripted = self._scripted_errors.get(model) or self._scripted_errors.get(None)
+        error_status = scripted.popleft() if scripted else None
+        if error_status is None and (
+            self.error_rate > 0
+            and (self.error_models is None or model in self.error_models)
+            and self._random.random() < self.error_rate
+        ):
+            error_status = self.error_status
+        failing = error_status is not None
+        # 非流式调用需要等待整段生成完成：首包延迟 + 其余分片的生成时间
+        delay = self.latency
+        if not streaming and not failing:
+            delay += max(0, len(self._chunks(content)) - 1) * chunk_interval
+        self._concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self._concurrent)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._concurrent -= 1
+        if failing:
+            self.errors_injected += 1
+            return JSONResponse({
+                "request_id": str(uuid.uuid4()),
+                "code": "Throttling" if error_status == 429 else "InternalError",
+                "message": "injected error",
+            }, status_code=error_status)
+        if streaming:
+            return StreamingResponse(
+                self._stream(content, messages, chunk_interval, finish_reason), media_type="text/event-stream"
+            )
+        return JSONResponse({
+            "request_id": str(uuid.uuid4()),
+            "output": {
+                "choices": [{
+                    "finish_reason": finish_reason,
+                    "message": {"role": "assistant", "content": content},
+                }]
+            },
+            "usage": {
+                "input_tokens": estimate_tokens(messages),
+                "output_tokens": len(content),
+                "total_tokens": estimate_tokens(messages) + len(content),
+            },
+        })
+
+    def _chunks(self, content: str) -> List[str]:
+        return [content[i:i + self.chunk_size] for i in range(0, len(content), self.chunk_size)]
+
+    async def _stream(self, content: str, messages: List[Dict], chunk_interval: float, finish_reason: str):
+        request_id = str(uuid.uuid4())
+        chunks = self._chunks(content)
+        for index, chunk in enumerate(chunks, start=1):
+            if index > 1:
+                await asyncio.sleep(chunk_interval)
+            data = json.dumps({
+                "request_id": request_id,
+                "output": {
+                    "choices": [{
+                        "finish_reason": finish_reason if index == len(chunks) else "null",
+                        "message": {"role": "assistant", "content": chunk},
+                    }]
+                },
+                "usage": {"input_tokens": estimate_tokens(messages), "output_tokens": index, "total_tokens": 0},
+            }, ensure_ascii=False)
+            yield f"id:{index}\nevent:result\n:HTTP_STATUS/200\ndata:{data}\n\n"
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=1.0, help="首包延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=None, help="每秒生成的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的概率")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的HTTP状态码")
+    args = parser.parse_args()
+
+    fake = FakeDashScope(
+        latency=args.latency, token_rate=args.token_rate, error_rate=args.error_rate, error_status=args.error_status
+    )
+    uvicorn.run(fake.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from prompt_cache import prompt_digest
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def _file_lock(path: str):
+    """跨进程的排他文件锁（不支持fcntl的平台上退化为不加锁）"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class CharacterRegistry:
+    """常驻内存的角色数据：启动时加载一次，按mtime感知外部修改，写入防抖并原子落盘
+
+    shared为True时（多worker部署），每次访问都检查文件是否被其他worker修改；修改在文件锁内
+    先合并磁盘上的最新数据再立即写入，不做防抖，避免多个worker互相覆盖。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        default_description: str,
+        save_delay: float = 1.0,
+        reload_interval: float = 1.0,
+        shared: bool = False,
+    ):
+        self.path = path
+        self.default_description = default_description
+        self.save_delay = save_delay
+        self.reload_interval = reload_interval
+        self.shared = shared
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._characters: Dict[str, Dict] = {}
+        self._session_characters: Dict[str, str] = {}
+        # 反向索引 {角色名: {会话ID}}
+        self._sessions_by_character: Dict[str, Set[str]] = {}
+        # 角色描述的内容哈希 {角色名: 哈希}，只在加载和修改角色时计算
+        self._digests: Dict[str, str] = {}
+        # 文件签名(inode, mtime)，原子替换会产生新的inode
+        self._signature: Optional[Tuple[int, int]] = None
+        self._last_check = 0.0
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._loaded = False
+
+    def _default_data(self) -> Dict:
+        return {
+            "session_characters": {},  # 会话级角色映射
+            "characters": {
+                "default": {
+                    "name": "默认助手",
+                    "description": self.default_description
+                }
+            }
+        }
+
+    def _apply(self, data: Dict):
+        self._characters = data.get("characters", {})
+        self._session_characters = data.get("session_characters", {})
+        self._sessions_by_character = {}
+        for conversation_id, character_name in self._session_characters.items():
+            self._sessions_by_character.setdefault(character_name, set()).add(conversation_id)
+        self._digests = {name: prompt_digest(info["description"]) for name, info in self._characters.items()}
+
+    def _snapshot(self) -> Dict:
+        return {
+            "session_characters": dict(self._session_characters),
+            "characters": {name: dict(info) for name, info in self._characters.items()},
+        }
+
+    def _load(self):
+        """从磁盘加载角色数据"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._signature = self._file_signature()
+                # 兼容旧版本格式，如果存在current_character则转换为新格式
+                if "current_character" in data and "session_characters" not in data:
+                    logger.info("检测到旧版本角色数据格式，正在转换为会话级格式")
+                    old_current = data.pop("current_character", "default")
+                    data["session_characters"] = {"default": old_current}
+                    self._apply(data)
+                    self._write(self._snapshot())
+                else:
+                    self._apply(data)
+            else:
+                # 如果文件不存在，创建默认角色数据
+                self._apply(self._default_data())
+                self._write(self._snapshot())
+        except Exception as e:
+            logger.error(f"加载角色数据失败: {e}")
+            self._apply(self._default_data())
+        self._loaded = True
+
+    def _file_signature(self) -> Tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _ensure_fresh(self):
+        """首次访问时加载；之后按间隔检查文件mtime，发现外部修改则重新加载（共享模式下每次都检查）"""
+        if not self._loaded:
+            self._load()
+            return
+        now = time.monotonic()
+        if not self.shared and now - self._last_check < self.reload_interval:
+            return
+        self._last_check = now
+        try:
+            signature = self._file_signature()
+        except OSError:
+            return
+        if signature != self._signature and not self._dirty:
+            if not self.shared:
+                logger.info("检测到角色数据文件被外部修改，重新加载")
+            self._load()
+
+    def _modify(self, mutate: Callable[[], bool]) -> bool:
+        """执行一次修改，mutate返回是否有变化；共享模式下在文件锁内合并最新数据后立即写入，否则防抖写入"""
+        with self._lock:
+            if not self.shared:
+                self._ensure_fresh()
+                changed = mutate()
+                if changed:
+                    self._schedule_save()
+                return changed
+            with _file_lock(self.path + ".lock"):
+                self._ensure_fresh()
+                changed = mutate()
+                if changed and not self._write(self._snapshot()):
+                    # 写入失败时退回防抖重试
+                    self._schedule_save()
+                return changed
+
+    def _write(self, data: Dict) -> bool:
+        """原子写入：先写临时文件再rename"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".characters-", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            self._signature = self._file_signature()
+            return True
+        except Exception as e:
+            logger.error(f"保存角色数据失败: {e}")
+            return False
+
+    def _schedule_save(self):
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self) -> bool:
+        """立即写入尚未落盘的修改（序列化在锁外进行，不阻塞读取）"""
+        with self._write_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._dirty:
+                    return True
+                data = self._snapshot()
+                self._dirty = False
+            ok = self._write(data)
+            if not ok:
+                with self._lock:
+                    self._schedule_save()
+            return ok
+
+    def get_characters(self) -> Dict[str, Dict]:
+        with self._lock:
+            self._ensure_fresh()
+            return dict(self._characters)
+
+    def get_character(self, character_name: str) -> Optional[Dict]:
+        with self._lock:
+            self._ensure_fresh()
+            return self._characters.get(character_name)
+
+    def get_session_character(self, conversation_id: str = "default") -> str:
+        with self._lock:
+            self._ensure_fresh()
+            return self._session_characters.get(conversation_id, "default")
+
+    def get_description(self, conversation_id: str = "default") -> str:
+        """获取指定会话当前角色的描述，角色不存在时回退到默认角色"""
+        with self._lock:
+            self._ensure_fresh()
+            current_char = self._session_characters.get(conversation_id, "default")
+            if current_char in self._characters:
+                return self._characters[current_char]["description"]
+            return self._characters.get("default", {}).get("description", self.default_description)
+
+    def get_prompt(self, conversation_id: str = "default") -> Tuple[str, str, str]:
+        """获取指定会话当前角色的(角色名, 描述哈希, 描述)，角色不存在时回退到默认角色"""
+        with self._lock:
+            self._ensure_fresh()
+            current_char = self._session_characters.get(conversation_id, "default")
+            if current_char not in self._characters:
+                current_char = "default"
+            if current_char in self._characters:
+                return current_char, self._digests[current_char], self._characters[current_char]["description"]
+            return current_char, prompt_digest(self.default_description), self.default_description
+
+    def get_session_characters(self) -> Dict[str, str]:
+        """所有会话的角色映射 {会话ID: 角色名}"""
+        with self._lock:
+            self._ensure_fresh()
+            return dict(self._session_characters)
+
+    def get_generation_profile(self, conversation_id: str = "default") -> Optional[str]:
+        """指定会话当前角色的生成档位，未设置时返回None"""
+        with self._lock:
+            self._ensure_fresh()
+            current_char = self._session_characters.get(conversation_id, "default")
+            info = self._characters.get(current_char) or self._characters.get("default") or {}
+            return info.get("generation_profile") or None
+
+    def get_sessions_for_character(self, character_name: str) -> Set[str]:
+        with self._lock:
+            self._ensure_fresh()
+            return set(self._sessions_by_character.get(character_name, ()))
+
+    def _assign(self, conversation_id: str, character_name: str) -> bool:
+        """修改会话角色映射并维护反向索引，返回是否有变化（需持有锁）"""
+        previous = self._session_characters.get(conversation_id)
+        if previous == character_name:
+            return False
+        if previous is not None:
+            sessions = self._sessions_by_character.get(previous)
+            if sessions is not None:
+                sessions.discard(conversation_id)
+                if not sessions:
+                    del self._sessions_by_character[previous]
+        self._session_characters[conversation_id] = character_name
+        self._sessions_by_character.setdefault(character_name, set()).add(conversation_id)
+        return True
+
+    def set_session_character(self, conversation_id: str, character_name: str):
+        self._modify(lambda: self._assign(conversation_id, character_name))
+
+    def add_character(self, character_name: str, description: str, generation_profile: Optional[str] = None) -> bool:
+        """添加新角色，角色已存在时返回False"""
+        def mutate() -> bool:
+            if character_name in self._characters:
+                return False
+            self._characters[character_name] = {
+                "name": character_name,
+                "description": description
+            }
+            if generation_profile:
+                self._characters[character_name]["generation_profile"] = generation_profile
+            self._digests[character_name] = prompt_digest(description)
+            return True
+        return self._modify(mutate)
+
+    def set_generation_profile(self, character_name: str, generation_profile: Optional[str]) -> bool:
+        """设置角色的生成档位（None为使用默认选择），角色不存在时返回False"""
+        found = False
+
+        def mutate() -> bool:
+            nonlocal found
+            info = self._characters.get(character_name)
+            if info is None:
+                return False
+            found = True
+            if (info.get("generation_profile") or None) == generation_profile:
+                return False
+            if generation_profile:
+                info["generation_profile"] = generation_profile
+            else:
+                info.pop("generation_profile", None)
+            return True
+        self._modify(mutate)
+        return found
+
+    def import_data(self, characters: Dict[str, Dict], session_characters: Dict[str, str]) -> bool:
+        """批量导入角色 {角色名: 角色数据} 和会话角色映射 {会话ID: 角色名}，覆盖同名角色和已有映射，只写入一次
+
+        角色数据缺少显示名称name时沿用角色名。
+        """
+        def mutate() -> bool:
+            changed = False
+            for character_name, info in characters.items():
+                info = {"name": character_name, **info}
+                if self._characters.get(character_name) == info:
+                    continue
+                self._characters[character_name] = info
+                self._digests[character_name] = prompt_digest(info["description"])
+                changed = True
+            for conversation_id, character_name in session_characters.items():
+                changed = self._assign(conversation_id, character_name) or changed
+            return changed
+        return self._modify(mutate)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "characters": len(self._characters),
+                "sessions": len(self._session_characters),
+                "dirty": self._dirty,
+                "shared": self.shared,
+            }
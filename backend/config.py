@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import List, Optional
 from dotenv import load_dotenv
 
 # 加载.env文件
@@ -9,14 +9,115 @@ class Config:
     # DashScope API配置
     DASHSCOPE_API_KEY: Optional[str] = os.getenv("DASHSCOPE_API_KEY")
     DASHSCOPE_MODEL: str = os.getenv("DASHSCOPE_MODEL", "qwen-turbo")
+    DASHSCOPE_BASE_URL: Optional[str] = os.getenv("DASHSCOPE_BASE_URL")
+    
+    # LLM调用配置
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "60"))
+    # 限流/5xx/连接错误的重试次数（不含首次调用）及指数退避的基础/最大等待（秒）
+    LLM_RETRY_ATTEMPTS: int = int(os.getenv("LLM_RETRY_ATTEMPTS", "2"))
+    LLM_RETRY_BASE_DELAY: float = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+    LLM_RETRY_MAX_DELAY: float = float(os.getenv("LLM_RETRY_MAX_DELAY", "5"))
+    # 熔断：连续失败多少次后暂停调用该模型（0为不熔断），以及熔断持续秒数
+    LLM_BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+    LLM_BREAKER_RESET_TIMEOUT: float = float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", "30"))
+    # 备用模型，逗号分隔，按顺序在DASHSCOPE_MODEL不可用时使用
+    LLM_FALLBACK_MODELS: List[str] = [
+        name.strip() for name in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if name.strip()
+    ]
     
     # 服务配置
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "1478"))
     
+    # 多worker部署：worker进程数；SHARED_STATE为sqlite时各worker通过本机SQLite文件共享对话状态
+    WORKERS: int = int(os.getenv("WORKERS", "1"))
+    SHARED_STATE: str = os.getenv("SHARED_STATE", "none")
+    SHARED_STATE_PATH: Optional[str] = os.getenv("SHARED_STATE_PATH")  # 默认 data/shared_state.db
+    # 会话亲和：PORT上运行路由进程，按conversation_id把请求固定转发到同一个worker（端口PORT+1起）
+    WORKER_AFFINITY: bool = os.getenv("WORKER_AFFINITY", "false").lower() == "true"
+    
+    # Prometheus指标（/metrics）：请求数、各阶段耗时、token用量、错误数
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+    
     # 对话配置
     MAX_CONVERSATION_HISTORY: int = int(os.getenv("MAX_CONVERSATION_HISTORY", "20"))
+    # 单次请求上下文的token预算（含系统提示，0表示只按条数限制）
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+    # token计数方式：char（字符估算）或 dashscope（本地Qwen分词器，需要tiktoken）
+    TOKENIZER: str = os.getenv("TOKENIZER", "char")
+    
+    # 滚动摘要：会话token超过阈值时在后台将较早的对话压缩为摘要
+    SUMMARY_ENABLED: bool = os.getenv("SUMMARY_ENABLED", "false").lower() == "true"
+    SUMMARY_TRIGGER_TOKENS: int = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "1500"))
+    SUMMARY_KEEP_RECENT: int = int(os.getenv("SUMMARY_KEEP_RECENT", "6"))
+    SUMMARY_MAX_TOKENS: int = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+    SUMMARY_MODEL: Optional[str] = os.getenv("SUMMARY_MODEL")
     MAX_MESSAGE_LENGTH: int = int(os.getenv("MAX_MESSAGE_LENGTH", "2000"))
+    # 任务检测预分类：只对命中定时/提醒等关键词的消息附加任务检测提示词（false为每次都附加）
+    TASK_PRECLASSIFIER: bool = os.getenv("TASK_PRECLASSIFIER", "true").lower() == "true"
+    
+    # 生成参数：默认档位的max_tokens和temperature，以及额外的命名档位（逗号分隔的 名称:max_tokens:temperature:模型，省略的字段沿用默认档位）
+    GENERATION_MAX_TOKENS: int = int(os.getenv("GENERATION_MAX_TOKENS", "1500"))
+    GENERATION_TEMPERATURE: float = float(os.getenv("GENERATION_TEMPERATURE", "0.7"))
+    GENERATION_PROFILES: str = os.getenv("GENERATION_PROFILES", "short:400")
+    # 自适应：不超过GENERATION_SHORT_MESSAGE_CHARS字、且不含定时任务需求的消息使用GENERATION_ADAPTIVE_PROFILE档位
+    GENERATION_ADAPTIVE: bool = os.getenv("GENERATION_ADAPTIVE", "false").lower() == "true"
+    GENERATION_ADAPTIVE_PROFILE: str = os.getenv("GENERATION_ADAPTIVE_PROFILE", "short")
+    GENERATION_SHORT_MESSAGE_CHARS: int = int(os.getenv("GENERATION_SHORT_MESSAGE_CHARS", "30"))
+    
+    # 令牌桶限流（每分钟条数，0为不限制）：按用户ID和会话ID分别计数，超出时返回429
+    RATE_LIMIT_USER_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "0"))
+    RATE_LIMIT_USER_BURST: int = int(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+    RATE_LIMIT_CONVERSATION_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_CONVERSATION_PER_MINUTE", "0"))
+    RATE_LIMIT_CONVERSATION_BURST: int = int(os.getenv("RATE_LIMIT_CONVERSATION_BURST", "10"))
+    
+    # 准入控制：同时处理的聊天请求上限（0为不限制），超出时按会话轮转排队，排队已满或超时返回503
+    ADMISSION_MAX_IN_FLIGHT: int = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "0"))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+    ADMISSION_MAX_QUEUE_PER_CONVERSATION: int = int(os.getenv("ADMISSION_MAX_QUEUE_PER_CONVERSATION", "5"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+    
+    # 批量聊天接口：单次最多的消息数、同时处理的消息数
+    CHAT_BATCH_MAX_ITEMS: int = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "50"))
+    CHAT_BATCH_CONCURRENCY: int = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+    
+    # 同一会话的请求串行处理；开启合并后，LLM调用进行中到达的消息合并为一次后续调用
+    CONVERSATION_COALESCE: bool = os.getenv("CONVERSATION_COALESCE", "false").lower() == "true"
+    COALESCE_MAX_BATCH: int = int(os.getenv("COALESCE_MAX_BATCH", "8"))
+    
+    # 重复提问的回复缓存（可选）：键为角色描述+模型+归一化消息+最近若干条上下文
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    RESPONSE_CACHE_CONTEXT_MESSAGES: int = int(os.getenv("RESPONSE_CACHE_CONTEXT_MESSAGES", "1"))
+    # 不使用缓存的角色名，逗号分隔
+    RESPONSE_CACHE_DISABLED_CHARACTERS: List[str] = [
+        name.strip() for name in os.getenv("RESPONSE_CACHE_DISABLED_CHARACTERS", "").split(",") if name.strip()
+    ]
+    
+    # 后端定时任务调度（可选）：任务持久化到SQLite，到期后由插件通过 /tasks/due 长轮询取走
+    SCHEDULER_ENABLED: bool = os.getenv("SCHEDULER_ENABLED", "false").lower() == "true"
+    SCHEDULER_PATH: str = os.getenv("SCHEDULER_PATH", "data/scheduled_tasks.db")
+    # 投递租期（秒）：取走后未确认的提醒在租期过后重新下发
+    SCHEDULER_LEASE: float = float(os.getenv("SCHEDULER_LEASE", "60"))
+    # 服务停机期间错过的触发，在该秒数内的补发一次，更早的跳过
+    SCHEDULER_MISFIRE_GRACE: float = float(os.getenv("SCHEDULER_MISFIRE_GRACE", "300"))
+    
+    # 对话存储上限（0表示不限制）
+    MAX_CONVERSATIONS: int = int(os.getenv("MAX_CONVERSATIONS", "1000"))
+    CONVERSATION_TTL: float = float(os.getenv("CONVERSATION_TTL", "604800"))  # 空闲秒数，默认7天
+    CONVERSATION_MAX_BYTES: int = int(os.getenv("CONVERSATION_MAX_BYTES", str(256 * 1024 * 1024)))
+    
+    # 对话历史持久化：memory（不持久化）、sqlite 或 jsonl
+    HISTORY_BACKEND: str = os.getenv("HISTORY_BACKEND", "memory")
+    HISTORY_PATH: Optional[str] = os.getenv("HISTORY_PATH")  # 默认 data/history.db 或 data/history_log
+    HISTORY_FLUSH_INTERVAL: float = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))
+    HISTORY_BATCH_SIZE: int = int(os.getenv("HISTORY_BATCH_SIZE", "256"))
+    
+    # 角色数据配置
+    CHARACTERS_SAVE_DELAY: float = float(os.getenv("CHARACTERS_SAVE_DELAY", "1.0"))
+    CHARACTERS_RELOAD_INTERVAL: float = float(os.getenv("CHARACTERS_RELOAD_INTERVAL", "1.0"))
     
     # 系统提示词
     SYSTEM_PROMPT: str = os.getenv("SYSTEM_PROMPT", 
@@ -0,0 +1,103 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+class _ConversationState:
+    __slots__ = ("lock", "pending", "users")
+
+    def __init__(self):
+        # asyncio.Lock按等待顺序唤醒，保证同一会话的请求按到达顺序处理
+        self.lock = asyncio.Lock()
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.users = 0
+
+
+class ConversationCoordinator:
+    """同一会话的请求串行处理；开启合并后，LLM调用进行中到达的消息合并为一次后续调用"""
+
+    def __init__(self, coalesce: bool = False, max_batch: int = 8):
+        self.coalesce = coalesce
+        self.max_batch = max_batch
+        self._states: Dict[str, _ConversationState] = {}
+        self.batches = 0
+        self.coalesced_requests = 0
+
+    def _acquire_state(self, conversation_id: str) -> _ConversationState:
+        state = self._states.get(conversation_id)
+        if state is None:
+            state = self._states[conversation_id] = _ConversationState()
+        state.users += 1
+        return state
+
+    def _release_state(self, conversation_id: str, state: _ConversationState):
+        state.users -= 1
+        if state.users == 0 and not state.pending:
+            self._states.pop(conversation_id, None)
+
+    @asynccontextmanager
+    async def lock(self, conversation_id: str):
+        """独占某个会话（不参与合并）"""
+        state = self._acquire_state(conversation_id)
+        try:
+            async with state.lock:
+                yield
+        finally:
+            self._release_state(conversation_id, state)
+
+    async def run(self, conversation_id: str, item: Any, process: Callable[[List[Any]], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """处理一个请求，返回(结果, 是否已被合并到其他请求中处理)
+
+        process接收同一会话按到达顺序排列的一批请求，返回这批请求共享的结果。
+        """
+        if not self.coalesce:
+            async with self.lock(conversation_id):
+                self.batches += 1
+                return await process([item]), False
+
+        state = self._acquire_state(conversation_id)
+        future = asyncio.get_running_loop().create_future()
+        state.pending.append((item, future))
+        try:
+            async with state.lock:
+                if future.done():
+                    # 已由排在前面的请求合并处理
+                    return future.result(), True
+                batch = state.pending[:self.max_batch]
+                del state.pending[:self.max_batch]
+                self.batches += 1
+                self.coalesced_requests += len(batch) - 1
+                try:
+                    result = await process([batch_item for batch_item, _ in batch])
+                except BaseException as e:
+                    error = e if isinstance(e, Exception) else Exception("合并处理的请求已被取消")
+                    for _, other in batch:
+                        if other is not future and not other.done():
+                            other.set_exception(error)
+                    raise
+                for _, other in batch:
+                    if other is not future and not other.done():
+                        other.set_result(result)
+                if not future.done():
+                    future.set_result(result)
+                return result, False
+        finally:
+            if not future.done():
+                # 等待锁时被取消（或本批处理失败）：尚未被取走的消息不再交给后续批次处理
+                self._discard_pending(state, future)
+            self._release_state(conversation_id, state)
+
+    @staticmethod
+    def _discard_pending(state: _ConversationState, future: asyncio.Future):
+        for index, (_, pending_future) in enumerate(state.pending):
+            if pending_future is future:
+                del state.pending[index]
+                return
+
+    def stats(self) -> Dict:
+        return {
+            "coalesce": self.coalesce,
+            "active_conversations": len(self._states),
+            "batches": self.batches,
+            "coalesced_requests": self.coalesced_requests,
+        }
@@ -0,0 +1,462 @@
+import itertools
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from history_backend import HistoryBackend, StoredMessage
+from prompt_cache import PromptCache, PromptPrefix
+from tokenizer import TokenCounter, estimate_tokens
+
+# 不参与窗口滑动的固定消息：系统提示和历史摘要
+PINNED_ROLES = ("system", "summary")
+SUMMARY_HEADER = "[此前对话摘要]"
+
+
+class Message:
+    """单条对话消息，使用__slots__避免每条消息一个dict"""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str, tokens: int = 0):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+    def to_dict(self) -> Dict:
+        return {"role": self.role, "content": self.content}
+
+    def size(self) -> int:
+        """近似内存占用（字节）"""
+        return MESSAGE_OVERHEAD + sys.getsizeof(self.content)
+
+
+MESSAGE_OVERHEAD = sys.getsizeof(Message("", "")) + 8  # 对象本身 + 容器中的指针
+
+
+class Conversation:
+    """单个会话：固定的系统消息、历史摘要、按时间排列的对话消息及其token/内存估算"""
+
+    __slots__ = ("system", "summary", "condensed", "messages", "tokens", "last_access", "bytes", "version")
+
+    def __init__(self):
+        # 使用角色前缀缓存时为共享的PromptPrefix
+        self.system: Optional[Message] = None
+        self.summary: Optional[Message] = None
+        # 最近被摘要替代的原始消息的token数（从旧到新）
+        self.condensed: Deque[int] = deque()
+        self.messages: Deque[Message] = deque()
+        # 对话消息（不含系统消息）的token总数
+        self.tokens = 0
+        self.last_access = time.monotonic()
+        self.bytes = 0
+        # 共享模式下对应的共享状态版本号，-1表示本地副本已过期
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.messages) + (self.system is not None) + (self.summary is not None)
+
+    def pinned_tokens(self) -> int:
+        tokens = self.system.tokens if self.system is not None else 0
+        return tokens + (self.summary.tokens if self.summary is not None else 0)
+
+    def total_tokens(self) -> int:
+        return self.tokens + self.pinned_tokens()
+
+
+class ConversationStore:
+    """有界的对话历史存储：按会话数、空闲时间和内存预算进行LRU淘汰
+
+    每个会话的上下文窗口同时受消息条数和token预算限制：系统消息单独固定保存、只出现一次，
+    其余消息存放在deque中并维护token累计值，超出预算时从队首弹出，每条消息均摊O(1)。
+    """
+
+    def __init__(
+        self,
+        max_history: int,
+        max_conversations: int = 0,
+        ttl: float = 0,
+        max_bytes: int = 0,
+        backend: Optional[HistoryBackend] = None,
+        token_budget: int = 0,
+        token_counter: TokenCounter = estimate_tokens,
+        prompt_cache: Optional[PromptCache] = None,
+    ):
+        self.max_history = max_history
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.token_budget = token_budget
+        self.count_tokens = token_counter
+        # 角色前缀缓存（可选）：内容相同的系统消息共用同一个编译好的前缀，不再逐会话保存副本和计算token
+        self.prompt_cache = prompt_cache
+        # 持久化后端（可选）：内存中只保留活跃会话，淘汰的会话下次访问时从后端加载
+        self.backend = backend
+        # 多worker共享模式：内存中的会话只是缓存，访问时按版本号校验
+        self.shared = bool(backend is not None and backend.shared)
+        # 按最近访问排序，队首为最久未访问的会话
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self.total_bytes = 0
+        self.total_messages = 0
+        self.total_tokens = 0
+        self.evictions = {"lru": 0, "ttl": 0, "bytes": 0}
+        self.trimmed_messages = 0
+        self.backend_loads = 0
+        self.stale_reloads = 0
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._conversations
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def _touch(self, conversation_id: str, create: bool) -> Optional[Conversation]:
+        self._expire()
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None and self.shared and self.backend.version(conversation_id) != conversation.version:
+            # 其他worker修改过该会话，丢弃本地副本重新加载
+            self._remove(conversation_id)
+            self.stale_reloads += 1
+            conversation = None
+        if conversation is None:
+            conversation = self._load_from_backend(conversation_id)
+            if conversation is None:
+                if not create:
+                    return None
+                conversation = Conversation()
+            self._conversations[conversation_id] = conversation
+            self._enforce_limits(keep=conversation_id)
+        else:
+            self._conversations.move_to_end(conversation_id)
+        conversation.last_access = time.monotonic()
+        return conversation
+
+    def _new_message(self, role: str, content: str) -> Message:
+        if role == "system" and self.prompt_cache is not None:
+            prefix = self.prompt_cache.lookup(content)
+            if prefix is not None:
+                return prefix
+        return Message(role, content, self.count_tokens(content))
+
+    def _account(self, conversation: Conversation, message: Message, sign: int):
+        size = message.size() * sign
+        conversation.bytes += size
+        self.total_bytes += size
+        self.total_messages += sign
+        self.total_tokens += message.tokens * sign
+        if message.role not in PINNED_ROLES:
+            conversation.tokens += message.tokens * sign
+
+    def _load_from_backend(self, conversation_id: str) -> Optional[Conversation]:
+        if self.backend is None:
+            return None
+        if self.shared:
+            version, stored = self.backend.load_versioned(conversation_id)
+            if not version:
+                return None
+        else:
+            version, stored = 0, self.backend.load(conversation_id)
+            if not stored:
+                return None
+        conversation = self._build(stored or (), version)
+        self.backend_loads += 1
+        self._trim(conversation_id, conversation)
+        return conversation
+
+    def _build(self, stored: Iterable[StoredMessage], version: int = 0) -> Conversation:
+        """由持久化格式的消息列表构造会话（不做裁剪）"""
+        conversation = Conversation()
+        conversation.version = version
+        for role, content in stored:
+            message = self._new_message(role, content)
+            if role in PINNED_ROLES:
+                slot = "system" if role == "system" else "summary"
+                previous = getattr(conversation, slot)
+                if previous is not None:
+                    self._account(conversation, previous, -1)
+                setattr(conversation, slot, message)
+            else:
+                conversation.messages.append(message)
+            self._account(conversation, message, 1)
+        return conversation
+
+    def _remove(self, conversation_id: str) -> Optional[Conversation]:
+        conversation = self._conversations.pop(conversation_id, None)
+        if conversation is not None:
+            self.total_bytes -= conversation.bytes
+            self.total_messages -= len(conversation)
+            self.total_tokens -= conversation.total_tokens()
+        return conversation
+
+    def _expire(self):
+        """淘汰空闲超过TTL的会话，只检查LRU队首，均摊O(1)"""
+        if not self.ttl:
+            return
+        deadline = time.monotonic() - self.ttl
+        while self._conversations:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if conversation.last_access >= deadline:
+                break
+            self._remove(conversation_id)
+            self.evictions["ttl"] += 1
+
+    def _enforce_limits(self, keep: str):
+        """超出会话数或内存预算时从LRU队首淘汰，当前会话除外"""
+        while self.max_conversations and len(self._conversations) > self.max_conversations:
+            if not self._evict_oldest(keep, "lru"):
+                break
+        while self.max_bytes and self.total_bytes > self.max_bytes:
+            if not self._evict_oldest(keep, "bytes"):
+                break
+
+    def _evict_oldest(self, keep: str, reason: str) -> bool:
+        for conversation_id in self._conversations:
+            if conversation_id != keep:
+                self._remove(conversation_id)
+                self.evictions[reason] += 1
+                return True
+        return False
+
+    def _trim(self, conversation_id: str, conversation: Conversation):
+        """按消息条数和token预算从最旧的消息开始弹出，至少保留最新一条"""
+        system_tokens = conversation.pinned_tokens()
+        dropped = 0
+        messages = conversation.messages
+        while len(messages) > 1 and (
+            len(messages) > self.max_history
+            or (self.token_budget and system_tokens + conversation.tokens > self.token_budget)
+        ):
+            self._account(conversation, messages.popleft(), -1)
+            dropped += 1
+        if dropped:
+            self.trimmed_messages += dropped
+            if self.backend is not None:
+                self._record_write(conversation, self.backend.trim(conversation_id, dropped))
+
+    def _record_write(self, conversation: Conversation, change: Optional[Tuple[int, int]]):
+        """共享模式下按写入前后的版本号更新本地副本；写入前的版本不一致说明本地副本已过期"""
+        if self.shared and change is not None:
+            before, after = change
+            conversation.version = after if before == conversation.version else -1
+
+    def _replace_stored(self, conversation_id: str, conversation: Conversation) -> bool:
+        """用本地副本整体替换后端中的会话；共享模式下仅当其他worker未修改过该会话时才替换"""
+        if not self.shared:
+            self.backend.replace(conversation_id, self._stored(conversation))
+            return True
+        change = self.backend.replace(conversation_id, self._stored(conversation), expected_version=conversation.version)
+        if change is None:
+            conversation.version = -1
+            return False
+        conversation.version = change[1]
+        return True
+
+    def has_messages(self, conversation_id: str) -> bool:
+        conversation = self._touch(conversation_id, create=False)
+        return bool(conversation and len(conversation))
+
+    def build_context(self, conversation_id: str, extra_system: str = "") -> List[Dict]:
+        """组装供LLM调用的消息列表：系统消息（仅一次，附带历史摘要）+ 预算内的最近对话
+
+        extra_system为仅本次调用附加在系统消息末尾的内容，超出token预算时本次少发送最旧的消息。
+        """
+        conversation = self._touch(conversation_id, create=False)
+        if conversation is None:
+            return []
+        context = []
+        system_parts = [conversation.system.content if conversation.system is not None else ""]
+        if conversation.summary is not None:
+            system_parts.append(f"{SUMMARY_HEADER}\n{conversation.summary.content}")
+        if extra_system:
+            system_parts.append(extra_system)
+        if conversation.summary is None and extra_system and isinstance(conversation.system, PromptPrefix):
+            context.append({"role": "system", "content": conversation.system.extended(extra_system)})
+        elif conversation.summary is not None or extra_system:
+            context.append({"role": "system", "content": "\n\n".join(part for part in system_parts if part).strip()})
+        elif conversation.system is not None:
+            context.append(conversation.system.to_dict())
+        skip = 0
+        if extra_system and self.token_budget:
+            overflow = conversation.pinned_tokens() + conversation.tokens + self.count_tokens(extra_system) - self.token_budget
+            while overflow > 0 and skip < len(conversation.messages) - 1:
+                overflow -= conversation.messages[skip].tokens
+                skip += 1
+        context.extend(message.to_dict() for message in itertools.islice(conversation.messages, skip, None))
+        return context
+
+    def context_tokens(self, conversation_id: str) -> int:
+        conversation = self._conversations.get(conversation_id)
+        return conversation.total_tokens() if conversation is not None else 0
+
+    def conversation_tokens(self, conversation_id: str) -> int:
+        """会话中未被摘要、可滑动部分的token数"""
+        conversation = self._conversations.get(conversation_id)
+        return conversation.tokens if conversation is not None else 0
+
+    def summary_savings(self, conversation_id: str) -> int:
+        """本次请求因使用摘要而少发送的token数
+
+        与不做摘要时的窗口对比：被压缩的消息中，原本仍能放进条数和token预算的那部分，减去摘要本身的token数。
+        """
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None or conversation.summary is None:
+            return 0
+        room_count = self.max_history - len(conversation.messages)
+        room_tokens = (self.token_budget or float("inf")) - conversation.tokens
+        room_tokens -= conversation.system.tokens if conversation.system is not None else 0
+        replaced = 0
+        for tokens in reversed(conversation.condensed):
+            if room_count <= 0 or replaced + tokens > room_tokens:
+                break
+            replaced += tokens
+            room_count -= 1
+        return max(0, replaced - conversation.summary.tokens)
+
+    def summary_candidates(self, conversation_id: str, keep_recent: int) -> Optional[Tuple[List[Message], Optional[str]]]:
+        """取出待压缩的较早消息（保留最近keep_recent条）及现有摘要"""
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None or len(conversation.messages) <= keep_recent:
+            return None
+        count = len(conversation.messages) - keep_recent
+        older = [conversation.messages[i] for i in range(count)]
+        summary = conversation.summary.content if conversation.summary is not None else None
+        return older, summary
+
+    def apply_summary(self, conversation_id: str, condensed: List[Message], summary_text: str) -> bool:
+        """用摘要替换已压缩的消息；摘要生成期间被裁剪或清除的消息会被跳过"""
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return False
+        if self.shared and self.backend.version(conversation_id) != conversation.version:
+            return False
+        condensed_ids = {id(message) for message in condensed}
+        # 裁剪只会从队首弹出，因此快照中仍存在的消息必然连续位于队首
+        if conversation.condensed.maxlen != self.max_history:
+            conversation.condensed = deque(conversation.condensed, maxlen=self.max_history)
+        dropped = 0
+        while conversation.messages and id(conversation.messages[0]) in condensed_ids:
+            message = conversation.messages.popleft()
+            self._account(conversation, message, -1)
+            conversation.condensed.append(message.tokens)
+            dropped += 1
+        if not dropped:
+            return False
+        if conversation.summary is not None:
+            self._account(conversation, conversation.summary, -1)
+        conversation.summary = self._new_message("summary", summary_text)
+        self._account(conversation, conversation.summary, 1)
+        if self.backend is not None:
+            return self._replace_stored(conversation_id, conversation)
+        return True
+
+    def add_message(self, conversation_id: str, role: str, content: str):
+        """添加消息到对话历史"""
+        conversation = self._touch(conversation_id, create=True)
+        message = self._new_message(role, content)
+        if role == "system":
+            # 系统消息固定保存一份，重复设置时替换
+            # 共享模式下总是按版本号条件替换，避免多个worker同时为新会话各写入一条系统消息
+            if conversation.system is not None:
+                self._account(conversation, conversation.system, -1)
+            conversation.system = message
+            self._account(conversation, message, 1)
+            if self.backend is not None:
+                if len(conversation) == 1 and not self.shared:
+                    self._record_write(conversation, self.backend.append(conversation_id, role, content))
+                else:
+                    self._replace_stored(conversation_id, conversation)
+        else:
+            conversation.messages.append(message)
+            self._account(conversation, message, 1)
+            if self.backend is not None:
+                self._record_write(conversation, self.backend.append(conversation_id, role, content))
+            self._trim(conversation_id, conversation)
+
+        self._enforce_limits(keep=conversation_id)
+
+    @staticmethod
+    def _stored(conversation: Conversation) -> List[Tuple[str, str]]:
+        stored = [
+            (message.role, message.content)
+            for message in (conversation.system, conversation.summary)
+            if message is not None
+        ]
+        stored.extend((message.role, message.content) for message in conversation.messages)
+        return stored
+
+    def clear(self, conversation_id: str) -> bool:
+        """清除对话历史，返回内存中是否存在该会话"""
+        change = self.backend.replace(conversation_id, []) if self.backend is not None else None
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return False
+        self.total_bytes -= conversation.bytes
+        self.total_messages -= len(conversation)
+        self.total_tokens -= conversation.total_tokens()
+        self._conversations[conversation_id] = Conversation()
+        if self.shared:
+            self._conversations[conversation_id].version = change[1]
+        return True
+
+    def close(self):
+        """等待持久化后端写完并关闭"""
+        if self.backend is not None:
+            self.backend.close()
+
+    def conversation_ids(self) -> List[str]:
+        """所有会话的ID：内存中的会话，加上持久化后端中尚未加载的会话"""
+        if self.shared:
+            return [conversation_id for conversation_id, _ in self.backend.message_counts()]
+        self._expire()
+        ids = list(self._conversations)
+        if self.backend is not None:
+            in_memory = set(ids)
+            ids.extend(conversation_id for conversation_id in self.backend.conversation_ids() if conversation_id not in in_memory)
+        return ids
+
+    def export_conversation(self, conversation_id: str) -> Optional[List[StoredMessage]]:
+        """读取会话的完整历史用于导出；不在内存中的会话直接从后端读取，不载入内存、不改变LRU顺序"""
+        if self.shared:
+            return self.backend.load(conversation_id)
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            return self._stored(conversation) or None
+        return self.backend.load(conversation_id) if self.backend is not None else None
+
+    def import_conversation(self, conversation_id: str, messages: List[StoredMessage]):
+        """用导入的历史整体替换会话；有持久化后端时只写入后端，下次访问时再加载"""
+        self._remove(conversation_id)
+        if self.backend is not None:
+            self.backend.replace(conversation_id, messages)
+            return
+        conversation = self._build(messages)
+        self._conversations[conversation_id] = conversation
+        self._trim(conversation_id, conversation)
+        self._enforce_limits(keep=conversation_id)
+
+    def message_counts(self) -> Iterator[Tuple[str, int]]:
+        if self.shared:
+            # 共享模式下以共享状态为准，包含其他worker处理的会话
+            yield from self.backend.message_counts()
+            return
+        self._expire()
+        for conversation_id, conversation in self._conversations.items():
+            yield conversation_id, len(conversation)
+
+    def stats(self) -> Dict:
+        self._expire()
+        return {
+            "conversations": len(self._conversations),
+            "messages": self.total_messages,
+            "approx_tokens": self.total_tokens,
+            "approx_bytes": self.total_bytes,
+            "max_conversations": self.max_conversations,
+            "max_bytes": self.max_bytes,
+            "token_budget": self.token_budget,
+            "ttl_seconds": self.ttl,
+            "evictions": dict(self.evictions),
+            "trimmed_messages": self.trimmed_messages,
+            "backend_loads": self.backend_loads,
+            "stale_reloads": self.stale_reloads,
+            "backend": self.backend.stats() if self.backend is not None else None,
+        }
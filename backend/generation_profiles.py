@@ -0,0 +1,154 @@
+import logging
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = "default"
+# 每个档位保留的最近调用样本数，用于统计延迟与token分布
+SAMPLE_SIZE = 1000
+
+
+class GenerationProfile:
+    """一组生成参数：max_tokens、temperature和模型（为空时使用DASHSCOPE_MODEL）"""
+
+    __slots__ = ("name", "max_tokens", "temperature", "model")
+
+    def __init__(self, name: str, max_tokens: int, temperature: float, model: Optional[str] = None):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.model = model or None
+
+    def with_min_tokens(self, min_tokens: int) -> "GenerationProfile":
+        """max_tokens不低于min_tokens的副本（名称不变，仍计入原档位）"""
+        if self.max_tokens >= min_tokens:
+            return self
+        return GenerationProfile(self.name, min_tokens, self.temperature, self.model)
+
+    @property
+    def cache_key(self) -> str:
+        """参与回复缓存键的部分：不同参数生成的回复互不复用"""
+        return f"{self.model or ''}|{self.max_tokens}|{self.temperature}"
+
+    def to_dict(self) -> Dict:
+        return {"max_tokens": self.max_tokens, "temperature": self.temperature, "model": self.model}
+
+
+def parse_profiles(spec: str, default: GenerationProfile) -> Dict[str, GenerationProfile]:
+    """解析 `名称:max_tokens:temperature:模型` 的逗号分隔列表，省略或留空的字段沿用默认档位
+
+    例如 `short:400,scene:2000:0.9,fast:300::qwen-turbo`；格式错误时抛出ValueError。
+    """
+    profiles = {DEFAULT_PROFILE: default}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        fields = [field.strip() for field in item.split(":")]
+        if len(fields) > 4 or not fields[0]:
+            raise ValueError(f"生成档位格式错误: {item}")
+        fields += [""] * (4 - len(fields))
+        name, max_tokens, temperature, model = fields
+        try:
+            profile = GenerationProfile(
+                name,
+                int(max_tokens) if max_tokens else default.max_tokens,
+                float(temperature) if temperature else default.temperature,
+                model or default.model,
+            )
+        except ValueError:
+            raise ValueError(f"生成档位格式错误: {item}")
+        if profile.max_tokens <= 0 or not 0 <= profile.temperature < 2:
+            raise ValueError(f"生成档位参数超出范围: {item}")
+        profiles[name] = profile
+    return profiles
+
+
+class GenerationProfiles:
+    """按请求选择生成参数，并按档位统计调用延迟和回复token数
+
+    优先级：请求指定的档位 > 会话当前角色的档位 > 自适应（短消息且不含定时任务时使用adaptive_profile）> 默认档位。
+    附加了任务检测提示词的调用，max_tokens不低于默认档位，保证任务检测块不被截断。
+    """
+
+    def __init__(
+        self,
+        profiles: Dict[str, GenerationProfile],
+        adaptive: bool = False,
+        adaptive_profile: str = "short",
+        short_message_chars: int = 30,
+    ):
+        self.profiles = profiles
+        self.default = profiles[DEFAULT_PROFILE]
+        self.adaptive = adaptive
+        self.adaptive_profile = adaptive_profile
+        self.short_message_chars = short_message_chars
+        if adaptive and adaptive_profile not in profiles:
+            logger.warning(f"自适应生成档位 {adaptive_profile} 未定义，不启用自适应")
+            self.adaptive = False
+        # {档位名: {选择原因: 次数}}
+        self.selections: Dict[str, Dict[str, int]] = {}
+        # {档位名: 最近调用的(耗时, 回复token数)}
+        self._samples: Dict[str, Deque[Tuple[float, int]]] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.profiles
+
+    def select(
+        self,
+        messages: Iterable[str],
+        needs_detection: bool,
+        requested: Optional[str] = None,
+        character_profile: Optional[str] = None,
+    ) -> GenerationProfile:
+        if requested:
+            profile, reason = self.profiles[requested], "request"
+        elif character_profile and character_profile in self.profiles:
+            profile, reason = self.profiles[character_profile], "character"
+        elif self.adaptive and not needs_detection and all(
+                len(message) <= self.short_message_chars for message in messages):
+            profile, reason = self.profiles[self.adaptive_profile], "adaptive"
+        else:
+            if character_profile:
+                logger.warning(f"角色的生成档位 {character_profile} 未定义，使用默认档位")
+            profile, reason = self.default, "default"
+        counts = self.selections.setdefault(profile.name, {})
+        counts[reason] = counts.get(reason, 0) + 1
+        if needs_detection:
+            profile = profile.with_min_tokens(self.default.max_tokens)
+        return profile
+
+    def record(self, profile: GenerationProfile, seconds: float, output_tokens: Optional[int]):
+        """记录一次LLM调用的耗时和回复token数"""
+        samples = self._samples.get(profile.name)
+        if samples is None:
+            samples = self._samples[profile.name] = deque(maxlen=SAMPLE_SIZE)
+        samples.append((seconds, output_tokens or 0))
+
+    def stats(self) -> Dict:
+        profiles = {}
+        for name, profile in self.profiles.items():
+            entry = {**profile.to_dict(), "selected": dict(self.selections.get(name, {}))}
+            samples = self._samples.get(name)
+            if samples:
+                latencies = sorted(seconds for seconds, _ in samples)
+                tokens = sorted(count for _, count in samples)
+                entry.update({
+                    "calls": len(samples),
+                    "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 1),
+                    "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+                    "output_tokens_avg": round(sum(tokens) / len(tokens), 1),
+                    "output_tokens_p95": _percentile(tokens, 0.95),
+                })
+            profiles[name] = entry
+        return {
+            "adaptive": self.adaptive,
+            "adaptive_profile": self.adaptive_profile,
+            "short_message_chars": self.short_message_chars,
+            "profiles": profiles,
+        }
+
+
+def _percentile(values: List, fraction: float):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,531 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# 持久化的消息记录 (role, content)
+StoredMessage = Tuple[str, str]
+
+
+class HistoryBackend:
+    """对话历史持久化后端：写操作进入队列，由后台线程批量落盘，请求路径不等待fsync
+
+    尚未落盘的写操作保存在内存中，读取时叠加到已落盘的数据上，因此读取也不必等待写线程。
+    子类的_write_batch必须在持有_visible_lock时让数据对读取可见并调用_published，
+    保证读取看到的已落盘数据和未落盘操作既不重复也不遗漏。
+    """
+
+    # 是否为多worker共享的状态（见shared_state.py）
+    shared = False
+
+    def __init__(self, flush_interval: float = 0.5, batch_size: int = 256, write_retries: int = 3):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.write_retries = write_retries
+        self._queue: "queue.Queue" = queue.Queue()
+        # 尚未落盘的写操作 {conversation_id: [(操作, 负载)]}，按提交顺序排列
+        self._pending: Dict[str, List[Tuple]] = {}
+        self._pending_lock = threading.Lock()
+        self._visible_lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self.written_ops = 0
+        self.write_errors = 0
+        self.failed_ops = 0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{type(self).__name__}-writer", daemon=True)
+            self._thread.start()
+
+    def append(self, conversation_id: str, role: str, content: str):
+        self._submit(("append", conversation_id, (role, content)))
+
+    def replace(self, conversation_id: str, messages: List[StoredMessage]):
+        self._submit(("replace", conversation_id, messages))
+
+    def trim(self, conversation_id: str, count: int):
+        """删除最旧的count条对话消息（系统提示和摘要除外）"""
+        self._submit(("trim", conversation_id, count))
+
+    def _submit(self, op: Tuple):
+        with self._pending_lock:
+            self._pending.setdefault(op[1], []).append((op[0], op[2]))
+        self._queue.put(op)
+
+    def _published(self, batch: List[Tuple]):
+        """batch已对读取可见（或已放弃写入），从未落盘操作中移除"""
+        with self._pending_lock:
+            for _, conversation_id, _ in batch:
+                ops = self._pending.get(conversation_id)
+                if ops is None:
+                    continue
+                del ops[0]
+                if not ops:
+                    del self._pending[conversation_id]
+
+    def load(self, conversation_id: str) -> Optional[List[StoredMessage]]:
+        """读取会话历史：已落盘的数据加上该会话尚未落盘的写操作"""
+        with self._visible_lock:
+            with self._pending_lock:
+                ops = list(self._pending.get(conversation_id, ()))
+            if ops and ops[-1][0] == "replace":
+                # 最后一次整体替换之前的数据都会被覆盖，无需读盘
+                return list(ops[-1][1]) or None
+            stored = self._load(conversation_id)
+        if not ops:
+            return stored
+        messages = list(stored or ())
+        for op, payload in ops:
+            if op == "append":
+                messages.append(payload)
+            elif op == "trim":
+                messages = _drop_oldest(messages, payload)
+            else:
+                messages = list(payload)
+        return messages or None
+
+    def conversation_ids(self) -> List[str]:
+        """所有有历史记录的会话ID，包括只有未落盘写操作的会话"""
+        with self._visible_lock:
+            with self._pending_lock:
+                pending = list(self._pending)
+            ids = self._conversation_ids()
+        known = set(ids)
+        ids.extend(conversation_id for conversation_id in pending if conversation_id not in known)
+        return ids
+
+    def flush(self, timeout: Optional[float] = None):
+        """等待队列中已有的写操作全部落盘"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(("flush", None, done))
+        done.wait(timeout)
+
+    def close(self):
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(("close", None, done))
+        done.wait()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        self._open_writer()
+        running = True
+        while running:
+            batch = []
+            waiters = []
+            try:
+                op = self._queue.get()
+            except Exception:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if op[0] in ("flush", "close"):
+                    waiters.append(op[2])
+                    if op[0] == "close":
+                        running = False
+                    break
+                batch.append(op)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_with_retry(batch)
+            for waiter in waiters:
+                waiter.set()
+        self._close_writer()
+
+    def _write_with_retry(self, batch: List[Tuple]):
+        """写入一批操作，失败时退避重试；重试用尽后丢弃并计入failed_ops"""
+        for attempt in range(self.write_retries + 1):
+            try:
+                self._write_batch(batch)
+                self.written_ops += len(batch)
+                break
+            except Exception as e:
+                self.write_errors += 1
+                self.last_error = str(e)
+                if attempt == self.write_retries:
+                    logger.error(f"写入对话历史失败，已重试{self.write_retries}次，丢弃{len(batch)}条写操作: {e}")
+                    self.failed_ops += len(batch)
+                    self._published(batch)
+                    return
+                delay = backoff_delay(attempt, self.flush_interval, 5.0)
+                logger.warning(f"写入对话历史失败，{delay:.2f}秒后重试: {e}")
+                time.sleep(delay)
+        try:
+            self._after_batch()
+        except Exception as e:
+            logger.error(f"对话历史写入后处理失败: {e}")
+
+    def _open_writer(self):
+        pass
+
+    def _close_writer(self):
+        pass
+
+    def _write_batch(self, batch: List[Tuple]):
+        """写入一批操作；成功时须在持有_visible_lock时使其可见并调用_published，失败时不留下部分写入"""
+        raise NotImplementedError
+
+    def _after_batch(self):
+        """一批写入成功后的维护工作（例如分段切换），失败不影响已写入的数据"""
+
+    def _load(self, conversation_id: str) -> Optional[List[StoredMessage]]:
+        raise NotImplementedError
+
+    def _conversation_ids(self) -> List[str]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {
+            "backend": type(self).__name__,
+            "queued_ops": self._queue.qsize(),
+            "written_ops": self.written_ops,
+            "write_errors": self.write_errors,
+            "failed_ops": self.failed_ops,
+            "last_error": self.last_error,
+        }
+
+
+class SQLiteHistoryBackend(HistoryBackend):
+    """SQLite（WAL模式）后端：每条消息一行，按会话ID建索引"""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._reader = self._connect(check_same_thread=False)
+        self._reader.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id);
+        """)
+        self._reader_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self.start()
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _open_writer(self):
+        self._writer = self._connect()
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _write_batch(self, batch: List[Tuple]):
+        try:
+            for op, conversation_id, payload in batch:
+                if op == "append":
+                    self._writer.execute(
+                        "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                        (conversation_id, payload[0], payload[1])
+                    )
+                elif op == "trim":
+                    self._writer.execute(
+                        "DELETE FROM messages WHERE id IN ("
+                        "SELECT id FROM messages WHERE conversation_id = ? AND role NOT IN ('system', 'summary') "
+                        "ORDER BY id LIMIT ?)",
+                        (conversation_id, payload)
+                    )
+                elif op == "replace":
+                    self._writer.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                    self._writer.executemany(
+                        "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                        [(conversation_id, role, content) for role, content in payload]
+                    )
+            # WAL模式下提交不等待fsync，持锁时间很短
+            with self._visible_lock:
+                self._writer.commit()
+                self._published(batch)
+        except Exception:
+            self._writer.rollback()
+            raise
+
+    def _load(self, conversation_id: str) -> Optional[List[StoredMessage]]:
+        with self._reader_lock:
+            rows = self._reader.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,)
+            ).fetchall()
+        return rows or None
+
+    def _conversation_ids(self) -> List[str]:
+        with self._reader_lock:
+            rows = self._reader.execute("SELECT DISTINCT conversation_id FROM messages").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        super().close()
+        with self._reader_lock:
+            self._reader.close()
+
+
+class JsonlHistoryBackend(HistoryBackend):
+    """仅追加的JSONL分段日志后端
+
+    每行格式为 `<会话ID的JSON>\\t<操作>\\t<负载JSON>`，操作a为追加一条消息，t为删除最旧的若干条对话消息，
+    r为整体替换。
+    启动时只扫描行首的会话ID建立偏移索引，不解析消息内容；真正用到某个会话时才按偏移读取。
+    分段数超过上限时在写线程中压缩为只含当前状态的新分段。
+    """
+
+    OP_CODES = {"append": "a", "trim": "t", "replace": "r"}
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".jsonl"
+
+    def __init__(self, directory: str, segment_max_bytes: int = 64 * 1024 * 1024, max_segments: int = 8, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+        self._index_lock = threading.RLock()
+        # {会话ID的JSON编码: array[(分段号 << 40) | 偏移]}，只保留最近一次替换之后的记录
+        self._index: Dict[bytes, array] = {}
+        self._segments: List[int] = []
+        self._build_index()
+        self._current = None
+        self._current_no = 0
+        self._current_size = 0
+        self.start()
+
+    def _segment_path(self, segment_no: int) -> str:
+        return os.path.join(self.directory, f"{self.SEGMENT_PREFIX}{segment_no:06d}{self.SEGMENT_SUFFIX}")
+
+    def _build_index(self):
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX)
+        )
+        for name in names:
+            segment_no = int(name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)])
+            self._segments.append(segment_no)
+            offset = 0
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # 末尾的不完整行（写入时进程被杀），忽略
+                        break
+                    key, op, _ = line.split(b"\t", 2)
+                    self._index_entry(key, op, segment_no, offset)
+                    offset += len(line)
+
+    def _index_entry(self, key: bytes, op: bytes, segment_no: int, offset: int):
+        position = (segment_no << 40) | offset
+        if op == b"r":
+            self._index[key] = array('q', [position])
+        else:
+            positions = self._index.get(key)
+            if positions is None:
+                self._index[key] = array('q', [position])
+            else:
+                positions.append(position)
+
+    def _open_writer(self):
+        self._current_no = (self._segments[-1] + 1) if self._segments else 1
+        self._open_segment(self._current_no)
+
+    def _open_segment(self, segment_no: int):
+        self._current = open(self._segment_path(segment_no), 'ab')
+        self._current_no = segment_no
+        self._current_size = self._current.tell()
+        with self._index_lock:
+            if segment_no not in self._segments:
+                self._segments.append(segment_no)
+
+    def _close_writer(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+    @staticmethod
+    def _encode(conversation_id: str, op: str, payload) -> Tuple[bytes, bytes]:
+        key = json.dumps(conversation_id).encode('utf-8')
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        return key, key + b"\t" + op.encode('ascii') + b"\t" + body + b"\n"
+
+    def _write_batch(self, batch: List[Tuple]):
+        entries = []
+        chunks = []
+        offset = self._current_size
+        for op, conversation_id, payload in batch:
+            code = self.OP_CODES[op]
+            key, line = self._encode(conversation_id, code, payload)
+            entries.append((key, code.encode('ascii'), offset))
+            chunks.append(line)
+            offset += len(line)
+        try:
+            self._current.write(b"".join(chunks))
+            self._current.flush()
+            os.fsync(self._current.fileno())
+        except Exception:
+            self._truncate_segment()
+            raise
+        self._current_size = offset
+        with self._visible_lock, self._index_lock:
+            for key, code, line_offset in entries:
+                self._index_entry(key, code, self._current_no, line_offset)
+            self._published(batch)
+
+    def _truncate_segment(self):
+        """写入失败后把当前分段截断回最后一次成功写入的位置，避免残留半行与偏移索引错位"""
+        path = self._segment_path(self._current_no)
+        try:
+            self._current.close()
+        except Exception:
+            # 关闭时可能再次写出缓冲区中的残留数据，下面的截断会一并去掉
+            pass
+        try:
+            os.truncate(path, self._current_size)
+        finally:
+            # 截断失败时以文件的实际大小为准，保证后续偏移与文件内容一致
+            self._current = open(path, 'ab')
+            self._current_size = self._current.tell()
+
+    def _after_batch(self):
+        if self._current_size >= self.segment_max_bytes:
+            self._current.close()
+            self._open_segment(self._current_no + 1)
+            if len(self._segments) > self.max_segments:
+                self._compact()
+
+    def _read_positions(self, positions: array, handles: Dict[int, object]) -> List[StoredMessage]:
+        messages: List[StoredMessage] = []
+        for position in positions:
+            segment_no, offset = position >> 40, position & ((1 << 40) - 1)
+            handle = handles.get(segment_no)
+            if handle is None:
+                handle = handles[segment_no] = open(self._segment_path(segment_no), 'rb')
+            handle.seek(offset)
+            _, op, body = handle.readline().split(b"\t", 2)
+            payload = json.loads(body)
+            if op == b"r":
+                messages = [tuple(message) for message in payload]
+            elif op == b"t":
+                messages = _drop_oldest(messages, payload)
+            else:
+                messages.append(tuple(payload))
+        return messages
+
+    def _load(self, conversation_id: str) -> Optional[List[StoredMessage]]:
+        key = json.dumps(conversation_id).encode('utf-8')
+        handles: Dict[int, object] = {}
+        try:
+            with self._index_lock:
+                positions = self._index.get(key)
+                if positions is None:
+                    return None
+                messages = self._read_positions(positions, handles)
+        finally:
+            for handle in handles.values():
+                handle.close()
+        return messages or None
+
+    def _conversation_ids(self) -> List[str]:
+        # 被清除的会话仍在索引中（最后一条记录为空的替换），导出时读到空历史会跳过
+        with self._index_lock:
+            keys = list(self._index)
+        return [json.loads(key) for key in keys]
+
+    def _compact(self):
+        """将旧分段中每个会话的当前状态写入新分段，然后删除旧分段"""
+        start = time.perf_counter()
+        with self._index_lock:
+            keys = list(self._index.keys())
+            old_segments = [no for no in self._segments if no != self._current_no]
+        compact_no = self._current_no
+        self._current.close()
+        self._current = None
+        compact_path = self._segment_path(compact_no) + ".compact"
+        handles: Dict[int, object] = {}
+        new_index: Dict[bytes, array] = {}
+        try:
+            with open(compact_path, 'wb') as out:
+                offset = 0
+                for key in keys:
+                    with self._index_lock:
+                        positions = self._index.get(key)
+                    messages = self._read_positions(positions, handles) if positions is not None else []
+                    if not messages:
+                        continue
+                    body = json.dumps(messages, ensure_ascii=False).encode('utf-8')
+                    line = key + b"\tr\t" + body + b"\n"
+                    out.write(line)
+                    new_index[key] = array('q', [(compact_no << 40) | offset])
+                    offset += len(line)
+                out.flush()
+                os.fsync(out.fileno())
+        finally:
+            for handle in handles.values():
+                handle.close()
+        with self._index_lock:
+            os.replace(compact_path, self._segment_path(compact_no))
+            self._index = new_index
+            for segment_no in old_segments:
+                try:
+                    os.unlink(self._segment_path(segment_no))
+                except OSError:
+                    pass
+            self._segments = [compact_no]
+        self._open_segment(compact_no)
+        logger.info(f"对话日志压缩完成: {len(new_index)} 个会话，耗时 {time.perf_counter() - start:.2f}s")
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self._index_lock:
+            stats.update({"segments": len(self._segments), "indexed_conversations": len(self._index)})
+        return stats
+
+
+def _drop_oldest(messages: List[StoredMessage], count: int) -> List[StoredMessage]:
+    """删除最旧的count条对话消息（系统提示和摘要除外）"""
+    kept = []
+    for message in messages:
+        if count > 0 and message[0] not in ("system", "summary"):
+            count -= 1
+            continue
+        kept.append(message)
+    return kept
+
+
+def create_history_backend(kind: str, path: Optional[str], flush_interval: float, batch_size: int) -> Optional[HistoryBackend]:
+    """根据配置创建持久化后端，memory表示不持久化"""
+    kind = (kind or "memory").lower()
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        return SQLiteHistoryBackend(path or "data/history.db", flush_interval=flush_interval, batch_size=batch_size)
+    if kind == "jsonl":
+        return JsonlHistoryBackend(path or "data/history_log", flush_interval=flush_interval, batch_size=batch_size)
+    raise ValueError(f"未知的对话历史后端: {kind}")
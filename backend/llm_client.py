@@ -0,0 +1,347 @@
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request
+
+from config import config
+from resilience import RETRYABLE_STATUS_CODES, CircuitBreaker, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# 断开检测轮询间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class LLMTimeoutError(Exception):
+    """LLM调用超时"""
+
+
+class ClientDisconnectedError(Exception):
+    """调用方在LLM返回前断开连接"""
+
+
+class LLMResponseError(Exception):
+    """DashScope返回非200状态"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"DashScope API调用失败: {message}")
+        self.status_code = status_code
+
+
+class LLMUnavailableError(Exception):
+    """所有模型均处于熔断状态或重试后仍无法连接"""
+
+
+# 视为上游临时故障的连接错误，导入SDK后加入aiohttp.ClientError
+CONNECTION_ERRORS: Tuple[type, ...] = (ConnectionError,)
+
+# DashScope的AioGeneration，首次使用时才导入（SDK及其依赖的aiohttp占启动导入耗时的近一半）
+_aio_generation = None
+
+
+def load_dashscope():
+    """导入DashScope SDK并应用全局配置，只在第一次调用时导入"""
+    global _aio_generation, CONNECTION_ERRORS
+    if _aio_generation is None:
+        import aiohttp
+        import dashscope
+        from dashscope import AioGeneration
+
+        dashscope.api_key = config.DASHSCOPE_API_KEY
+        if config.DASHSCOPE_BASE_URL:
+            dashscope.base_http_api_url = config.DASHSCOPE_BASE_URL
+        CONNECTION_ERRORS = (aiohttp.ClientError, ConnectionError)
+        _aio_generation = AioGeneration
+    return _aio_generation
+
+
+class LLMClient:
+    """DashScope异步调用封装：限制并发数、为每次调用设置超时，并在上游故障时重试、熔断和切换备用模型
+
+    限流、5xx和连接错误按指数退避（全抖动）重试retry_attempts次，仍失败时依次换用fallback_models；
+    每个模型有独立的熔断器，熔断中的模型直接跳过，全部不可用时立即失败。
+    超时不重试（计入熔断），以免单个请求的等待时间成倍增加；流式调用只在产出第一段文本之前重试。
+    重试等待期间不占用并发名额。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        timeout: float,
+        retry_attempts: int = 0,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 5.0,
+        breaker_failure_threshold: int = 0,
+        breaker_reset_timeout: float = 30.0,
+        fallback_models: Iterable[str] = (),
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retry_attempts = retry_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.fallback_models = list(fallback_models)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.in_flight = 0
+        self.waiting = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self._loading: Optional[asyncio.Future] = None
+
+    @property
+    def ready(self) -> bool:
+        """DashScope SDK是否已导入"""
+        return _aio_generation is not None
+
+    async def warm_up(self):
+        """在线程中导入DashScope SDK，不阻塞事件循环；并发调用共用同一次导入"""
+        if _aio_generation is not None:
+            return _aio_generation
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(asyncio.to_thread(load_dashscope))
+        try:
+            return await asyncio.shield(self._loading)
+        except Exception:
+            self._loading = None
+            raise
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = CircuitBreaker(self.breaker_failure_threshold, self.breaker_reset_timeout)
+        return breaker
+
+    def _models(self, model: Optional[str]) -> List[str]:
+        models = [model or config.DASHSCOPE_MODEL]
+        models.extend(m for m in self.fallback_models if m not in models)
+        return models
+
+    async def _attempts(self, model: Optional[str]) -> AsyncIterator[Tuple[str, CircuitBreaker]]:
+        """依次产出本次调用要尝试的(模型, 熔断器)：同一模型重试前按退避等待，熔断中的模型跳过"""
+        for index, candidate in enumerate(self._models(model)):
+            breaker = self._breaker(candidate)
+            for attempt in range(self.retry_attempts + 1):
+                if not breaker.allow():
+                    break
+                if attempt:
+                    self.retries += 1
+                    await asyncio.sleep(backoff_delay(attempt - 1, self.retry_base_delay, self.retry_max_delay))
+                elif index:
+                    self.fallbacks += 1
+                    logger.warning(f"切换到备用模型 {candidate}")
+                yield candidate, breaker
+
+    async def generate(
+        self,
+        messages: List[Dict],
+        model: Optional[str] = None,
+        max_tokens: int = 1500,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """调用Generation接口，返回DashScope响应对象
+
+        重试和备用模型都失败时返回最后一次的失败响应；没有任何模型可调用时抛出LLMUnavailableError。
+        """
+        last_response = None
+        last_error: Optional[BaseException] = None
+        async with aclosing(self._attempts(model)) as attempts:
+            async for candidate, breaker in attempts:
+                try:
+                    response = await self._generate_once(candidate, messages, max_tokens, temperature, timeout)
+                except LLMTimeoutError:
+                    breaker.record_failure()
+                    raise
+                except CONNECTION_ERRORS as e:
+                    breaker.record_failure()
+                    last_error = e
+                    logger.warning(f"DashScope连接失败（{candidate}）: {e}")
+                    continue
+                except BaseException:
+                    breaker.release()
+                    raise
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    breaker.record_failure()
+                    last_response = response
+                    logger.warning(f"DashScope调用失败（{candidate}，{response.status_code}）: {response.message}")
+                    continue
+                breaker.record_success()
+                return response
+        if last_response is not None:
+            return last_response
+        raise LLMUnavailableError(f"DashScope暂不可用: {last_error or '所有模型均处于熔断状态'}")
+
+    async def _generate_once(
+        self,
+        model: str,
+        messages: List[Dict],
+        max_tokens: int,
+        temperature: float,
+        timeout: Optional[float],
+    ) -> Any:
+        generation = await self.warm_up()
+        timeout = self.timeout if timeout is None else timeout
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            return await asyncio.wait_for(
+                generation.call(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    result_format='message'
+                ),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"DashScope API调用超时（{timeout}秒）")
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def stream(
+        self,
+        messages: List[Dict],
+        model: Optional[str] = None,
+        max_tokens: int = 1500,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        usage: Optional[Dict] = None,
+    ) -> AsyncIterator[str]:
+        """流式调用Generation接口，逐段产出增量文本；超时按整个流计算
+
+        传入usage字典时，用每个分片携带的token用量（input_tokens、output_tokens）更新它。
+        """
+        last_error: Optional[BaseException] = None
+        async with aclosing(self._attempts(model)) as attempts:
+            async for candidate, breaker in attempts:
+                started = False
+                try:
+                    async with aclosing(self._stream_once(
+                        candidate, messages, max_tokens, temperature, timeout, usage
+                    )) as deltas:
+                        async for delta in deltas:
+                            started = True
+                            yield delta
+                except LLMTimeoutError:
+                    breaker.record_failure()
+                    raise
+                except (LLMResponseError, *CONNECTION_ERRORS) as e:
+                    retryable = not isinstance(e, LLMResponseError) or e.status_code in RETRYABLE_STATUS_CODES
+                    if retryable:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    if started or not retryable:
+                        raise
+                    last_error = e
+                    logger.warning(f"DashScope流式调用失败（{candidate}）: {e}")
+                    continue
+                except BaseException:
+                    breaker.release()
+                    raise
+                breaker.record_success()
+                return
+        raise LLMUnavailableError(f"DashScope暂不可用: {last_error or '所有模型均处于熔断状态'}")
+
+    async def _stream_once(
+        self,
+        model: str,
+        messages: List[Dict],
+        max_tokens: int,
+        temperature: float,
+        timeout: Optional[float],
+        usage: Optional[Dict],
+    ) -> AsyncIterator[str]:
+        generation = await self.warm_up()
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = loop.time() + timeout
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        responses = None
+        try:
+            responses = await asyncio.wait_for(
+                generation.call(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    result_format='message',
+                    stream=True,
+                    incremental_output=True
+                ),
+                timeout=max(0.0, deadline - loop.time())
+            )
+            while True:
+                try:
+                    response = await asyncio.wait_for(responses.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                if response.status_code != 200:
+                    raise LLMResponseError(response.status_code, response.message)
+                if usage is not None and response.usage:
+                    usage.update(response.usage)
+                delta = response.output.choices[0].message.content
+                if delta:
+                    yield delta
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"DashScope API调用超时（{timeout}秒）")
+        finally:
+            if responses is not None:
+                await responses.aclose()
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+            "breakers": {model: breaker.stats() for model, breaker in self._breakers.items()},
+        }
+
+
+async def run_until_disconnected(http_request: Request, coro: Awaitable, poll_interval: float = DISCONNECT_POLL_INTERVAL):
+    """执行协程，若调用方提前断开连接则取消它"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                task.cancel()
+                logger.info("调用方已断开连接，取消LLM调用")
+                raise ClientDisconnectedError("客户端已断开连接")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+llm_client = LLMClient(
+    config.LLM_MAX_CONCURRENCY,
+    config.LLM_TIMEOUT,
+    retry_attempts=config.LLM_RETRY_ATTEMPTS,
+    retry_base_delay=config.LLM_RETRY_BASE_DELAY,
+    retry_max_delay=config.LLM_RETRY_MAX_DELAY,
+    breaker_failure_threshold=config.LLM_BREAKER_FAILURE_THRESHOLD,
+    breaker_reset_timeout=config.LLM_BREAKER_RESET_TIMEOUT,
+    fallback_models=config.LLM_FALLBACK_MODELS
+)
@@ -1,14 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, List, Optional, Tuple
-import dashscope
 from config import config
+from llm_client import llm_client, run_until_disconnected
+from character_registry import CharacterRegistry
+from conversation_store import ConversationStore
+from history_backend import create_history_backend
+from shared_state import create_shared_state
+from tokenizer import get_token_counter
+from summarizer import ConversationSummarizer
+from conversation_coordinator import ConversationCoordinator
+from response_cache import ResponseCache
+from admission import AdmissionController, OverloadedError, RateLimiter, acquire_all
+from metrics import Metrics, MetricsMiddleware
+from prompt_cache import PromptCache, PromptPrefix, prompt_digest
+from task_scheduler import TaskScheduler
+from snapshot import SnapshotError, export_snapshot, import_snapshot
+from generation_profiles import GenerationProfile, GenerationProfiles, parse_profiles
+from task_detection import TASK_DETECTION_SYSTEM_PROMPT, TaskInfoStreamParser, TaskPreClassifier, parse_task_info
+import asyncio
 import logging
+import math
 import time
 import re
 import json
-import os
+from collections import deque
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -25,118 +43,220 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 配置DashScope API Key
-dashscope.api_key = config.DASHSCOPE_API_KEY
+# Prometheus指标（可选），关闭时各记录点为空操作
+metrics = Metrics(enabled=config.METRICS_ENABLED)
 
-# 存储对话历史 {conversation_id: [messages]}
-conversation_store: Dict[str, List[Dict]] = {}
+# 多worker共享状态（可选），启用时替代HISTORY_BACKEND
+shared_state = create_shared_state(config.SHARED_STATE, config.SHARED_STATE_PATH)
+if config.WORKERS > 1 and shared_state is None and not config.WORKER_AFFINITY:
+    logger.warning("多worker部署未配置SHARED_STATE，各worker的对话历史互不可见")
+
+token_counter = get_token_counter(config.TOKENIZER, config.DASHSCOPE_MODEL)
+
+# 编译好的角色系统消息，使用同一角色的会话共享同一份前缀
+prompt_cache = PromptCache(token_counter)
+
+# 存储对话历史（有界，按会话数/空闲时间/内存预算淘汰）
+conversation_store = ConversationStore(
+    max_history=config.MAX_CONVERSATION_HISTORY,
+    max_conversations=config.MAX_CONVERSATIONS,
+    ttl=config.CONVERSATION_TTL,
+    max_bytes=config.CONVERSATION_MAX_BYTES,
+    token_budget=config.CONTEXT_TOKEN_BUDGET,
+    token_counter=token_counter,
+    prompt_cache=prompt_cache,
+    backend=shared_state or create_history_backend(
+        config.HISTORY_BACKEND,
+        config.HISTORY_PATH,
+        flush_interval=config.HISTORY_FLUSH_INTERVAL,
+        batch_size=config.HISTORY_BATCH_SIZE
+    )
+)
+
+# 同一会话的请求串行处理（可选合并突发消息）
+conversation_coordinator = ConversationCoordinator(
+    coalesce=config.CONVERSATION_COALESCE,
+    max_batch=config.COALESCE_MAX_BATCH
+)
+
+# 任务检测预分类：只有可能包含定时任务需求的消息才附加任务检测提示词
+task_classifier = TaskPreClassifier(
+    enabled=config.TASK_PRECLASSIFIER,
+    prompt_tokens=conversation_store.count_tokens(TASK_DETECTION_SYSTEM_PROMPT)
+)
+
+# 按用户和会话的令牌桶限流（可选）
+user_rate_limiter = RateLimiter(config.RATE_LIMIT_USER_PER_MINUTE / 60, config.RATE_LIMIT_USER_BURST)
+conversation_rate_limiter = RateLimiter(
+    config.RATE_LIMIT_CONVERSATION_PER_MINUTE / 60, config.RATE_LIMIT_CONVERSATION_BURST
+)
+
+# 准入控制（可选）：全局并发上限，超出时按会话轮转排队，排队已满或超时立即返回繁忙
+admission = AdmissionController(
+    max_in_flight=config.ADMISSION_MAX_IN_FLIGHT,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    max_queue_per_conversation=config.ADMISSION_MAX_QUEUE_PER_CONVERSATION,
+    queue_timeout=config.ADMISSION_QUEUE_TIMEOUT
+)
+
+# 重复提问的回复缓存（可选）
+response_cache = ResponseCache(
+    max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=config.RESPONSE_CACHE_TTL,
+    context_messages=config.RESPONSE_CACHE_CONTEXT_MESSAGES,
+    disabled_characters=config.RESPONSE_CACHE_DISABLED_CHARACTERS
+) if config.RESPONSE_CACHE_ENABLED else None
+
+# 后端定时任务调度（可选），关闭时task_info仍原样返回给插件自行注册
+task_scheduler = TaskScheduler(
+    config.SCHEDULER_PATH,
+    lease=config.SCHEDULER_LEASE,
+    misfire_grace=config.SCHEDULER_MISFIRE_GRACE
+) if config.SCHEDULER_ENABLED else None
+
+# 生成参数档位：按请求、角色或自适应规则选择max_tokens、temperature和模型
+generation_profiles = GenerationProfiles(
+    parse_profiles(
+        config.GENERATION_PROFILES,
+        GenerationProfile("default", config.GENERATION_MAX_TOKENS, config.GENERATION_TEMPERATURE)
+    ),
+    adaptive=config.GENERATION_ADAPTIVE,
+    adaptive_profile=config.GENERATION_ADAPTIVE_PROFILE,
+    short_message_chars=config.GENERATION_SHORT_MESSAGE_CHARS
+)
+
+# 流式接口最近的首字延迟样本（秒）
+ttft_samples: deque = deque(maxlen=1000)
+
+# 滚动摘要（可选）
+summarizer = ConversationSummarizer(
+    conversation_store,
+    llm_client,
+    trigger_tokens=config.SUMMARY_TRIGGER_TOKENS,
+    keep_recent=config.SUMMARY_KEEP_RECENT,
+    max_tokens=config.SUMMARY_MAX_TOKENS,
+    model=config.SUMMARY_MODEL
+) if config.SUMMARY_ENABLED else None
+
+# 抓取时计算的仪表：进行中的请求、LLM并发、对话存储占用
+metrics.register_gauge("http_requests_in_flight", "进行中的HTTP请求数", lambda: {(): metrics.http_in_flight})
+metrics.register_gauge(
+    "llm_calls", "LLM调用数（in_flight进行中，waiting等待并发名额）",
+    lambda: {("in_flight",): llm_client.in_flight, ("waiting",): llm_client.waiting},
+    ("state",)
+)
+metrics.register_gauge(
+    "admission", "准入控制（in_flight处理中，waiting排队中）",
+    lambda: {("in_flight",): admission.in_flight, ("waiting",): admission.waiting},
+    ("state",)
+)
+metrics.register_gauge(
+    "llm_circuit_open", "模型是否处于熔断状态（1为熔断或半开）",
+    lambda: {(model,): int(state["state"] != "closed") for model, state in llm_client.stats()["breakers"].items()},
+    ("model",)
+)
+metrics.register_gauge(
+    "conversation_store", "内存中的对话存储占用",
+    lambda: {(key,): value for key, value in conversation_store.stats().items()
+             if key in ("conversations", "messages", "approx_tokens", "approx_bytes")},
+    ("resource",)
+)
 
 # 角色数据文件路径
 CHARACTERS_FILE = "characters.json"
 
-def load_characters() -> Dict:
-    """加载角色数据"""
-    try:
-        if os.path.exists(CHARACTERS_FILE):
-            with open(CHARACTERS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # 兼容旧版本格式，如果存在current_character则转换为新格式
-                if "current_character" in data and "session_characters" not in data:
-                    logger.info("检测到旧版本角色数据格式，正在转换为会话级格式")
-                    old_current = data.pop("current_character", "default")
-                    data["session_characters"] = {"default": old_current}
-                    save_characters(data)
-                return data
-        else:
-            # 如果文件不存在，创建默认角色数据
-            default_data = {
-                "session_characters": {},  # 会话级角色映射
-                "characters": {
-                    "default": {
-                        "name": "默认助手",
-                        "description": config.SYSTEM_PROMPT
-                    }
-                }
-            }
-            save_characters(default_data)
-            return default_data
-    except Exception as e:
-        logger.error(f"加载角色数据失败: {e}")
-        # 返回默认数据
-        return {
-            "session_characters": {},
-            "characters": {
-                "default": {
-                    "name": "默认助手",
-                    "description": config.SYSTEM_PROMPT
-                }
-            }
-        }
-
-def save_characters(data: Dict) -> bool:
-    """保存角色数据"""
-    try:
-        with open(CHARACTERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        logger.error(f"保存角色数据失败: {e}")
-        return False
+character_registry = CharacterRegistry(
+    CHARACTERS_FILE,
+    default_description=config.SYSTEM_PROMPT,
+    save_delay=config.CHARACTERS_SAVE_DELAY,
+    reload_interval=config.CHARACTERS_RELOAD_INTERVAL,
+    shared=config.WORKERS > 1
+)
 
-def get_current_character_description(conversation_id: str = "default") -> str:
-    """获取指定会话的当前角色描述（系统提示词）"""
+def get_current_character_prompt(conversation_id: str = "default") -> PromptPrefix:
+    """获取指定会话当前角色编译好的系统消息前缀，角色描述未变化时直接命中缓存"""
     try:
-        data = load_characters()
-        session_characters = data.get("session_characters", {})
-        characters = data.get("characters", {})
-        
-        # 获取该会话的当前角色，如果没有设置则使用default
-        current_char = session_characters.get(conversation_id, "default")
-        
-        if current_char in characters:
-            return characters[current_char]["description"]
-        else:
-            # 如果当前角色不存在，使用默认角色
-            return characters.get("default", {}).get("description", config.SYSTEM_PROMPT)
+        with metrics.stage("character_lookup"):
+            return prompt_cache.get(*character_registry.get_prompt(conversation_id))
     except Exception as e:
         logger.error(f"获取当前角色描述失败: {e}")
-        return config.SYSTEM_PROMPT
+        return prompt_cache.get("", prompt_digest(config.SYSTEM_PROMPT), config.SYSTEM_PROMPT)
 
 def get_session_current_character(conversation_id: str = "default") -> str:
     """获取指定会话的当前角色名"""
     try:
-        data = load_characters()
-        session_characters = data.get("session_characters", {})
-        return session_characters.get(conversation_id, "default")
+        return character_registry.get_session_character(conversation_id)
     except Exception as e:
         logger.error(f"获取会话角色失败: {e}")
         return "default"
 
 def set_session_character(conversation_id: str, character_name: str) -> bool:
-    """设置指定会话的角色"""
+    """设置指定会话的角色（写入防抖，稍后原子落盘）"""
     try:
-        data = load_characters()
-        if "session_characters" not in data:
-            data["session_characters"] = {}
-        
-        data["session_characters"][conversation_id] = character_name
-        return save_characters(data)
+        character_registry.set_session_character(conversation_id, character_name)
+        return True
     except Exception as e:
         logger.error(f"设置会话角色失败: {e}")
         return False
 
+def record_llm_usage(conversation_id: str, usage: Optional[Dict]):
+    """按会话当前角色记录一次LLM调用的token用量"""
+    if metrics.enabled and usage:
+        metrics.record_tokens(
+            get_session_current_character(conversation_id),
+            usage.get("input_tokens"),
+            usage.get("output_tokens")
+        )
+
+def record_generation(profile: GenerationProfile, seconds: float, usage: Optional[Dict]):
+    """按生成档位记录一次LLM调用的耗时和回复token数"""
+    output_tokens = usage.get("output_tokens") if usage else None
+    generation_profiles.record(profile, seconds, output_tokens)
+    metrics.record_generation(profile.name, seconds, output_tokens)
+
+def select_generation_profile(requests: List["ChatRequest"], needs_detection: bool) -> GenerationProfile:
+    """为同一会话的一批消息选择生成参数，请求指定的档位以最后一条消息为准"""
+    request = requests[-1]
+    try:
+        character_profile = character_registry.get_generation_profile(request.conversation_id)
+    except Exception as e:
+        logger.error(f"获取角色生成档位失败: {e}")
+        character_profile = None
+    return generation_profiles.select(
+        (item.message for item in requests),
+        needs_detection,
+        requested=request.generation_profile,
+        character_profile=character_profile
+    )
+
 class ChatRequest(BaseModel):
     user_id: str
     user_name: str = ""
     message: str
     conversation_id: str = "default"
     user_permission: int = 0  # 新增：用户权限等级
+    generation_profile: Optional[str] = None  # 生成参数档位，为空时按角色或自适应规则选择
+    backend_tasks: bool = False  # 客户端会轮询/tasks/due发送提醒，检测到的定时任务交由后端保存和调度
 
 class ChatResponse(BaseModel):
     reply: str
     success: bool
     error: Optional[str] = None
     task_info: Optional[Dict] = None  # 新增：定时任务信息
+    coalesced: bool = False  # 已合并到同一会话的其他请求中，回复由该请求返回
+    cached: bool = False  # 回复来自缓存
+
+class ChatBatchRequest(BaseModel):
+    requests: List[ChatRequest]
+
+class ChatBatchResult(ChatResponse):
+    status: int = 200  # 该条消息对应的HTTP状态码，输入不合法时为400等
+
+class ChatBatchResponse(BaseModel):
+    success: bool  # 所有消息均处理成功
+    results: List[ChatBatchResult]  # 与请求顺序一致
+    succeeded: int
+    failed: int
 
 class ClearHistoryRequest(BaseModel):
     conversation_id: str = "default"
@@ -145,10 +265,19 @@ class ClearHistoryResponse(BaseModel):
     success: bool
     message: str
 
+class ImportSnapshotResponse(BaseModel):
+    success: bool
+    conversations: int = 0
+    characters: int = 0
+    sessions: int = 0
+    messages: int = 0
+    error: Optional[str] = None
+
 # 新增：角色系统相关的数据模型
 class Character(BaseModel):
     name: str
     description: str
+    generation_profile: Optional[str] = None
 
 class CharacterListRequest(BaseModel):
     conversation_id: str = "default"
@@ -174,6 +303,11 @@ class SetCharacterResponse(BaseModel):
 class AddCharacterRequest(BaseModel):
     character_name: str
     character_description: str
+    generation_profile: Optional[str] = None
+
+class SetCharacterProfileRequest(BaseModel):
+    character_name: str
+    generation_profile: Optional[str] = None  # 为空时取消，按自适应规则或默认档位选择
 
 class AddCharacterResponse(BaseModel):
     success: bool
@@ -181,194 +315,454 @@ class AddCharacterResponse(BaseModel):
     character: Optional[Character] = None
     error: Optional[str] = None
 
-# 新增：定时任务相关的提示词
-TASK_DETECTION_SYSTEM_PROMPT = """
-你是一个智能助手，除了正常聊天外，还需要识别用户消息中是否包含定时任务需求。
-
-请在回复用户消息后，额外输出一个特殊的任务检测标记：
-[TASK_DETECTION_START]
-{
-  "has_task": true/false,
-  "task_type": "cron" 或 "daily" 或 null,
-  "task_value": "cron表达式" 或 "时间格式HH:MM" 或 null,
-  "task_description": "任务描述" 或 null,
-  "task_action": "任务要执行的动作" 或 null
-}
-[TASK_DETECTION_END]
-
-识别规则：
-1. 定时任务需要60级或以上权限才能创建
-2. 识别关键词：定时、每天、每小时、每分钟、提醒、通知、任务等
-3. 时间表达：
-   - "每天8:30" -> task_type="daily", task_value="08:30"
-   - "每5分钟" -> task_type="cron", task_value="*/5 * * * *"
-   - "每小时" -> task_type="cron", task_value="0 * * * *"
-   - "每天中午12点" -> task_type="daily", task_value="12:00"
-
-示例：
-用户说："每天早上8点提醒我吃药"
-你应该回复："好的，我会为你设置每天早上8点的吃药提醒。[TASK_DETECTION_START]{"has_task": true, "task_type": "daily", "task_value": "08:00", "task_description": "每天早上8点吃药提醒", "task_action": "提醒吃药"}[TASK_DETECTION_END]"
-
-如果用户只是普通聊天，则：
-[TASK_DETECTION_START]{"has_task": false, "task_type": null, "task_value": null, "task_description": null, "task_action": null}[TASK_DETECTION_END]
-"""
-
-def get_conversation_history(conversation_id: str) -> List[Dict]:
-    """获取对话历史"""
-    if conversation_id not in conversation_store:
-        conversation_store[conversation_id] = []
-    return conversation_store[conversation_id]
-
-def add_message_to_history(conversation_id: str, role: str, content: str, user_id: str = "", user_name: str = ""):
-    """添加消息到对话历史"""
-    history = get_conversation_history(conversation_id)
-    message_data = {"role": role, "content": content}
-    
-    # 如果是用户消息，添加用户信息
-    if role == "user" and user_id:
-        if user_name:
-            message_data["content"] = f"[用户 {user_name}({user_id})]: {content}"
-        else:
-            message_data["content"] = f"[用户 {user_id}]: {content}"
-    
-    history.append(message_data)
-    
-    # 限制历史记录长度
-    if len(history) > config.MAX_CONVERSATION_HISTORY:
-        # 保留系统消息和最近的对话
-        system_messages = [msg for msg in history if msg["role"] == "system"]
-        recent_messages = history[-config.MAX_CONVERSATION_HISTORY:]
-        history = system_messages + recent_messages
-        conversation_store[conversation_id] = history
-
-def clear_conversation_history(conversation_id: str):
-    """清除对话历史"""
-    if conversation_id in conversation_store:
-        conversation_store[conversation_id] = []
+# 定时任务相关的数据模型
+class TaskListRequest(BaseModel):
+    conversation_id: Optional[str] = None  # 为空时返回所有会话的任务
+
+class TaskListResponse(BaseModel):
+    success: bool
+    tasks: List[Dict] = []
+    error: Optional[str] = None
+
+class DeleteTaskRequest(BaseModel):
+    task_id: Optional[str] = None
+    conversation_id: Optional[str] = None  # 未指定task_id时删除该会话的所有任务
+
+class DeleteTaskResponse(BaseModel):
+    success: bool
+    deleted: int = 0
+    error: Optional[str] = None
+
+class DueTasksResponse(BaseModel):
+    success: bool
+    deliveries: List[Dict] = []
+    error: Optional[str] = None
+
+class AckTasksRequest(BaseModel):
+    delivery_ids: List[int]
 
-def parse_task_info(ai_response: str) -> Tuple[str, Optional[Dict]]:
-    """解析AI回复中的任务信息"""
+class AckTasksResponse(BaseModel):
+    success: bool
+    acked: int = 0
+    error: Optional[str] = None
+
+def format_user_message(content: str, user_id: str = "", user_name: str = "") -> str:
+    """为用户消息添加用户信息前缀"""
+    if not user_id:
+        return content
+    if user_name:
+        return f"[用户 {user_name}({user_id})]: {content}"
+    return f"[用户 {user_id}]: {content}"
+
+@app.on_event("startup")
+async def start_scheduler():
+    """启动定时任务调度循环"""
+    if task_scheduler is not None:
+        task_scheduler.start()
+
+# 就绪状态：DashScope SDK和角色数据在启动后于后台加载，完成前/health报告warming、/health/ready返回503
+readiness = {"ready": False, "error": None, "warmup_seconds": None}
+warmup_task: Optional[asyncio.Task] = None
+
+async def warm_up():
+    """后台预热：导入DashScope SDK、加载角色数据（首次加载可能创建或迁移characters.json）"""
+    start = time.perf_counter()
     try:
-        # 查找任务检测标记
-        start_marker = "[TASK_DETECTION_START]"
-        end_marker = "[TASK_DETECTION_END]"
-        
-        start_pos = ai_response.find(start_marker)
-        end_pos = ai_response.find(end_marker)
-        
-        if start_pos == -1 or end_pos == -1:
-            return ai_response, None
-        
-        # 提取任务信息JSON
-        task_json_str = ai_response[start_pos + len(start_marker):end_pos].strip()
-        task_info = json.loads(task_json_str)
-        
-        # 移除AI回复中的任务检测标记
-        clean_response = ai_response[:start_pos].strip()
-        if clean_response.endswith("[TASK_DETECTION_START]"):
-            clean_response = clean_response[:-len("[TASK_DETECTION_START]")].strip()
-        
-        return clean_response, task_info if task_info.get("has_task") else None
-        
+        await llm_client.warm_up()
+        await asyncio.to_thread(character_registry.get_characters)
     except Exception as e:
-        logger.error(f"解析任务信息失败: {e}")
-        return ai_response, None
+        logger.error(f"启动预热失败: {e}")
+        readiness["error"] = str(e)
+        return
+    readiness["warmup_seconds"] = round(time.perf_counter() - start, 3)
+    readiness["ready"] = True
+    logger.info(f"启动预热完成，耗时{readiness['warmup_seconds']}秒")
+
+@app.on_event("startup")
+async def start_warmup():
+    """启动后台预热，不阻塞服务开始接受请求"""
+    global warmup_task
+    warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def flush_state():
+    """关闭前写入尚未落盘的角色数据和对话历史"""
+    character_registry.flush()
+    if summarizer is not None:
+        await summarizer.close()
+    if task_scheduler is not None:
+        await task_scheduler.close()
+    conversation_store.close()
 
 @app.get("/")
 async def root():
     return {"message": "海豹骰子聊天机器人API v2.0.0 - 支持定时任务", "status": "运行中"}
 
+def readiness_status() -> str:
+    if readiness["ready"]:
+        return "healthy"
+    return "unhealthy" if readiness["error"] else "warming"
+
 @app.get("/health")
 async def health_check():
-    """健康检查接口"""
+    """存活检查接口：进程能响应即返回200，预热完成前status为warming"""
     try:
-        # 简单的API连通性检查
+        status = readiness_status()
+        result = {"status": status, "api_configured": bool(config.DASHSCOPE_API_KEY), "version": "2.0.0"}
+        if status == "warming":
+            result["warning"] = "服务正在预热"
+        elif status == "unhealthy":
+            result["error"] = readiness["error"]
         if config.DASHSCOPE_API_KEY:
-            return {"status": "healthy", "api_configured": True, "version": "2.0.0"}
+            result["llm"] = llm_client.stats()
         else:
-            return {"status": "healthy", "api_configured": False, "warning": "API密钥未配置", "version": "2.0.0"}
+            result["warning"] = "API密钥未配置"
+        return result
     except Exception as e:
         logger.error(f"健康检查失败: {e}")
         return {"status": "unhealthy", "error": str(e), "version": "2.0.0"}
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """处理聊天请求"""
-    try:
-        # 验证输入
-        if not request.message.strip():
-            raise HTTPException(status_code=400, detail="消息不能为空")
-        
-        if len(request.message) > config.MAX_MESSAGE_LENGTH:
-            raise HTTPException(status_code=400, detail="消息过长")
-        
-        # 检查API密钥
-        if not config.DASHSCOPE_API_KEY:
-            raise HTTPException(status_code=500, detail="API密钥未配置")
-        
-        logger.info(f"收到用户 {request.user_id}(权限:{request.user_permission}) 的消息: {request.message[:50]}...")
-        
-        # 获取对话历史
-        history = get_conversation_history(request.conversation_id)
-        
-        # 如果是新对话，添加系统提示
-        if not history:
-            # 使用该会话当前角色的描述组合任务检测提示
-            current_character_prompt = get_current_character_description(request.conversation_id)
-            combined_prompt = current_character_prompt + "\n\n" + TASK_DETECTION_SYSTEM_PROMPT
-            add_message_to_history(request.conversation_id, "system", combined_prompt)
-            history = get_conversation_history(request.conversation_id)
-        
-        # 添加用户消息，包含权限等级信息
-        user_message_with_context = f"{request.message}\n[用户权限等级: {request.user_permission}]"
-        add_message_to_history(request.conversation_id, "user", user_message_with_context, request.user_id, request.user_name)
-        history = get_conversation_history(request.conversation_id)
-        
-        # 调用DashScope API
-        from dashscope import Generation
-        
-        response = Generation.call(
-            model=config.DASHSCOPE_MODEL,
-            messages=history,
-            max_tokens=1500,  # 增加token限制以容纳任务检测信息
-            temperature=0.7,
-            result_format='message'
+@app.get("/health/ready")
+async def readiness_check():
+    """就绪检查接口：预热完成前返回503，供负载均衡或编排系统决定何时转发流量"""
+    status = readiness_status()
+    body = {"status": status, "ready": readiness["ready"], "warmup_seconds": readiness["warmup_seconds"]}
+    if readiness["error"]:
+        body["error"] = readiness["error"]
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=body)
+
+def validate_chat_request(request: ChatRequest):
+    """验证聊天请求，不合法时抛出HTTPException"""
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="消息不能为空")
+    
+    if len(request.message) > config.MAX_MESSAGE_LENGTH:
+        raise HTTPException(status_code=400, detail="消息过长")
+    
+    if request.generation_profile and request.generation_profile not in generation_profiles:
+        raise HTTPException(status_code=400, detail=f"生成档位 '{request.generation_profile}' 不存在")
+    
+    # 检查API密钥
+    if not config.DASHSCOPE_API_KEY:
+        raise HTTPException(status_code=500, detail="API密钥未配置")
+
+def check_rate_limits(request: ChatRequest):
+    """按会话和用户的令牌桶限流，两个桶都有令牌时才扣除，超出时抛出429"""
+    rejected = acquire_all((
+        (conversation_rate_limiter, request.conversation_id, "本会话"),
+        (user_rate_limiter, request.user_id, "您"),
+    ))
+    if rejected:
+        scope, wait = rejected
+        seconds = max(1, math.ceil(wait))
+        raise HTTPException(
+            status_code=429,
+            detail=f"{scope}发送消息过于频繁，请{seconds}秒后再试",
+            headers={"Retry-After": str(seconds)}
         )
-        
-        if response.status_code == 200:
-            ai_reply_raw = response.output.choices[0].message.content
+
+def busy_error(e: OverloadedError) -> HTTPException:
+    """服务繁忙时立即返回503，而不是让请求排队直到超时"""
+    return HTTPException(
+        status_code=503,
+        detail=f"{e}，请稍后再试",
+        headers={"Retry-After": str(max(1, math.ceil(config.ADMISSION_QUEUE_TIMEOUT)))}
+    )
+
+def prepare_chat_history(requests: List[ChatRequest]) -> Tuple[List[Dict], bool]:
+    """将同一会话的一批用户消息按顺序写入对话历史，返回本次调用LLM的上下文及是否附加了任务检测提示词"""
+    request = requests[-1]
+    # 如果是新对话，添加系统提示（该会话当前角色的描述）
+    if not conversation_store.has_messages(request.conversation_id):
+        current_character_prompt = get_current_character_prompt(request.conversation_id)
+        conversation_store.add_message(request.conversation_id, "system", current_character_prompt.content)
+    
+    # 添加用户消息，包含权限等级信息
+    for item in requests:
+        user_message_with_context = f"{item.message}\n[用户权限等级: {item.user_permission}]"
+        conversation_store.add_message(
+            item.conversation_id,
+            "user",
+            format_user_message(user_message_with_context, item.user_id, item.user_name)
+        )
+    # 任务检测提示词只在预分类命中时附加到本次调用
+    needs_detection = task_classifier.needs_detection(item.message for item in requests)
+    history = conversation_store.build_context(
+        request.conversation_id,
+        extra_system=TASK_DETECTION_SYSTEM_PROMPT if needs_detection else ""
+    )
+    if summarizer is not None:
+        summarizer.record_request(request.conversation_id)
+    return history, needs_detection
+
+def lookup_cached_reply(
+    requests: List[ChatRequest], history: List[Dict], needs_detection: bool, profile: GenerationProfile
+) -> Tuple[Optional[str], Optional[str]]:
+    """查询回复缓存，返回(缓存的回复, 缓存键)；不适用缓存时两者均为None"""
+    if response_cache is None:
+        return None, None
+    request = requests[-1]
+    # 合并的多条消息、可能包含定时任务的消息、关闭缓存的角色都不走缓存
+    if len(requests) > 1 or needs_detection or not response_cache.is_enabled_for(
+            get_session_current_character(request.conversation_id)):
+        response_cache.record_bypass()
+        return None, None
+    context = [m for m in history[:-1] if m["role"] != "system"]
+    key = response_cache.make_key(
+        request.conversation_id,
+        get_current_character_prompt(request.conversation_id).digest,
+        f"{config.DASHSCOPE_MODEL}|{profile.cache_key}",
+        request.message,
+        context
+    )
+    return response_cache.get(key), key
+
+def finish_chat_reply(request: ChatRequest, ai_reply_clean: str, task_info: Optional[Dict]) -> Tuple[str, Optional[Dict]]:
+    """校验任务权限并将AI回复写入对话历史，返回最终回复和任务信息"""
+    # 验证任务权限
+    if task_info and request.user_permission < 60:
+        task_info = None
+        ai_reply_clean += "\n\n⚠️ 检测到定时任务需求，但您的权限等级不足（需要60级或以上权限）。请联系管理员提升权限后再试。"
+    
+    # 启用后端调度且客户端会轮询提醒时直接保存任务，返回的task_id告诉插件不必再本地注册；
+    # 其余客户端自行注册任务，后端不保存，避免同一任务被调度两次、提醒无人确认
+    if task_info and task_scheduler is not None and request.backend_tasks:
+        try:
+            task_info = {**task_info, **task_scheduler.add_task(
+                request.conversation_id, request.user_id, request.user_name, task_info
+            )}
+        except ValueError as e:
+            logger.error(f"定时任务格式无效: {e}")
+            task_info = None
+            ai_reply_clean += "\n\n⚠️ 检测到定时任务需求，但任务时间格式无法识别，请换一种说法再试。"
+    
+    # 添加清理后的AI回复到历史
+    conversation_store.add_message(request.conversation_id, "assistant", ai_reply_clean)
+    if summarizer is not None:
+        summarizer.maybe_schedule(request.conversation_id)
+    
+    logger.info(f"AI回复用户 {request.user_id}: {ai_reply_clean[:50]}...")
+    if task_info:
+        logger.info(f"检测到定时任务: {task_info}")
+    return ai_reply_clean, task_info
+
+async def process_chat_batch(requests: List[ChatRequest], http_request: Optional[Request]) -> ChatResponse:
+    """对同一会话的一批消息调用一次LLM，回复对应最后一条消息"""
+    with metrics.stage("history"):
+        history, needs_detection = prepare_chat_history(requests)
+    profile = select_generation_profile(requests, needs_detection)
+    with metrics.stage("cache_lookup"):
+        cached_reply, cache_key = lookup_cached_reply(requests, history, needs_detection, profile)
+    if cached_reply is not None:
+        with metrics.stage("finish"):
+            ai_reply_clean, _ = finish_chat_reply(requests[-1], cached_reply, None)
+        return ChatResponse(reply=ai_reply_clean, success=True, cached=True)
+    
+    # 附加任务检测提示词时max_tokens不低于默认档位，以容纳任务检测信息
+    generation = llm_client.generate(
+        messages=history,
+        model=profile.model,
+        max_tokens=profile.max_tokens,
+        temperature=profile.temperature
+    )
+    llm_started = time.perf_counter()
+    with metrics.stage("llm_call"):
+        if len(requests) == 1 and http_request is not None:
+            # 调用DashScope API（异步，不阻塞事件循环；调用方断开时取消）
+            response = await run_until_disconnected(http_request, generation)
         else:
-            raise Exception(f"DashScope API调用失败: {response.message}")
-        
-        # 解析AI回复中的任务信息
+            # 合并的请求由多个调用方共享，不因其中一个断开而取消
+            response = await generation
+    
+    if response.status_code == 200:
+        ai_reply_raw = response.output.choices[0].message.content
+    else:
+        raise Exception(f"DashScope API调用失败: {response.message}")
+    record_llm_usage(requests[-1].conversation_id, response.usage)
+    record_generation(profile, time.perf_counter() - llm_started, response.usage)
+    
+    # 解析AI回复中的任务信息，按最后一条消息的发送者校验权限
+    with metrics.stage("parse_task_info"):
         ai_reply_clean, task_info = parse_task_info(ai_reply_raw)
+    if cache_key is not None and task_info is None:
+        response_cache.put(cache_key, ai_reply_clean)
+    with metrics.stage("finish"):
+        ai_reply_clean, task_info = finish_chat_reply(requests[-1], ai_reply_clean, task_info)
+    return ChatResponse(reply=ai_reply_clean, success=True, task_info=task_info)
+
+async def handle_chat(request: ChatRequest, http_request: Optional[Request], endpoint: str) -> ChatResponse:
+    """处理单条聊天消息：输入不合法时抛出HTTPException，其余错误以success=False返回"""
+    try:
+        # 验证输入
+        with metrics.stage("validate"):
+            validate_chat_request(request)
+            check_rate_limits(request)
         
-        # 验证任务权限
-        if task_info and request.user_permission < 60:
-            task_info = None
-            ai_reply_clean += "\n\n⚠️ 检测到定时任务需求，但您的权限等级不足（需要60级或以上权限）。请联系管理员提升权限后再试。"
-        
-        # 添加清理后的AI回复到历史
-        add_message_to_history(request.conversation_id, "assistant", ai_reply_clean)
+        logger.info(f"收到用户 {request.user_id}(权限:{request.user_permission}) 的消息: {request.message[:50]}...")
         
-        logger.info(f"AI回复用户 {request.user_id}: {ai_reply_clean[:50]}...")
-        if task_info:
-            logger.info(f"检测到定时任务: {task_info}")
+        async def process(requests: List[ChatRequest]) -> ChatResponse:
+            async with admission.slot(request.conversation_id):
+                return await process_chat_batch(requests, http_request)
         
-        return ChatResponse(reply=ai_reply_clean, success=True, task_info=task_info)
+        # 同一会话按到达顺序处理；开启合并时，等待中的消息与之合并为一次调用
+        async with admission.admit(request.conversation_id):
+            response, coalesced = await conversation_coordinator.run(request.conversation_id, request, process)
+        if coalesced:
+            return ChatResponse(reply=response.reply, success=True, coalesced=True)
+        return response
         
-    except HTTPException:
+    except OverloadedError as e:
+        logger.warning(f"服务繁忙，拒绝会话 {request.conversation_id} 的请求: {e}")
+        metrics.record_error(endpoint, e)
+        raise busy_error(e)
+    except HTTPException as e:
+        metrics.record_error(endpoint, e)
         raise
     except Exception as e:
         logger.error(f"聊天处理错误: {e}")
+        metrics.record_error(endpoint, e)
         return ChatResponse(reply="", success=False, error=str(e))
 
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, http_request: Request):
+    """处理聊天请求"""
+    return await handle_chat(request, http_request, "chat")
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch(batch: ChatBatchRequest):
+    """批量聊天：并发处理多个会话的消息（同一会话仍按顺序处理），按请求顺序返回每条消息的结果"""
+    if len(batch.requests) > config.CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多{config.CHAT_BATCH_MAX_ITEMS}条消息")
+    semaphore = asyncio.Semaphore(config.CHAT_BATCH_CONCURRENCY)
+    
+    async def run_item(request: ChatRequest) -> ChatBatchResult:
+        async with semaphore:
+            try:
+                # 批量请求不因调用方断开而取消单条消息
+                response = await handle_chat(request, None, "chat_batch")
+            except HTTPException as e:
+                return ChatBatchResult(reply="", success=False, error=str(e.detail), status=e.status_code)
+            return ChatBatchResult(**response.model_dump())
+    
+    results = await asyncio.gather(*(run_item(request) for request in batch.requests))
+    succeeded = sum(1 for result in results if result.success)
+    return ChatBatchResponse(
+        success=succeeded == len(results),
+        results=results,
+        succeeded=succeeded,
+        failed=len(results) - succeeded
+    )
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """流式聊天：以SSE逐段返回回复（delta事件），任务检测块不会下发，最后以done事件返回完整回复和task_info"""
+    try:
+        with metrics.stage("validate"):
+            validate_chat_request(request)
+            check_rate_limits(request)
+        admission.check(request.conversation_id)
+    except OverloadedError as e:
+        metrics.record_error("chat_stream", e)
+        raise busy_error(e)
+    except HTTPException as e:
+        metrics.record_error("chat_stream", e)
+        raise
+    logger.info(f"收到用户 {request.user_id}(权限:{request.user_permission}) 的流式消息: {request.message[:50]}...")
+    started = time.perf_counter()
+    
+    async def events():
+        parser = TaskInfoStreamParser()
+        ttft = None
+        try:
+            # 流式请求独占会话，不参与合并
+            async with admission.admit(request.conversation_id), \
+                    conversation_coordinator.lock(request.conversation_id), \
+                    admission.slot(request.conversation_id):
+                with metrics.stage("history"):
+                    history, needs_detection = prepare_chat_history([request])
+                profile = select_generation_profile([request], needs_detection)
+                with metrics.stage("cache_lookup"):
+                    cached_reply, cache_key = lookup_cached_reply([request], history, needs_detection, profile)
+                if cached_reply is not None:
+                    # 缓存命中：整段回复作为一个增量下发
+                    tail, ai_reply_clean, task_info = cached_reply, cached_reply, None
+                else:
+                    usage = {}
+                    llm_started = time.perf_counter()
+                    first_token = False
+                    async for delta in llm_client.stream(
+                            messages=history, model=profile.model, max_tokens=profile.max_tokens,
+                            temperature=profile.temperature, usage=usage):
+                        if not first_token:
+                            first_token = True
+                            metrics.observe_stage("llm_first_token", time.perf_counter() - llm_started)
+                        text = parser.feed(delta)
+                        if not text:
+                            continue
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                            ttft_samples.append(ttft)
+                        yield sse_event("delta", {"text": text})
+                    
+                    metrics.observe_stage("llm_stream", time.perf_counter() - llm_started)
+                    record_llm_usage(request.conversation_id, usage)
+                    record_generation(profile, time.perf_counter() - llm_started, usage)
+                    tail, ai_reply_clean, task_info = parser.finish()
+                    if cache_key is not None and task_info is None:
+                        response_cache.put(cache_key, ai_reply_clean)
+                with metrics.stage("finish"):
+                    reply, task_info = finish_chat_reply(request, ai_reply_clean, task_info)
+            # 尚未发送的正文尾部及权限提示
+            remaining = tail + reply[len(ai_reply_clean):]
+            if remaining:
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                    ttft_samples.append(ttft)
+                yield sse_event("delta", {"text": remaining})
+            yield sse_event("done", {
+                "success": True,
+                "reply": reply,
+                "task_info": task_info,
+                "cached": cached_reply is not None,
+                "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1)
+            })
+        except OverloadedError as e:
+            metrics.record_error("chat_stream", e)
+            yield sse_event("error", {"success": False, "error": f"{e}，请稍后再试", "busy": True})
+        except Exception as e:
+            logger.error(f"流式聊天处理错误: {e}")
+            metrics.record_error("chat_stream", e)
+            yield sse_event("error", {"success": False, "error": str(e)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/chat/stream/stats")
+async def chat_stream_stats():
+    """流式接口首字延迟（TTFT）统计，单位毫秒"""
+    samples = sorted(ttft_samples)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "avg_ms": round(sum(samples) / len(samples) * 1000, 1),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 1),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+    }
+
 @app.post("/clear_history", response_model=ClearHistoryResponse)
 async def clear_history(request: ClearHistoryRequest):
     """清除对话历史"""
     try:
         logger.info(f"清除对话历史")
-        clear_conversation_history(request.conversation_id)
+        conversation_store.clear(request.conversation_id)
         return ClearHistoryResponse(success=True, message="对话历史已清除")
     except Exception as e:
         logger.error(f"清除历史错误: {e}")
@@ -378,20 +772,75 @@ async def clear_history(request: ClearHistoryRequest):
 async def get_conversations():
     """获取所有对话列表"""
     conversations = {}
-    for conv_id, messages in conversation_store.items():
-        conversations[conv_id] = len(messages)
+    for conv_id, count in conversation_store.message_counts():
+        conversations[conv_id] = count
     return {"conversations": conversations}
 
+@app.get("/conversations/stats")
+async def get_conversation_stats():
+    """获取对话存储占用情况"""
+    stats = conversation_store.stats()
+    stats["summarizer"] = summarizer.stats() if summarizer is not None else None
+    stats["coordinator"] = conversation_coordinator.stats()
+    stats["task_classifier"] = task_classifier.stats()
+    stats["response_cache"] = response_cache.stats() if response_cache is not None else None
+    stats["prompt_cache"] = prompt_cache.stats()
+    stats["generation"] = generation_profiles.stats()
+    stats["admission"] = admission.stats()
+    stats["rate_limits"] = {"user": user_rate_limiter.stats(), "conversation": conversation_rate_limiter.stats()}
+    stats["scheduler"] = task_scheduler.stats() if task_scheduler is not None else None
+    return stats
+
+@app.get("/conversations/export")
+async def export_conversations(
+    conversation_id: Optional[List[str]] = Query(None),
+    include_characters: bool = True,
+):
+    """流式导出会话快照（gzip压缩的二进制记录流）；可重复指定conversation_id只导出部分会话"""
+    async def stream():
+        try:
+            async for chunk in export_snapshot(conversation_store, character_registry, conversation_id, include_characters):
+                yield chunk
+        except Exception as e:
+            # 响应已经开始发送，只能中断；快照缺少结束标记，导入时会被拒绝
+            logger.error(f"导出会话快照失败: {e}")
+            raise
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": 'attachment; filename="conversations.snapshot.gz"'},
+    )
+
+@app.post("/conversations/import", response_model=ImportSnapshotResponse)
+async def import_conversations(http_request: Request):
+    """流式导入会话快照：边接收边写入，同ID的会话和同名角色被覆盖"""
+    try:
+        counts = await import_snapshot(conversation_store, character_registry, http_request.stream())
+        logger.info(f"导入会话快照: {counts}")
+        return ImportSnapshotResponse(success=True, **counts)
+    except SnapshotError as e:
+        logger.error(f"会话快照无效: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"导入会话快照失败: {e}")
+        return ImportSnapshotResponse(success=False, error=str(e))
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus文本格式的指标（需开启METRICS_ENABLED）"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/characters", response_model=CharacterListResponse)
 async def get_characters(request: CharacterListRequest):
     """获取角色列表"""
     try:
-        data = load_characters()
         characters = {}
-        for char_id, char_data in data.get("characters", {}).items():
+        for char_id, char_data in character_registry.get_characters().items():
             characters[char_id] = Character(
                 name=char_data["name"],
-                description=char_data["description"]
+                description=char_data["description"],
+                generation_profile=char_data.get("generation_profile")
             )
         
         # 获取该会话的当前角色
@@ -411,10 +860,9 @@ async def get_characters(request: CharacterListRequest):
 async def set_character(request: SetCharacterRequest):
     """切换角色（会话级）"""
     try:
-        data = load_characters()
-        characters = data.get("characters", {})
+        character_info = character_registry.get_character(request.character_name)
         
-        if request.character_name not in characters:
+        if character_info is None:
             return SetCharacterResponse(
                 success=False,
                 message=f"角色 '{request.character_name}' 不存在",
@@ -424,12 +872,10 @@ async def set_character(request: SetCharacterRequest):
         
         # 设置该会话的角色
         if set_session_character(request.conversation_id, request.character_name):
-            character_info = characters[request.character_name]
             logger.info(f"会话 {request.conversation_id} 成功切换到角色: {request.character_name}")
             
             # 只清除当前会话的对话历史
-            if request.conversation_id in conversation_store:
-                conversation_store[request.conversation_id] = []
+            if conversation_store.clear(request.conversation_id):
                 logger.info(f"已清除会话 {request.conversation_id} 的对话历史")
             
             return SetCharacterResponse(
@@ -437,7 +883,8 @@ async def set_character(request: SetCharacterRequest):
                 message=f"成功切换到角色：{character_info['name']}",
                 character=Character(
                     name=character_info["name"],
-                    description=character_info["description"]
+                    description=character_info["description"],
+                    generation_profile=character_info.get("generation_profile")
                 ),
                 conversation_id=request.conversation_id
             )
@@ -480,45 +927,128 @@ async def add_character(request: AddCharacterRequest):
                 error="无效角色名"
             )
         
-        data = load_characters()
-        characters = data.get("characters", {})
-        
-        # 检查角色是否已存在
-        if request.character_name in characters:
+        if request.generation_profile and request.generation_profile not in generation_profiles:
             return AddCharacterResponse(
                 success=False,
-                message=f"角色 '{request.character_name}' 已存在",
-                error="角色已存在"
+                message=f"生成档位 '{request.generation_profile}' 不存在",
+                error="无效生成档位"
             )
         
-        # 添加新角色
-        characters[request.character_name] = {
-            "name": request.character_name,
-            "description": request.character_description
-        }
-        data["characters"] = characters
-        
-        if save_characters(data):
+        # 添加新角色，已存在时返回False
+        if character_registry.add_character(
+                request.character_name, request.character_description, request.generation_profile):
             logger.info(f"成功添加新角色: {request.character_name}")
             return AddCharacterResponse(
                 success=True,
                 message=f"成功添加角色：{request.character_name}",
                 character=Character(
                     name=request.character_name,
-                    description=request.character_description
+                    description=request.character_description,
+                    generation_profile=request.generation_profile
                 )
             )
         else:
             return AddCharacterResponse(
                 success=False,
-                message="保存角色失败",
-                error="保存失败"
+                message=f"角色 '{request.character_name}' 已存在",
+                error="角色已存在"
             )
             
     except Exception as e:
         logger.error(f"添加角色失败: {e}")
         return AddCharacterResponse(success=False, message="添加角色失败", error=str(e))
 
+@app.post("/characters/profile", response_model=AddCharacterResponse)
+async def set_character_profile(request: SetCharacterProfileRequest):
+    """设置角色的生成档位（使用该角色的所有会话生效）"""
+    try:
+        if request.generation_profile and request.generation_profile not in generation_profiles:
+            return AddCharacterResponse(
+                success=False,
+                message=f"生成档位 '{request.generation_profile}' 不存在",
+                error="无效生成档位"
+            )
+        if not character_registry.set_generation_profile(request.character_name, request.generation_profile or None):
+            return AddCharacterResponse(
+                success=False,
+                message=f"角色 '{request.character_name}' 不存在",
+                error="角色不存在"
+            )
+        character_info = character_registry.get_character(request.character_name)
+        logger.info(f"角色 {request.character_name} 的生成档位设置为: {request.generation_profile or '自动'}")
+        return AddCharacterResponse(
+            success=True,
+            message=f"角色 {request.character_name} 的生成档位已设置为：{request.generation_profile or '自动'}",
+            character=Character(
+                name=character_info["name"],
+                description=character_info["description"],
+                generation_profile=character_info.get("generation_profile")
+            )
+        )
+    except Exception as e:
+        logger.error(f"设置角色生成档位失败: {e}")
+        return AddCharacterResponse(success=False, message="设置角色生成档位失败", error=str(e))
+
+def require_scheduler() -> TaskScheduler:
+    if task_scheduler is None:
+        raise HTTPException(status_code=404, detail="后端定时任务未启用（SCHEDULER_ENABLED）")
+    return task_scheduler
+
+@app.post("/tasks", response_model=TaskListResponse)
+async def list_tasks(request: TaskListRequest):
+    """获取定时任务列表（按下次触发时间排序）"""
+    scheduler = require_scheduler()
+    try:
+        return TaskListResponse(success=True, tasks=scheduler.list_tasks(request.conversation_id))
+    except Exception as e:
+        logger.error(f"获取定时任务失败: {e}")
+        return TaskListResponse(success=False, error=str(e))
+
+@app.post("/tasks/delete", response_model=DeleteTaskResponse)
+async def delete_tasks(request: DeleteTaskRequest):
+    """删除指定任务，或删除某个会话的所有任务"""
+    scheduler = require_scheduler()
+    if request.task_id is None and request.conversation_id is None:
+        raise HTTPException(status_code=400, detail="需要指定task_id或conversation_id")
+    try:
+        if request.task_id is not None:
+            deleted = int(scheduler.remove_task(request.task_id))
+        else:
+            deleted = scheduler.remove_conversation_tasks(request.conversation_id)
+        logger.info(f"已删除 {deleted} 个定时任务")
+        return DeleteTaskResponse(success=True, deleted=deleted)
+    except Exception as e:
+        logger.error(f"删除定时任务失败: {e}")
+        return DeleteTaskResponse(success=False, error=str(e))
+
+@app.get("/tasks/due", response_model=DueTasksResponse)
+async def get_due_tasks(wait: float = 0, limit: int = 50):
+    """取走到期的任务提醒；wait>0时长轮询，最多等待wait秒（上限60）
+
+    取走的提醒需通过 /tasks/ack 确认，否则租期（SCHEDULER_LEASE）过后会重新下发。
+    """
+    scheduler = require_scheduler()
+    try:
+        deliveries = await scheduler.wait_for_deliveries(min(max(wait, 0.0), 60.0), max(1, min(limit, 500)))
+        return DueTasksResponse(success=True, deliveries=deliveries)
+    except Exception as e:
+        logger.error(f"获取到期任务失败: {e}")
+        return DueTasksResponse(success=False, error=str(e))
+
+@app.post("/tasks/ack", response_model=AckTasksResponse)
+async def ack_tasks(request: AckTasksRequest):
+    """确认任务提醒已发送"""
+    scheduler = require_scheduler()
+    try:
+        return AckTasksResponse(success=True, acked=scheduler.ack(request.delivery_ids))
+    except Exception as e:
+        logger.error(f"确认任务提醒失败: {e}")
+        return AckTasksResponse(success=False, error=str(e))
+
+# 指标中间件在所有路由注册之后添加，路径标签只取已注册的路由
+if metrics.enabled:
+    app.add_middleware(MetricsMiddleware, metrics=metrics, paths=[route.path for route in app.routes])
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=config.HOST, port=config.PORT) 
\ No newline at end of file
@@ -0,0 +1,228 @@
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 阶段耗时的直方图分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 回复token数的直方图分桶
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+Labels = Tuple[str, ...]
+INF_BUCKET = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # {标签: [各分桶计数..., 总和, 总数]}，分桶计数不累计，输出时再累加
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[index] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, INF_BUCKET)} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {state[-1]}")
+        return lines
+
+
+class Gauge:
+    """抓取时通过回调取值的仪表，回调返回{标签: 值}"""
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], Dict[Labels, float]], label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.label_names = label_names
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class _NullTimer:
+    """关闭指标时使用的空计时器，进入/退出不做任何事"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class Metrics:
+    """Prometheus文本格式的进程内指标：请求数、各阶段耗时、LLM token数、错误数及抓取时计算的仪表
+
+    关闭时所有记录方法直接返回，stage()返回共享的空计时器。
+    指标只在事件循环线程中更新，不加锁。
+    """
+
+    def __init__(self, enabled: bool = False, prefix: str = "sealdice"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.requests = Counter(f"{prefix}_http_requests_total", "HTTP请求数", ("method", "path", "status"))
+        self.request_seconds = Histogram(f"{prefix}_http_request_seconds", "HTTP请求耗时（秒）", ("path",))
+        self.stage_seconds = Histogram(f"{prefix}_chat_stage_seconds", "聊天处理各阶段耗时（秒）", ("stage",))
+        self.tokens = Counter(f"{prefix}_llm_tokens_total", "LLM消耗的token数", ("character", "kind"))
+        self.errors = Counter(f"{prefix}_errors_total", "按类型统计的错误数", ("endpoint", "type"))
+        self.generation_seconds = Histogram(f"{prefix}_llm_generation_seconds", "按生成档位统计的LLM调用耗时（秒）", ("profile",))
+        self.generation_tokens = Histogram(
+            f"{prefix}_llm_completion_tokens", "按生成档位统计的每次回复token数", ("profile",), TOKEN_BUCKETS
+        )
+        self._gauges: List[Gauge] = []
+        self.http_in_flight = 0
+
+    def stage(self, name: str):
+        """计时上下文：with metrics.stage("llm_call"): ..."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self.stage_seconds, (name,))
+
+    def observe_stage(self, name: str, seconds: float):
+        if self.enabled:
+            self.stage_seconds.observe(seconds, (name,))
+
+    def record_tokens(self, character: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+        if not self.enabled:
+            return
+        if prompt_tokens:
+            self.tokens.inc((character, "prompt"), prompt_tokens)
+        if completion_tokens:
+            self.tokens.inc((character, "completion"), completion_tokens)
+
+    def record_generation(self, profile: str, seconds: float, completion_tokens: Optional[int]):
+        if not self.enabled:
+            return
+        self.generation_seconds.observe(seconds, (profile,))
+        if completion_tokens:
+            self.generation_tokens.observe(completion_tokens, (profile,))
+
+    def record_error(self, endpoint: str, error: BaseException):
+        if self.enabled:
+            self.errors.inc((endpoint, type(error).__name__))
+
+    def record_request(self, method: str, path: str, status: int, seconds: float):
+        if self.enabled:
+            self.requests.inc((method, path, str(status)))
+            self.request_seconds.observe(seconds, (path,))
+
+    def register_gauge(self, name: str, help_text: str, collect: Callable[[], Dict[Labels, float]], label_names: Tuple[str, ...] = ()):
+        self._gauges.append(Gauge(f"{self.prefix}_{name}", help_text, collect, label_names))
+
+    def render(self) -> str:
+        if not self.enabled:
+            return "# 指标未开启（METRICS_ENABLED=false）\n"
+        lines = []
+        for metric in (self.requests, self.request_seconds, self.stage_seconds, self.tokens, self.errors,
+                       self.generation_seconds, self.generation_tokens, *self._gauges):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI中间件：统计HTTP请求数、耗时和进行中的请求数；只应在开启指标时添加
+
+    路径标签只使用已注册的路由，其余归为other，避免标签基数无限增长。
+    """
+
+    def __init__(self, app, metrics: Metrics, paths: Iterable[str]):
+        self.app = app
+        self.metrics = metrics
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"] if scope["path"] in self.paths else "other"
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.http_in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics.http_in_flight -= 1
+            self.metrics.record_request(scope["method"], path, status, time.perf_counter() - start)
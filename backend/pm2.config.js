@@ -23,6 +23,7 @@ module.exports = {
       error_file: './logs/app-err.log',
       log_date_format: 'YYYY-MM-DD HH:mm:ss Z',
       merge_logs: true,
+      // 多worker由serve.py按WORKERS环境变量启动，pm2只管理一个主进程
       instances: 1,
       exec_mode: 'fork'
     }
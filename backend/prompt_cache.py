@@ -0,0 +1,95 @@
+import hashlib
+import sys
+from typing import Dict, Optional
+
+from tokenizer import TokenCounter, estimate_tokens
+
+# 会话中只保存对共享前缀的引用
+REFERENCE_SIZE = 8
+
+
+def prompt_digest(content: str) -> str:
+    """角色描述的内容哈希，用于判断编译好的前缀是否仍然有效"""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class PromptPrefix:
+    """编译好的角色系统消息，由使用同一角色的所有会话共享
+
+    与对话消息的接口一致（role、content、tokens、to_dict、size），可以直接作为会话的系统消息；
+    size只计入会话中的一个引用，前缀本身的内存由PromptCache统计一次。
+    """
+
+    __slots__ = ("character", "digest", "content", "tokens", "_extended")
+    role = "system"
+
+    def __init__(self, character: str, digest: str, content: str, tokens: int):
+        self.character = character
+        self.digest = digest
+        self.content = content
+        self.tokens = tokens
+        # 附加了本次调用额外提示词（如任务检测提示词）的完整系统消息，按额外内容缓存
+        self._extended: Dict[str, str] = {}
+
+    def to_dict(self) -> Dict:
+        return {"role": "system", "content": self.content}
+
+    def size(self) -> int:
+        return REFERENCE_SIZE
+
+    def extended(self, extra: str) -> str:
+        content = self._extended.get(extra)
+        if content is None:
+            content = "\n\n".join(part for part in (self.content, extra) if part).strip()
+            self._extended[extra] = content
+        return content
+
+
+class PromptCache:
+    """按角色名和内容哈希缓存编译好的系统消息前缀
+
+    角色描述不变时重复获取直接命中，不再重新计算token数；描述被修改（添加角色、外部编辑characters.json）后
+    哈希变化，下次获取时重新编译并替换该角色的旧前缀，已持有旧前缀的会话不受影响。
+    另按内容建立索引，从持久化后端恢复的会话据此复用同一份前缀，而不是各自保存一份副本。
+    """
+
+    def __init__(self, token_counter: TokenCounter = estimate_tokens):
+        self.count_tokens = token_counter
+        self._by_character: Dict[str, PromptPrefix] = {}
+        self._by_content: Dict[str, PromptPrefix] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared_lookups = 0
+
+    def get(self, character: str, digest: str, content: str) -> PromptPrefix:
+        """获取角色的编译前缀，哈希与缓存不一致时重新编译"""
+        prefix = self._by_character.get(character)
+        if prefix is not None and prefix.digest == digest:
+            self.hits += 1
+            return prefix
+        self.misses += 1
+        stale = prefix
+        # 不同角色的描述相同时共用同一个前缀
+        prefix = self._by_content.get(content) or PromptPrefix(character, digest, content, self.count_tokens(content))
+        self._by_character[character] = prefix
+        self._by_content[content] = prefix
+        if stale is not None and all(other is not stale for other in self._by_character.values()):
+            self._by_content.pop(stale.content, None)
+        return prefix
+
+    def lookup(self, content: str) -> Optional[PromptPrefix]:
+        """按内容查找已编译的前缀；同一个字符串对象的查找为O(1)"""
+        prefix = self._by_content.get(content)
+        if prefix is not None:
+            self.shared_lookups += 1
+        return prefix
+
+    def stats(self) -> Dict:
+        prefixes = {id(prefix): prefix for prefix in self._by_content.values()}.values()
+        return {
+            "prefixes": len(prefixes),
+            "prefix_bytes": sum(sys.getsizeof(prefix.content) for prefix in prefixes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_lookups": self.shared_lookups,
+        }
@@ -0,0 +1,73 @@
+import random
+import time
+from typing import Dict
+
+# 可重试的HTTP状态码：限流与上游临时故障
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """第attempt次重试（从0开始）前的等待时间：指数退避 + 全抖动"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """单个模型的熔断器
+
+    连续failure_threshold次上游故障后熔断（open），reset_timeout秒内直接拒绝调用；
+    之后放行一个探测调用（half_open），成功则恢复（closed），失败则重新熔断。
+    failure_threshold为0时不熔断。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejections = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """是否放行本次调用；熔断期间返回False"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejections += 1
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.failure_threshold and self.failures >= self.failure_threshold):
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """放行的调用既未成功也未判定为上游故障（如调用方取消）时，允许下一次探测"""
+        self._probing = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opens": self.opens,
+            "rejections": self.rejections,
+        }
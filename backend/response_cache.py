@@ -0,0 +1,99 @@
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+# 归一化时去掉的句末标点和语气符号
+_TRAILING_PUNCTUATION = "?？!！.。~～…,，、 "
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    """归一化用户消息：全半角统一、小写、合并空白、去掉句末标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+class ResponseCache:
+    """重复提问的回复缓存：按会话、角色描述、模型、归一化消息和最近若干条上下文作为键
+
+    按条目数进行LRU淘汰，并为每条缓存设置过期时间；可按角色名关闭缓存。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 3600,
+        context_messages: int = 1,
+        disabled_characters: Iterable[str] = (),
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # 参与缓存键的上文消息条数（不含本条消息）
+        self.context_messages = context_messages
+        self.disabled_characters = set(disabled_characters)
+        # 按最近使用排序，值为(过期时间, 回复)
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = {"lru": 0, "ttl": 0}
+
+    def is_enabled_for(self, character_name: str) -> bool:
+        return character_name not in self.disabled_characters
+
+    def make_key(self, conversation_id: str, character_digest: str, model: str, message: str, context: List[Dict]) -> str:
+        """生成缓存键；character_digest为角色描述的内容哈希，context为本条消息之前的对话消息（不含系统消息）
+
+        缓存只在同一会话内复用：不同会话的上文、参与者和语境不同，同一句话不一定是同一个问题。
+        """
+        parts = [conversation_id, character_digest, model, normalize_message(message)]
+        if self.context_messages:
+            for item in context[-self.context_messages:]:
+                parts.append(f"{item['role']}:{normalize_message(item['content'])}")
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.time():
+            del self._entries[key]
+            self.evictions["ttl"] += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, reply: str):
+        self._entries[key] = (time.time() + self.ttl if self.ttl else float("inf"), reply)
+        self._entries.move_to_end(key)
+        while self.max_entries and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions["lru"] += 1
+
+    def record_bypass(self):
+        """记录一次不适用缓存的请求（角色关闭缓存、任务请求等）"""
+        self.bypassed += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "context_messages": self.context_messages,
+            "disabled_characters": sorted(self.disabled_characters),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": dict(self.evictions),
+        }
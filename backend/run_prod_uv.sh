@@ -28,5 +28,5 @@ fi
 echo "启动生产服务器..."
 echo "API文档地址: http://localhost:1478/docs"
 
-# 启动生产服务器
-uv run uvicorn main:app --host 0.0.0.0 --port 1478 --log-level info 
\ No newline at end of file
+# 启动生产服务器（worker数量等由.env中的WORKERS、SHARED_STATE、WORKER_AFFINITY控制）
+uv run python serve.py 
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""生产启动入口：按WORKERS启动单进程、多worker共享状态或会话亲和路由
+
+用法（在backend目录下）:
+    uv run python serve.py
+"""
+import logging
+
+import uvicorn
+
+from config import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    if config.WORKERS <= 1:
+        uvicorn.run("main:app", host=config.HOST, port=config.PORT)
+    elif config.WORKER_AFFINITY:
+        from worker_router import run_affinity
+        logger.info(f"会话亲和模式：{config.WORKERS}个worker，路由监听端口{config.PORT}")
+        run_affinity(config.HOST, config.PORT, config.WORKERS)
+    else:
+        logger.info(f"共享状态模式：{config.WORKERS}个worker（{config.SHARED_STATE}）")
+        uvicorn.run("main:app", host=config.HOST, port=config.PORT, workers=config.WORKERS)
+
+
+if __name__ == "__main__":
+    main()
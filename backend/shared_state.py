@@ -0,0 +1,396 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from history_backend import StoredMessage
+from resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# 写操作前后的会话版本号 (写入前, 写入后)
+VersionChange = Tuple[int, int]
+
+
+class SharedConversationState:
+    """多worker共享的对话状态：实现持久化后端的接口，写操作立即返回写入前后的版本号，并为每个会话维护版本号
+
+    每次写操作使该会话的版本号加一。ConversationStore在共享模式下把内存中的会话当作缓存，
+    访问时比对版本号，发现其他worker修改过就重新加载。
+    """
+
+    shared = True
+
+    def append(self, conversation_id: str, role: str, content: str) -> VersionChange:
+        raise NotImplementedError
+
+    def replace(
+        self, conversation_id: str, messages: List[StoredMessage], expected_version: Optional[int] = None
+    ) -> Optional[VersionChange]:
+        """整体替换会话；指定expected_version时，仅当当前版本号与之相同才替换，否则返回None"""
+        raise NotImplementedError
+
+    def trim(self, conversation_id: str, count: int) -> VersionChange:
+        """删除最旧的count条对话消息（系统提示和摘要除外）"""
+        raise NotImplementedError
+
+    def version(self, conversation_id: str) -> int:
+        raise NotImplementedError
+
+    def load_versioned(self, conversation_id: str) -> Tuple[int, Optional[List[StoredMessage]]]:
+        """原子地读取会话的版本号和消息"""
+        raise NotImplementedError
+
+    def load(self, conversation_id: str) -> Optional[List[StoredMessage]]:
+        return self.load_versioned(conversation_id)[1]
+
+    def message_counts(self) -> Iterator[Tuple[str, int]]:
+        raise NotImplementedError
+
+    def flush(self, timeout: Optional[float] = None):
+        """等待已返回的写操作全部提交；同步写入的实现无需等待"""
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict:
+        return {"backend": type(self).__name__, "shared": True}
+
+
+class InMemorySharedState(SharedConversationState):
+    """进程内的共享状态替身：多个ConversationStore共用同一实例即可模拟多个worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {会话ID: [版本号, 消息列表]}
+        self._conversations: Dict[str, list] = {}
+        self.writes = 0
+
+    def _write(self, conversation_id: str, mutate, expected_version: Optional[int] = None) -> Optional[VersionChange]:
+        with self._lock:
+            entry = self._conversations.setdefault(conversation_id, [0, []])
+            before = entry[0]
+            if expected_version is not None and before != expected_version:
+                return None
+            mutate(entry[1])
+            entry[0] = before + 1
+            self.writes += 1
+            return before, entry[0]
+
+    def append(self, conversation_id: str, role: str, content: str) -> VersionChange:
+        return self._write(conversation_id, lambda messages: messages.append((role, content)))
+
+    def replace(
+        self, conversation_id: str, messages: List[StoredMessage], expected_version: Optional[int] = None
+    ) -> Optional[VersionChange]:
+        def mutate(current):
+            current[:] = list(messages)
+        return self._write(conversation_id, mutate, expected_version)
+
+    def trim(self, conversation_id: str, count: int) -> VersionChange:
+        def mutate(current):
+            kept, dropped = [], 0
+            for message in current:
+                if dropped < count and message[0] not in ("system", "summary"):
+                    dropped += 1
+                    continue
+                kept.append(message)
+            current[:] = kept
+        return self._write(conversation_id, mutate)
+
+    def version(self, conversation_id: str) -> int:
+        entry = self._conversations.get(conversation_id)
+        return entry[0] if entry is not None else 0
+
+    def load_versioned(self, conversation_id: str) -> Tuple[int, Optional[List[StoredMessage]]]:
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                return 0, None
+            return entry[0], list(entry[1]) or None
+
+    def message_counts(self) -> Iterator[Tuple[str, int]]:
+        with self._lock:
+            counts = [(cid, len(entry[1])) for cid, entry in self._conversations.items() if entry[1]]
+        return iter(counts)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats.update({"conversations": len(self._conversations), "writes": self.writes})
+        return stats
+
+
+class SQLiteSharedState(SharedConversationState):
+    """基于本机SQLite文件（WAL）的共享状态，多个worker进程各自打开同一个数据库
+
+    消息表与SQLiteHistoryBackend相同，可以直接沿用单进程模式下的历史数据库。
+    写操作进入队列，由写线程在BEGIN IMMEDIATE事务中批量执行并递增版本号，事件循环不等待其他worker的写锁。
+    入队时按"当前版本号 + 本worker尚未提交的写操作数"预测写入后的版本号并立即返回；
+    写线程提交时发现写入前的版本号与预测不符（其他worker同时写入了该会话，或条件替换不成立），
+    就把该会话标记为冲突，之后的version()等待该会话的写操作全部提交后返回数据库中的版本号，使本地副本重新加载。
+
+    读取在事件循环线程中同步执行，WAL模式下读不等待写事务；只有读取仍有未提交写操作的冲突会话时才等待写线程。
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0, batch_size: int = 256, write_retries: int = 3):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.batch_size = batch_size
+        self.write_retries = write_retries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 由事件循环线程读取，加锁以防后台线程（如关闭时）并发访问
+        self._conn = self._connect()
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id);
+            CREATE TABLE IF NOT EXISTS conversation_versions (
+                conversation_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        self._lock = threading.Lock()
+        # 本worker尚未提交的写操作 {会话ID: [预测的版本号, 未提交操作数, 是否冲突]}
+        self._pending: Dict[str, list] = {}
+        self._pending_cond = threading.Condition(threading.Lock())
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="SQLiteSharedState-writer", daemon=True)
+        self._thread.start()
+        self.writes = 0
+        self.version_checks = 0
+        self.conflicts = 0
+        self.write_errors = 0
+        self.failed_ops = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _stored_version(self, conversation_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM conversation_versions WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _submit(self, conversation_id: str, op: str, payload, expected_version: Optional[int] = None) -> Optional[VersionChange]:
+        """写操作入队，返回预测的(写入前, 写入后)版本号；条件替换的版本号已经不符时不入队，返回None"""
+        with self._pending_cond:
+            entry = self._pending.get(conversation_id)
+        before = entry[0] if entry is not None else self._stored_version(conversation_id)
+        if expected_version is not None and before != expected_version:
+            return None
+        with self._pending_cond:
+            entry = self._pending.setdefault(conversation_id, [before, 0, False])
+            if entry[0] != before:
+                # 写线程在两次加锁之间提交了该会话的写操作，以最新预测为准
+                before = entry[0]
+                if expected_version is not None and before != expected_version:
+                    return None
+            entry[0] = before + 1
+            entry[1] += 1
+        self._queue.put((op, conversation_id, payload, before, expected_version))
+        return before, before + 1
+
+    def append(self, conversation_id: str, role: str, content: str) -> VersionChange:
+        return self._submit(conversation_id, "append", (role, content))
+
+    def replace(
+        self, conversation_id: str, messages: List[StoredMessage], expected_version: Optional[int] = None
+    ) -> Optional[VersionChange]:
+        return self._submit(conversation_id, "replace", list(messages), expected_version)
+
+    def trim(self, conversation_id: str, count: int) -> VersionChange:
+        return self._submit(conversation_id, "trim", count)
+
+    def _wait_committed(self, conversation_id: str):
+        """等待本worker对该会话的写操作全部提交"""
+        with self._pending_cond:
+            self._pending_cond.wait_for(lambda: conversation_id not in self._pending)
+
+    def version(self, conversation_id: str) -> int:
+        self.version_checks += 1
+        with self._pending_cond:
+            entry = self._pending.get(conversation_id)
+            if entry is not None and not entry[2]:
+                return entry[0]
+        if entry is not None:
+            self._wait_committed(conversation_id)
+        return self._stored_version(conversation_id)
+
+    def load_versioned(self, conversation_id: str) -> Tuple[int, Optional[List[StoredMessage]]]:
+        if conversation_id in self._pending:
+            self._wait_committed(conversation_id)
+        with self._lock:
+            conn = self._conn
+            # 读事务保证版本号与消息来自同一快照
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute(
+                    "SELECT version FROM conversation_versions WHERE conversation_id = ?", (conversation_id,)
+                ).fetchone()
+                rows = conn.execute(
+                    "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY id", (conversation_id,)
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        return (row[0] if row else 0), (rows or None)
+
+    def message_counts(self) -> Iterator[Tuple[str, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT conversation_id, COUNT(*) FROM messages GROUP BY conversation_id"
+            ).fetchall()
+        return iter(rows)
+
+    def _run(self):
+        conn = self._connect()
+        running = True
+        while running:
+            batch = []
+            waiters = []
+            op = self._queue.get()
+            while True:
+                if op[0] in ("flush", "close"):
+                    waiters.append(op[1])
+                    running = op[0] != "close"
+                    break
+                batch.append(op)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_with_retry(conn, batch)
+            for waiter in waiters:
+                waiter.set()
+        conn.close()
+
+    def _write_with_retry(self, conn: sqlite3.Connection, batch: List[Tuple]):
+        """在一个事务中提交一批写操作，失败时退避重试；重试用尽后丢弃，相关会话标记为冲突以便重新加载"""
+        for attempt in range(self.write_retries + 1):
+            try:
+                conflicts = self._write_batch(conn, batch)
+                self.writes += len(batch) - len(conflicts)
+                break
+            except Exception as e:
+                self.write_errors += 1
+                if attempt == self.write_retries:
+                    logger.error(f"写入共享对话状态失败，已重试{self.write_retries}次，丢弃{len(batch)}条写操作: {e}")
+                    self.failed_ops += len(batch)
+                    conflicts = {op[1] for op in batch}
+                    break
+                delay = backoff_delay(attempt, 0.05, 1.0)
+                logger.warning(f"写入共享对话状态失败，{delay:.2f}秒后重试: {e}")
+                time.sleep(delay)
+        with self._pending_cond:
+            for _, conversation_id, _, _, _ in batch:
+                entry = self._pending[conversation_id]
+                entry[1] -= 1
+                if conversation_id in conflicts:
+                    if not entry[2]:
+                        self.conflicts += 1
+                    entry[2] = True
+                if not entry[1]:
+                    del self._pending[conversation_id]
+            self._pending_cond.notify_all()
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: List[Tuple]) -> set:
+        """执行一批写操作，返回写入前的版本号与预测不符的会话"""
+        conflicts = set()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for op, conversation_id, payload, predicted, expected_version in batch:
+                row = conn.execute(
+                    "SELECT version FROM conversation_versions WHERE conversation_id = ?", (conversation_id,)
+                ).fetchone()
+                before = row[0] if row else 0
+                if before != predicted:
+                    conflicts.add(conversation_id)
+                    if expected_version is not None:
+                        # 条件替换不成立，跳过
+                        continue
+                if op == "append":
+                    conn.execute(
+                        "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                        (conversation_id, payload[0], payload[1])
+                    )
+                elif op == "trim":
+                    conn.execute(
+                        "DELETE FROM messages WHERE id IN ("
+                        "SELECT id FROM messages WHERE conversation_id = ? AND role NOT IN ('system', 'summary') "
+                        "ORDER BY id LIMIT ?)",
+                        (conversation_id, payload)
+                    )
+                else:
+                    conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                    conn.executemany(
+                        "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                        [(conversation_id, role, content) for role, content in payload]
+                    )
+                conn.execute(
+                    "INSERT INTO conversation_versions (conversation_id, version) VALUES (?, 1) "
+                    "ON CONFLICT (conversation_id) DO UPDATE SET version = version + 1",
+                    (conversation_id,)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return conflicts
+
+    def flush(self, timeout: Optional[float] = None):
+        """等待已入队的写操作全部提交"""
+        if not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait(timeout)
+
+    def close(self):
+        if self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(("close", done))
+            done.wait()
+            self._thread.join()
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats.update({
+            "path": self.path,
+            "writes": self.writes,
+            "version_checks": self.version_checks,
+            "queued_ops": self._queue.qsize(),
+            "conflicts": self.conflicts,
+            "write_errors": self.write_errors,
+            "failed_ops": self.failed_ops,
+        })
+        return stats
+
+
+def create_shared_state(kind: str, path: Optional[str] = None) -> Optional[SharedConversationState]:
+    """按配置创建共享状态，kind为none时返回None"""
+    kind = (kind or "none").lower()
+    if kind == "none":
+        return None
+    if kind == "sqlite":
+        return SQLiteSharedState(path or os.path.join("data", "shared_state.db"))
+    if kind == "memory":
+        # 仅用于单进程内的测试
+        return InMemorySharedState()
+    logger.warning(f"未知的共享状态类型 {kind}，不启用共享状态")
+    return None
@@ -0,0 +1,296 @@
+"""会话快照：对话历史与角色数据的流式导出/导入
+
+格式为gzip压缩的记录流（可直接用zcat查看），解压后以8字节魔数开头，之后每条记录为
+`类型(1字节) + 负载长度(4字节大端) + 负载`，负载为 `字段数 + 各字段长度（均为4字节大端）+ 各字段的UTF-8内容`：
+
+- C 角色定义：角色键、显示名称、描述、生成档位（未设置时为空字符串）
+- S 会话角色映射：会话ID、角色名
+- M 会话历史：会话ID，之后依次为每条消息的角色、内容
+- E 结束标记：会话数、角色数、映射数（各4字节），用于发现被截断的快照
+
+导出与导入都按记录逐条处理，内存占用只与单个会话的大小有关，与快照总大小无关。
+"""
+import asyncio
+import struct
+import zlib
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from character_registry import CharacterRegistry
+from conversation_store import ConversationStore
+
+MAGIC = b"SDSNAP\x00\x01"
+RECORD_HEADER = struct.Struct(">BI")
+FIELD_COUNT = struct.Struct(">I")
+END_COUNTS = struct.Struct(">III")
+
+KIND_CHARACTER = ord("C")
+KIND_SESSION = ord("S")
+KIND_CONVERSATION = ord("M")
+KIND_END = ord("E")
+
+# gzip格式的wbits
+GZIP_WBITS = 31
+# 导出时攒够这么多压缩后的字节再发送一次
+CHUNK_BYTES = 64 * 1024
+# 导入时每次最多解压的字节数，避免压缩炸弹一次性展开
+DECOMPRESS_STEP = 1024 * 1024
+# 单条记录的长度上限
+MAX_RECORD_BYTES = 64 * 1024 * 1024
+# 导入会话角色映射时每批写入的条数
+SESSION_BATCH = 1000
+
+
+class SnapshotError(ValueError):
+    """快照格式错误或不完整"""
+
+
+def _record(kind: int, fields: List[str]) -> bytes:
+    encoded = [field.encode("utf-8") for field in fields]
+    lengths = struct.pack(f">{len(encoded) + 1}I", len(encoded), *map(len, encoded))
+    body = b"".join(encoded)
+    return RECORD_HEADER.pack(kind, len(lengths) + len(body)) + lengths + body
+
+
+def character_record(character_name: str, info: Dict) -> bytes:
+    return _record(KIND_CHARACTER, [
+        character_name,
+        info.get("name", character_name),
+        info.get("description", ""),
+        info.get("generation_profile") or "",
+    ])
+
+
+def session_record(conversation_id: str, character_name: str) -> bytes:
+    return _record(KIND_SESSION, [conversation_id, character_name])
+
+
+def conversation_record(conversation_id: str, messages: Iterable[Tuple[str, str]]) -> bytes:
+    fields = [conversation_id]
+    for role, content in messages:
+        fields.append(role)
+        fields.append(content)
+    return _record(KIND_CONVERSATION, fields)
+
+
+def end_record(conversations: int, characters: int, sessions: int) -> bytes:
+    payload = END_COUNTS.pack(conversations, characters, sessions)
+    return RECORD_HEADER.pack(KIND_END, len(payload)) + payload
+
+
+def _fields(payload: bytes) -> List[str]:
+    if len(payload) < FIELD_COUNT.size:
+        raise SnapshotError("快照记录字段不完整")
+    (count,) = FIELD_COUNT.unpack_from(payload)
+    offset = FIELD_COUNT.size * (count + 1)
+    if offset > len(payload):
+        raise SnapshotError("快照记录字段不完整")
+    lengths = struct.unpack_from(f">{count}I", payload, FIELD_COUNT.size)
+    if offset + sum(lengths) != len(payload):
+        raise SnapshotError("快照记录字段长度不符")
+    fields = []
+    try:
+        for length in lengths:
+            fields.append(payload[offset:offset + length].decode("utf-8"))
+            offset += length
+    except UnicodeDecodeError as e:
+        raise SnapshotError(f"快照记录编码错误: {e}")
+    return fields
+
+
+class SnapshotEncoder:
+    """把记录压缩为快照字节流，攒够CHUNK_BYTES才输出一块"""
+
+    def __init__(self, level: int = 6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+        self._output = bytearray(self._compressor.compress(MAGIC))
+        self.raw_bytes = len(MAGIC)
+        self.compressed_bytes = 0
+
+    def write(self, record: bytes) -> Optional[bytes]:
+        """写入一条记录，攒够一块时返回压缩后的数据"""
+        self.raw_bytes += len(record)
+        self._output += self._compressor.compress(record)
+        if len(self._output) < CHUNK_BYTES:
+            return None
+        return self._take()
+
+    def finish(self) -> bytes:
+        self._output += self._compressor.flush()
+        return self._take()
+
+    def _take(self) -> bytes:
+        chunk = bytes(self._output)
+        self._output.clear()
+        self.compressed_bytes += len(chunk)
+        return chunk
+
+
+class SnapshotDecoder:
+    """增量解析快照字节流：每次喂入一块数据，产出其中已完整的记录"""
+
+    def __init__(self, max_record_bytes: int = MAX_RECORD_BYTES):
+        self.max_record_bytes = max_record_bytes
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._buffer = bytearray()
+        self._header_checked = False
+        self.finished = False
+        self.expected_counts: Optional[Tuple[int, int, int]] = None
+
+    def feed(self, chunk: bytes) -> Iterator[Tuple[int, object]]:
+        """产出(记录类型, 内容)：角色为(角色键, 角色数据)，映射为(会话ID, 角色名)，会话为(会话ID, [(角色, 内容)])"""
+        data = chunk
+        while data:
+            if self._decompressor.eof:
+                raise SnapshotError("快照结束后还有多余的数据")
+            try:
+                self._buffer += self._decompressor.decompress(data, DECOMPRESS_STEP)
+            except zlib.error as e:
+                raise SnapshotError(f"快照解压失败: {e}")
+            data = self._decompressor.unconsumed_tail
+            yield from self._drain()
+
+    def close(self):
+        """输入结束时调用，快照不完整时抛出SnapshotError"""
+        if not self.finished or not self._decompressor.eof or self._buffer:
+            raise SnapshotError("快照不完整（缺少结束标记，可能被截断）")
+
+    def _drain(self) -> Iterator[Tuple[int, object]]:
+        buffer = self._buffer
+        offset = 0
+        if not self._header_checked:
+            if len(buffer) < len(MAGIC):
+                return
+            if bytes(buffer[:len(MAGIC)]) != MAGIC:
+                raise SnapshotError("不是会话快照文件或版本不受支持")
+            self._header_checked = True
+            offset = len(MAGIC)
+        try:
+            while len(buffer) - offset >= RECORD_HEADER.size:
+                if self.finished:
+                    raise SnapshotError("结束标记之后还有记录")
+                kind, length = RECORD_HEADER.unpack_from(buffer, offset)
+                if length > self.max_record_bytes:
+                    raise SnapshotError(f"快照记录过大（{length}字节）")
+                end = offset + RECORD_HEADER.size + length
+                if end > len(buffer):
+                    break
+                payload = bytes(buffer[offset + RECORD_HEADER.size:end])
+                offset = end
+                yield self._parse(kind, payload)
+        finally:
+            del buffer[:offset]
+
+    def _parse(self, kind: int, payload: bytes) -> Tuple[int, object]:
+        if kind == KIND_END:
+            if len(payload) != END_COUNTS.size:
+                raise SnapshotError("快照结束标记格式错误")
+            self.finished = True
+            self.expected_counts = END_COUNTS.unpack(payload)
+            return kind, self.expected_counts
+        fields = _fields(payload)
+        if kind == KIND_CHARACTER:
+            if len(fields) != 4:
+                raise SnapshotError("快照记录字段数错误")
+            character_name, name, description, generation_profile = fields
+            info = {"name": name, "description": description}
+            if generation_profile:
+                info["generation_profile"] = generation_profile
+            return kind, (character_name, info)
+        if kind == KIND_SESSION:
+            if len(fields) != 2:
+                raise SnapshotError("快照记录字段数错误")
+            return kind, (fields[0], fields[1])
+        if kind == KIND_CONVERSATION:
+            if not fields or len(fields) % 2 != 1:
+                raise SnapshotError("快照记录字段数错误")
+            messages = list(zip(fields[1::2], fields[2::2]))
+            return kind, (fields[0], messages)
+        raise SnapshotError(f"未知的快照记录类型: {kind}")
+
+
+async def export_snapshot(
+    store: ConversationStore,
+    registry: CharacterRegistry,
+    conversation_ids: Optional[List[str]] = None,
+    include_characters: bool = True,
+) -> AsyncIterator[bytes]:
+    """逐个会话读取并压缩输出快照；conversation_ids为空时导出全部会话
+
+    在事件循环中运行（ConversationStore不是线程安全的），每输出一块让出一次事件循环。
+    只导出选定会话时，角色映射也只包含这些会话。
+    """
+    encoder = SnapshotEncoder()
+    characters = sessions = conversations = 0
+    selected = set(conversation_ids) if conversation_ids else None
+
+    if include_characters:
+        for name, info in registry.get_characters().items():
+            chunk = encoder.write(character_record(name, info))
+            characters += 1
+            if chunk:
+                yield chunk
+        for conversation_id, character_name in registry.get_session_characters().items():
+            if selected is not None and conversation_id not in selected:
+                continue
+            chunk = encoder.write(session_record(conversation_id, character_name))
+            sessions += 1
+            if chunk:
+                yield chunk
+                await asyncio.sleep(0)
+
+    for conversation_id in (conversation_ids if conversation_ids else store.conversation_ids()):
+        messages = store.export_conversation(conversation_id)
+        if not messages:
+            continue
+        chunk = encoder.write(conversation_record(conversation_id, messages))
+        conversations += 1
+        if chunk:
+            yield chunk
+            await asyncio.sleep(0)
+
+    encoder.write(end_record(conversations, characters, sessions))
+    yield encoder.finish()
+
+
+async def import_snapshot(
+    store: ConversationStore,
+    registry: CharacterRegistry,
+    chunks: AsyncIterator[bytes],
+) -> Dict[str, int]:
+    """边接收边解析并写入快照：同名角色和同ID会话被覆盖，角色映射按SESSION_BATCH条一批写入
+
+    记录逐条生效，快照损坏或被截断时抛出SnapshotError，此前已导入的记录保留。
+    """
+    decoder = SnapshotDecoder()
+    counts = {"conversations": 0, "characters": 0, "sessions": 0, "messages": 0}
+    sessions: Dict[str, str] = {}
+
+    def flush_sessions():
+        if sessions:
+            registry.import_data({}, sessions)
+            counts["sessions"] += len(sessions)
+            sessions.clear()
+
+    async for chunk in chunks:
+        for kind, record in decoder.feed(chunk):
+            if kind == KIND_CHARACTER:
+                character_name, info = record
+                registry.import_data({character_name: info}, {})
+                counts["characters"] += 1
+            elif kind == KIND_SESSION:
+                conversation_id, character_name = record
+                sessions[conversation_id] = character_name
+                if len(sessions) >= SESSION_BATCH:
+                    flush_sessions()
+            elif kind == KIND_CONVERSATION:
+                conversation_id, messages = record
+                store.import_conversation(conversation_id, messages)
+                counts["conversations"] += 1
+                counts["messages"] += len(messages)
+    flush_sessions()
+    decoder.close()
+    expected = dict(zip(("conversations", "characters", "sessions"), decoder.expected_counts))
+    for key, value in expected.items():
+        if counts[key] != value:
+            raise SnapshotError(f"快照记录数不符：{key}应为{value}，实际导入{counts[key]}")
+    return counts
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+
+from conversation_store import ConversationStore
+from llm_client import LLMClient
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你负责为一场TRPG（桌上角色扮演游戏）跑团对话撰写滚动摘要。"
+    "请保留关键剧情进展、人物与NPC、地点、线索、检定结果、未解决的事项和玩家做出的重要决定，"
+    "省略寒暄和重复内容。只输出摘要正文，使用简洁的中文。"
+)
+
+
+class ConversationSummarizer:
+    """滚动摘要：会话token超过阈值时，在后台把较早的对话压缩为一条摘要
+
+    摘要在独立任务中生成，不阻塞请求路径；同一会话同时只有一个摘要任务。
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        client: LLMClient,
+        trigger_tokens: int,
+        keep_recent: int = 6,
+        max_tokens: int = 400,
+        model: Optional[str] = None,
+    ):
+        self.store = store
+        self.client = client
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent = keep_recent
+        self.max_tokens = max_tokens
+        self.model = model
+        self._running: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.summaries = 0
+        self.failures = 0
+        self.requests = 0
+        self.requests_with_summary = 0
+        self.tokens_saved = 0
+
+    def record_request(self, conversation_id: str) -> int:
+        """记录一次请求因摘要节省的token数并返回"""
+        saved = self.store.summary_savings(conversation_id)
+        self.requests += 1
+        if saved:
+            self.requests_with_summary += 1
+            self.tokens_saved += saved
+        return saved
+
+    def maybe_schedule(self, conversation_id: str):
+        """会话超过阈值且没有进行中的摘要任务时，启动后台摘要"""
+        if conversation_id in self._running:
+            return
+        if self.store.conversation_tokens(conversation_id) < self.trigger_tokens:
+            return
+        self._running.add(conversation_id)
+        task = asyncio.get_running_loop().create_task(self._summarize(conversation_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, conversation_id: str):
+        try:
+            candidates = self.store.summary_candidates(conversation_id, self.keep_recent)
+            if candidates is None:
+                return
+            older, previous_summary = candidates
+            parts = []
+            if previous_summary:
+                parts.append(f"此前的摘要：\n{previous_summary}")
+            parts.append("需要并入摘要的新对话：\n" + "\n".join(f"{m.role}: {m.content}" for m in older))
+            response = await self.client.generate(
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": "\n\n".join(parts)},
+                ],
+                model=self.model,
+                max_tokens=self.max_tokens,
+                temperature=0.3
+            )
+            if response.status_code != 200:
+                raise Exception(f"DashScope API调用失败: {response.message}")
+            summary = response.output.choices[0].message.content.strip()
+            if summary and self.store.apply_summary(conversation_id, older, summary):
+                self.summaries += 1
+                logger.info(f"会话 {conversation_id} 已压缩 {len(older)} 条历史消息为摘要")
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"生成会话摘要失败: {e}")
+        finally:
+            self._running.discard(conversation_id)
+
+    async def close(self):
+        """等待进行中的摘要任务结束"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "trigger_tokens": self.trigger_tokens,
+            "summaries": self.summaries,
+            "failures": self.failures,
+            "running": len(self._running),
+            "requests": self.requests,
+            "requests_with_summary": self.requests_with_summary,
+            "tokens_saved": self.tokens_saved,
+            "avg_tokens_saved_per_request": round(self.tokens_saved / self.requests, 1) if self.requests else 0,
+        }
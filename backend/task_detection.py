@@ -0,0 +1,184 @@
+import json
+import logging
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TASK_START_MARKER = "[TASK_DETECTION_START]"
+TASK_END_MARKER = "[TASK_DETECTION_END]"
+
+# 定时任务检测提示词
+TASK_DETECTION_SYSTEM_PROMPT = """
+你是一个智能助手，除了正常聊天外，还需要识别用户消息中是否包含定时任务需求。
+
+请在回复用户消息后，额外输出一个特殊的任务检测标记：
+[TASK_DETECTION_START]
+{
+  "has_task": true/false,
+  "task_type": "cron" 或 "daily" 或 null,
+  "task_value": "cron表达式" 或 "时间格式HH:MM" 或 null,
+  "task_description": "任务描述" 或 null,
+  "task_action": "任务要执行的动作" 或 null
+}
+[TASK_DETECTION_END]
+
+识别规则：
+1. 定时任务需要60级或以上权限才能创建
+2. 识别关键词：定时、每天、每小时、每分钟、提醒、通知、任务等
+3. 时间表达：
+   - "每天8:30" -> task_type="daily", task_value="08:30"
+   - "每5分钟" -> task_type="cron", task_value="*/5 * * * *"
+   - "每小时" -> task_type="cron", task_value="0 * * * *"
+   - "每天中午12点" -> task_type="daily", task_value="12:00"
+
+示例：
+用户说："每天早上8点提醒我吃药"
+你应该回复："好的，我会为你设置每天早上8点的吃药提醒。[TASK_DETECTION_START]{"has_task": true, "task_type": "daily", "task_value": "08:00", "task_description": "每天早上8点吃药提醒", "task_action": "提醒吃药"}[TASK_DETECTION_END]"
+
+如果用户只是普通聊天，则：
+[TASK_DETECTION_START]{"has_task": false, "task_type": null, "task_value": null, "task_description": null, "task_action": null}[TASK_DETECTION_END]
+"""
+
+# 预分类规则：取自上面提示词中的识别关键词和时间表达，宁可多判也不漏判
+TASK_TRIGGER_PATTERN = re.compile(
+    r"定时|定期|每天|每日|每晚|每早|每周|每星期|每月|每小时|每分钟|每隔"
+    r"|每\s*[\d一二三四五六七八九十两半]+\s*个?\s*(?:秒|分|小时|钟头|天|日|周|星期|月)"
+    r"|提醒|通知|任务|闹钟|叫醒|叫我|别忘|准时"
+    r"|\d{1,2}\s*[:：]\s*\d{2}"
+    r"|(?:早上|上午|中午|下午|傍晚|晚上|凌晨|明天|今晚|后天)\s*[\d一二三四五六七八九十两]{1,3}\s*[点時时]"
+    r"|cron|remind|schedule|daily|every\s*(?:day|hour|minute|week|\d)",
+    re.IGNORECASE
+)
+
+
+def looks_like_task(message: str) -> bool:
+    """本地快速判断消息是否可能包含定时任务需求"""
+    return TASK_TRIGGER_PATTERN.search(message) is not None
+
+
+class TaskPreClassifier:
+    """任务检测预分类：只有被关键词/正则命中的消息才在本次调用中附加任务检测提示词
+
+    未命中的消息既不发送提示词，模型也无需输出任务检测块。关闭时所有消息都走任务检测。
+    """
+
+    def __init__(self, enabled: bool = True, prompt_tokens: int = 0):
+        self.enabled = enabled
+        # 任务检测提示词的token数，用于统计节省量
+        self.prompt_tokens = prompt_tokens
+        self.checked = 0
+        self.flagged = 0
+        self.tokens_saved = 0
+
+    def needs_detection(self, messages: Iterable[str]) -> bool:
+        self.checked += 1
+        if not self.enabled or any(looks_like_task(message) for message in messages):
+            self.flagged += 1
+            return True
+        self.tokens_saved += self.prompt_tokens
+        return False
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "checked": self.checked,
+            "flagged": self.flagged,
+            "skipped": self.checked - self.flagged,
+            "prompt_tokens": self.prompt_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+
+def parse_task_info(ai_response: str) -> Tuple[str, Optional[Dict]]:
+    """解析AI回复中的任务信息"""
+    try:
+        # 查找任务检测标记
+        start_marker = TASK_START_MARKER
+        end_marker = TASK_END_MARKER
+        
+        start_pos = ai_response.find(start_marker)
+        end_pos = ai_response.find(end_marker)
+        
+        if start_pos == -1 or end_pos == -1:
+            return ai_response, None
+        
+        # 提取任务信息JSON
+        task_json_str = ai_response[start_pos + len(start_marker):end_pos].strip()
+        task_info = json.loads(task_json_str)
+        
+        # 移除AI回复中的任务检测标记
+        clean_response = ai_response[:start_pos].strip()
+        if clean_response.endswith("[TASK_DETECTION_START]"):
+            clean_response = clean_response[:-len("[TASK_DETECTION_START]")].strip()
+        
+        return clean_response, task_info if task_info.get("has_task") else None
+        
+    except Exception as e:
+        logger.error(f"解析任务信息失败: {e}")
+        return ai_response, None
+
+
+class TaskInfoStreamParser:
+    """流式解析AI回复：转发正文增量，扣留任务检测块，结束时给出完整正文和任务信息
+
+    feed()返回可以立即发送给用户的文本。可能构成开始标记前缀的尾部和末尾空白会被暂时扣留，
+    遇到开始标记后其后的内容全部扣留，保证任务检测块不会泄露给用户。
+    """
+
+    def __init__(self):
+        # 已发送的正文片段
+        self._sent = []
+        # 尚未发送的尾部：末尾空白和可能构成开始标记前缀的字符
+        self._pending = ""
+        # 开始标记之后的内容，遇到开始标记前为None
+        self._block = None
+
+    def feed(self, delta: str) -> str:
+        if self._block is not None:
+            self._block.append(delta)
+            return ""
+        buffer = self._pending + delta
+        if not self._sent:
+            # 与parse_task_info一致，去掉开头空白
+            buffer = buffer.lstrip()
+        marker_pos = buffer.find(TASK_START_MARKER)
+        if marker_pos != -1:
+            self._block = [buffer[marker_pos + len(TASK_START_MARKER):]]
+            self._pending = ""
+            text = buffer[:marker_pos].rstrip()
+        else:
+            # 扣留末尾空白：若其后紧跟任务块，这些空白不属于正文
+            text = buffer[:len(buffer) - _partial_marker_length(buffer)].rstrip()
+            self._pending = buffer[len(text):]
+        if text:
+            self._sent.append(text)
+        return text
+
+    def finish(self) -> Tuple[str, str, Optional[Dict]]:
+        """结束解析，返回(尚未发送的正文尾部, 完整正文, 任务信息)
+
+        只要出现过开始标记，完整正文就截止到开始标记；任务块不完整（例如被max_tokens截断）
+        或JSON无法解析时丢弃任务块，任务信息为None。
+        """
+        if self._block is None:
+            tail = self._pending.rstrip()
+            return tail, "".join(self._sent) + tail, None
+        block = "".join(self._block)
+        end_pos = block.find(TASK_END_MARKER)
+        task_info = None
+        if end_pos != -1:
+            try:
+                task_info = json.loads(block[:end_pos].strip())
+            except ValueError as e:
+                logger.error(f"解析任务信息失败: {e}")
+        if not isinstance(task_info, dict) or not task_info.get("has_task"):
+            task_info = None
+        return "", "".join(self._sent), task_info
+
+
+def _partial_marker_length(text: str) -> int:
+    """text末尾与开始标记前缀重合的最大长度"""
+    for length in range(min(len(TASK_START_MARKER) - 1, len(text)), 0, -1):
+        if text.endswith(TASK_START_MARKER[:length]):
+            return length
+    return 0
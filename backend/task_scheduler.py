@@ -0,0 +1,498 @@
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 调度循环的最长休眠（秒），新任务会提前唤醒；也是主调度租约的续约和同步其他worker新任务的间隔
+IDLE_SLEEP = 10.0
+# 主调度租约时长（秒）：多worker共用数据库时只有持有租约的worker运行调度，租约过期后由其他worker接管
+LEADER_LEASE = 30.0
+# 同步其他worker新建的任务时向前多看的秒数，覆盖写入时间与提交时间之间的差
+TASK_SYNC_MARGIN = 5.0
+# 已确认的投递记录保留多久（秒），用于多worker下同一次触发的去重
+ACKED_RETENTION = 86400.0
+# 长轮询在没有本进程通知时重新查询数据库的间隔（秒），多worker下其他worker产生的投递靠它发现
+POLL_RECHECK_INTERVAL = 1.0
+
+
+def _parse_cron_field(text: str, low: int, high: int) -> List[int]:
+    values = set()
+    for part in text.split(","):
+        base, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if step <= 0:
+            raise ValueError(f"cron步长必须为正数: {part}")
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            start_text, end_text = base.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(base)
+            end = high if step_text else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron字段超出范围（{low}-{high}）: {part}")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class CronSchedule:
+    """5字段cron表达式（分 时 日 月 周），支持 *、*/n、a-b、a-b/n 和逗号列表，周日为0或7
+
+    与标准cron一致，日和周都被限定时满足其一即可。
+    """
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron表达式需要5个字段: {expression}")
+        try:
+            self.minutes = _parse_cron_field(parts[0], 0, 59)
+            self.hours = _parse_cron_field(parts[1], 0, 23)
+            self.days = set(_parse_cron_field(parts[2], 1, 31))
+            self.months = set(_parse_cron_field(parts[3], 1, 12))
+            self.weekdays = {day % 7 for day in _parse_cron_field(parts[4], 0, 7)}
+        except ValueError as e:
+            raise ValueError(f"无效的cron表达式 {expression}: {e}")
+        self.day_restricted = parts[2] != "*"
+        self.weekday_restricted = parts[4] != "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        in_days = moment.day in self.days
+        # Python的weekday()周一为0，cron周日为0
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def next_after(self, after: datetime) -> datetime:
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            index = bisect_left(self.hours, moment.hour)
+            if index == len(self.hours):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if self.hours[index] != moment.hour:
+                moment = moment.replace(hour=self.hours[index], minute=0)
+            index = bisect_left(self.minutes, moment.minute)
+            if index == len(self.minutes):
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+                continue
+            return moment.replace(minute=self.minutes[index])
+        raise ValueError("cron表达式在5年内没有可触发的时间")
+
+
+class DailySchedule:
+    """每天固定时刻，格式HH:MM"""
+
+    def __init__(self, value: str):
+        try:
+            hour_text, minute_text = value.strip().split(":")
+            self.hour, self.minute = int(hour_text), int(minute_text)
+        except ValueError:
+            raise ValueError(f"无效的每日时间（需要HH:MM）: {value}")
+        if not (0 <= self.hour <= 23 and 0 <= self.minute <= 59):
+            raise ValueError(f"无效的每日时间（需要HH:MM）: {value}")
+
+    def next_after(self, after: datetime) -> datetime:
+        moment = after.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if moment <= after:
+            moment += timedelta(days=1)
+        return moment
+
+
+def parse_schedule(task_type: str, task_value: str):
+    """按任务检测提示词定义的格式解析：cron为5字段表达式，daily为HH:MM"""
+    if task_type == "cron":
+        return CronSchedule(task_value)
+    if task_type == "daily":
+        return DailySchedule(task_value)
+    raise ValueError(f"不支持的任务类型: {task_type}")
+
+
+def next_fire_time(task_type: str, task_value: str, after: float) -> float:
+    """下次触发时间（Unix时间戳），按服务器本地时间计算"""
+    schedule = parse_schedule(task_type, task_value)
+    return schedule.next_after(datetime.fromtimestamp(after)).timestamp()
+
+
+class TaskScheduler:
+    """持久化的定时任务调度器
+
+    任务保存在SQLite中，内存里按下次触发时间建小顶堆，调度循环只看堆顶，添加和触发都是O(log n)；
+    删除任务时不动堆，弹出时发现任务已删除或触发时间已变化就跳过。
+    到期的任务生成一条投递记录，插件通过长轮询取走，确认前每lease秒重新下发一次；
+    触发后超过max(misfire_grace, lease)秒仍未确认的投递视为过期，不再下发并在下次触发时删除。
+    多个worker共用同一个数据库时，只有持有主调度租约的worker运行调度循环，它定期把其他worker新建的任务同步进自己的堆；
+    即使租约交接期间两个worker同时触发，同一任务的同一次触发也只会生成一条投递记录。
+    重启期间错过的触发在misfire_grace秒内的补发一次，更早的直接跳到下一次。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lease: float = 60.0,
+        misfire_grace: float = 300.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.lease = lease
+        self.misfire_grace = misfire_grace
+        # 未确认的投递在触发后保留多久，至少要给客户端一次完整的租期
+        self.delivery_expiry = max(misfire_grace, lease)
+        self.clock = clock
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scheduled_tasks (
+                id TEXT PRIMARY KEY,
+                conversation_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                user_name TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                task_value TEXT NOT NULL,
+                description TEXT,
+                action TEXT,
+                created_at REAL NOT NULL,
+                next_fire REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_conversation ON scheduled_tasks (conversation_id);
+            CREATE INDEX IF NOT EXISTS idx_tasks_created ON scheduled_tasks (created_at);
+            CREATE TABLE IF NOT EXISTS task_deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL,
+                fire_time REAL NOT NULL,
+                conversation_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                user_name TEXT NOT NULL,
+                description TEXT,
+                action TEXT,
+                leased_until REAL NOT NULL DEFAULT 0,
+                acked_at REAL,
+                UNIQUE (task_id, fire_time)
+            );
+            CREATE INDEX IF NOT EXISTS idx_deliveries_pending ON task_deliveries (acked_at, leased_until);
+            CREATE TABLE IF NOT EXISTS scheduler_leader (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+        self._lock = threading.Lock()
+        # 小顶堆 (下次触发时间, 任务ID)；_next_fire记录每个任务当前有效的触发时间
+        self._heap: List[Tuple[float, str]] = []
+        self._next_fire: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._delivered: Optional[asyncio.Event] = None
+        self._owner = uuid.uuid4().hex
+        self.leader = False
+        self._synced_at = 0.0
+        self.fired = 0
+        self.skipped_misfires = 0
+        self.acked = 0
+        self.expired = 0
+        self._load()
+
+    def _load(self):
+        rows = self._conn.execute("SELECT id, next_fire FROM scheduled_tasks").fetchall()
+        self._heap = [(next_fire, task_id) for task_id, next_fire in rows]
+        heapq.heapify(self._heap)
+        self._next_fire = {task_id: next_fire for task_id, next_fire in rows}
+
+    def _push(self, task_id: str, next_fire: float):
+        self._next_fire[task_id] = next_fire
+        heapq.heappush(self._heap, (next_fire, task_id))
+        if self._wakeup is not None and self._heap[0][1] == task_id:
+            self._wakeup.set()
+
+    def _maybe_compact(self):
+        # 失效条目超过一半时重建堆，避免大量删除后堆无限增长
+        if len(self._heap) > 2 * len(self._next_fire) + 64:
+            self._heap = [(next_fire, task_id) for task_id, next_fire in self._next_fire.items()]
+            heapq.heapify(self._heap)
+
+    def add_task(self, conversation_id: str, user_id: str, user_name: str, task_info: Dict) -> Dict:
+        """保存任务并加入调度，task_value无效时抛出ValueError"""
+        task_type = task_info.get("task_type")
+        task_value = str(task_info.get("task_value") or "")
+        now = self.clock()
+        next_fire = next_fire_time(task_type, task_value, now)
+        task_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO scheduled_tasks (id, conversation_id, user_id, user_name, task_type, task_value, "
+                "description, action, created_at, next_fire) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (task_id, conversation_id, user_id, user_name, task_type, task_value,
+                 task_info.get("task_description"), task_info.get("task_action"), now, next_fire)
+            )
+            self._push(task_id, next_fire)
+        return {"task_id": task_id, "next_fire": datetime.fromtimestamp(next_fire).isoformat(timespec="minutes")}
+
+    def remove_task(self, task_id: str) -> bool:
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM scheduled_tasks WHERE id = ?", (task_id,)).rowcount
+            self._next_fire.pop(task_id, None)
+            self._maybe_compact()
+        return bool(removed)
+
+    def remove_conversation_tasks(self, conversation_id: str) -> int:
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM scheduled_tasks WHERE conversation_id = ?", (conversation_id,)
+            )]
+            self._conn.execute("DELETE FROM scheduled_tasks WHERE conversation_id = ?", (conversation_id,))
+            for task_id in ids:
+                self._next_fire.pop(task_id, None)
+            self._maybe_compact()
+        return len(ids)
+
+    def list_tasks(self, conversation_id: Optional[str] = None) -> List[Dict]:
+        sql = ("SELECT id, conversation_id, user_id, user_name, task_type, task_value, description, action, "
+               "created_at, next_fire FROM scheduled_tasks")
+        params: tuple = ()
+        if conversation_id is not None:
+            sql += " WHERE conversation_id = ?"
+            params = (conversation_id,)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY next_fire", params).fetchall()
+        return [{
+            "task_id": row[0],
+            "conversation_id": row[1],
+            "user_id": row[2],
+            "user_name": row[3],
+            "task_type": row[4],
+            "task_value": row[5],
+            "task_description": row[6],
+            "task_action": row[7],
+            "created_at": datetime.fromtimestamp(row[8]).isoformat(timespec="seconds"),
+            "next_fire": datetime.fromtimestamp(row[9]).isoformat(timespec="minutes"),
+        } for row in rows]
+
+    def next_due(self) -> Optional[float]:
+        """最近一次触发时间，顺带丢弃堆顶已失效的条目"""
+        while self._heap and self._next_fire.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def fire_due(self, now: Optional[float] = None) -> int:
+        """弹出所有到期的任务，生成投递记录并计算下次触发时间，返回生成的投递数"""
+        now = self.clock() if now is None else now
+        created = 0
+        with self._lock:
+            due = []
+            while self.next_due() is not None and self._heap[0][0] <= now:
+                fire_time, task_id = heapq.heappop(self._heap)
+                del self._next_fire[task_id]
+                due.append((fire_time, task_id))
+            if not due:
+                return 0
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for fire_time, task_id in due:
+                    # 以数据库为准：其他worker可能已删除该任务或推进了触发时间
+                    row = conn.execute(
+                        "SELECT conversation_id, user_id, user_name, task_type, task_value, description, action, "
+                        "next_fire FROM scheduled_tasks WHERE id = ?", (task_id,)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    conversation_id, user_id, user_name, task_type, task_value, description, action, stored = row
+                    fire_time = stored
+                    if fire_time <= now:
+                        if now - fire_time <= self.misfire_grace:
+                            created += conn.execute(
+                                "INSERT OR IGNORE INTO task_deliveries (task_id, fire_time, conversation_id, user_id, "
+                                "user_name, description, action) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (task_id, fire_time, conversation_id, user_id, user_name, description, action)
+                            ).rowcount
+                        else:
+                            self.skipped_misfires += 1
+                        next_fire = next_fire_time(task_type, task_value, now)
+                    else:
+                        next_fire = fire_time
+                    conn.execute("UPDATE scheduled_tasks SET next_fire = ? WHERE id = ?", (next_fire, task_id))
+                    self._push(task_id, next_fire)
+                conn.execute("DELETE FROM task_deliveries WHERE acked_at IS NOT NULL AND acked_at < ?",
+                             (now - ACKED_RETENTION,))
+                # 没有客户端确认的投递（例如插件已关闭后端定时任务）不能无限堆积
+                expired = conn.execute("DELETE FROM task_deliveries WHERE acked_at IS NULL AND fire_time < ?",
+                                       (now - self.delivery_expiry,)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.fired += created
+        self.expired += expired
+        if created and self._delivered is not None:
+            self._delivered.set()
+        return created
+
+    def claim_deliveries(self, limit: int = 50) -> List[Dict]:
+        """取出待投递的记录并租出lease秒，租期内不会再次下发"""
+        now = self.clock()
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, task_id, fire_time, conversation_id, user_id, user_name, description, action "
+                    "FROM task_deliveries WHERE acked_at IS NULL AND leased_until <= ? AND fire_time >= ? "
+                    "ORDER BY id LIMIT ?",
+                    (now, now - self.delivery_expiry, limit)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE task_deliveries SET leased_until = ? WHERE id = ?",
+                    [(now + self.lease, row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [{
+            "delivery_id": row[0],
+            "task_id": row[1],
+            "fire_time": datetime.fromtimestamp(row[2]).isoformat(timespec="minutes"),
+            "conversation_id": row[3],
+            "user_id": row[4],
+            "user_name": row[5],
+            "task_description": row[6],
+            "task_action": row[7],
+        } for row in rows]
+
+    async def wait_for_deliveries(self, timeout: float, limit: int = 50) -> List[Dict]:
+        """长轮询：有待投递记录时立即返回，否则最多等待timeout秒"""
+        if self._delivered is None:
+            self._delivered = asyncio.Event()
+        deadline = time.monotonic() + timeout
+        while True:
+            self._delivered.clear()
+            deliveries = self.claim_deliveries(limit)
+            remaining = deadline - time.monotonic()
+            if deliveries or remaining <= 0:
+                return deliveries
+            try:
+                await asyncio.wait_for(self._delivered.wait(), timeout=min(remaining, POLL_RECHECK_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+    def ack(self, delivery_ids: List[int]) -> int:
+        """确认投递完成，已确认的记录不再下发"""
+        now = self.clock()
+        with self._lock:
+            acked = self._conn.executemany(
+                "UPDATE task_deliveries SET acked_at = ? WHERE id = ? AND acked_at IS NULL",
+                [(now, delivery_id) for delivery_id in delivery_ids]
+            ).rowcount
+        self.acked += acked
+        return acked
+
+    def try_lead(self) -> bool:
+        """获取或续约主调度租约，返回本worker是否负责调度；刚成为主调度时从数据库重新加载全部任务"""
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO scheduler_leader (id, owner, expires_at) VALUES (1, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE scheduler_leader.owner = excluded.owner OR scheduler_leader.expires_at < ? RETURNING owner",
+                (self._owner, now + LEADER_LEASE, now)
+            ).fetchone()
+            was_leader, self.leader = self.leader, row is not None
+            if self.leader and not was_leader:
+                self._load()
+                if self._wakeup is not None:
+                    self._wakeup.set()
+            elif self.leader:
+                self._sync_new_tasks(now)
+            if self.leader:
+                self._synced_at = now
+        if self.leader != was_leader:
+            logger.info(f"{'成为' if self.leader else '不再是'}定时任务主调度")
+        return self.leader
+
+    def _sync_new_tasks(self, now: float):
+        """把其他worker新建、尚未进入本地堆的任务加入调度（调用方持有_lock）"""
+        rows = self._conn.execute(
+            "SELECT id, next_fire FROM scheduled_tasks WHERE created_at >= ?", (self._synced_at - TASK_SYNC_MARGIN,)
+        ).fetchall()
+        for task_id, next_fire in rows:
+            if task_id not in self._next_fire:
+                self._push(task_id, next_fire)
+
+    def _resign(self):
+        """释放主调度租约，其他worker下次续约时即可接管"""
+        with self._lock:
+            self._conn.execute("DELETE FROM scheduler_leader WHERE owner = ?", (self._owner,))
+        self.leader = False
+
+    async def _run(self):
+        while True:
+            try:
+                if self.try_lead():
+                    self.fire_due()
+            except Exception as e:
+                logger.error(f"触发定时任务失败: {e}")
+            next_due = self.next_due() if self.leader else None
+            delay = IDLE_SLEEP if next_due is None else min(IDLE_SLEEP, max(0.0, next_due - self.clock()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """在当前事件循环中启动调度循环"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._delivered = self._delivered or asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._resign()
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            tasks = self._conn.execute("SELECT COUNT(*) FROM scheduled_tasks").fetchone()[0]
+            pending = self._conn.execute(
+                "SELECT COUNT(*) FROM task_deliveries WHERE acked_at IS NULL"
+            ).fetchone()[0]
+        next_due = self.next_due()
+        return {
+            "tasks": tasks,
+            "leader": self.leader,
+            "heap_size": len(self._heap),
+            "pending_deliveries": pending,
+            "fired": self.fired,
+            "acked": self.acked,
+            "skipped_misfires": self.skipped_misfires,
+            "expired_deliveries": self.expired,
+            "next_fire": datetime.fromtimestamp(next_due).isoformat(timespec="minutes") if next_due else None,
+        }
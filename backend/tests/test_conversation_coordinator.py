@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from conversation_coordinator import ConversationCoordinator
+
+
+class RecordingProcess:
+    """记录每次调用收到的批次；gate未放行时阻塞，用来在LLM调用进行中制造排队"""
+
+    def __init__(self):
+        self.batches = []
+        self.running = 0
+        self.max_running = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.fail = False
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await self.gate.wait()
+            await asyncio.sleep(0)
+            if self.fail:
+                raise RuntimeError("LLM调用失败")
+            return "+".join(items)
+        finally:
+            self.running -= 1
+
+
+async def start(coordinator, process, conversation_id, item):
+    """发起一个请求，并让它运行到排队等锁为止"""
+    task = asyncio.ensure_future(coordinator.run(conversation_id, item, process))
+    await asyncio.sleep(0)
+    return task
+
+
+async def test_serializes_requests_in_arrival_order():
+    coordinator = ConversationCoordinator(coalesce=False)
+    process = RecordingProcess()
+    process.gate.clear()
+    tasks = [await start(coordinator, process, "g", f"m{index}") for index in range(5)]
+    process.gate.set()
+    results = await asyncio.gather(*tasks)
+
+    assert process.batches == [[f"m{index}"] for index in range(5)]
+    assert process.max_running == 1
+    assert results == [(f"m{index}", False) for index in range(5)]
+    assert coordinator.stats()["active_conversations"] == 0
+
+
+async def test_different_conversations_run_concurrently():
+    coordinator = ConversationCoordinator(coalesce=True)
+    process = RecordingProcess()
+    process.gate.clear()
+    tasks = [await start(coordinator, process, f"g{index}", "m") for index in range(3)]
+    assert process.running == 3
+    process.gate.set()
+    await asyncio.gather(*tasks)
+
+
+async def test_coalesces_messages_arriving_during_llm_call():
+    coordinator = ConversationCoordinator(coalesce=True)
+    process = RecordingProcess()
+    process.gate.clear()
+    first = await start(coordinator, process, "g", "m0")
+    rest = [await start(coordinator, process, "g", f"m{index}") for index in range(1, 5)]
+    process.gate.set()
+
+    assert await first == ("m0", False)
+    assert await asyncio.gather(*rest) == [("m1+m2+m3+m4", False)] + [("m1+m2+m3+m4", True)] * 3
+    assert process.batches == [["m0"], ["m1", "m2", "m3", "m4"]]
+    stats = coordinator.stats()
+    assert (stats["batches"], stats["coalesced_requests"], stats["active_conversations"]) == (2, 3, 0)
+
+
+async def test_batch_size_is_bounded():
+    coordinator = ConversationCoordinator(coalesce=True, max_batch=2)
+    process = RecordingProcess()
+    process.gate.clear()
+    tasks = [await start(coordinator, process, "g", f"m{index}") for index in range(5)]
+    process.gate.set()
+    await asyncio.gather(*tasks)
+
+    assert process.batches == [["m0"], ["m1", "m2"], ["m3", "m4"]]
+
+
+async def test_failure_propagates_to_coalesced_requests():
+    coordinator = ConversationCoordinator(coalesce=True)
+    process = RecordingProcess()
+    process.gate.clear()
+    first = await start(coordinator, process, "g", "m0")
+    rest = [await start(coordinator, process, "g", f"m{index}") for index in range(1, 3)]
+    process.fail = True
+    process.gate.set()
+
+    results = await asyncio.gather(first, *rest, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert coordinator.stats()["active_conversations"] == 0
+
+
+async def test_cancelled_waiter_is_not_sent_to_llm():
+    coordinator = ConversationCoordinator(coalesce=True)
+    process = RecordingProcess()
+    process.gate.clear()
+    first = await start(coordinator, process, "g", "m0")
+    cancelled = await start(coordinator, process, "g", "m1")
+    kept = await start(coordinator, process, "g", "m2")
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    process.gate.set()
+
+    assert await first == ("m0", False)
+    assert await kept == ("m2", False)
+    assert process.batches == [["m0"], ["m2"]]
+    assert coordinator.stats()["active_conversations"] == 0
+
+
+async def test_cancelled_only_waiter_releases_state():
+    coordinator = ConversationCoordinator(coalesce=True)
+    process = RecordingProcess()
+    process.gate.clear()
+    first = await start(coordinator, process, "g", "m0")
+    cancelled = await start(coordinator, process, "g", "m1")
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    process.gate.set()
+    await first
+
+    assert process.batches == [["m0"]]
+    assert coordinator.stats()["active_conversations"] == 0
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+import history_backend
+from history_backend import JsonlHistoryBackend, SQLiteHistoryBackend
+
+
+class StalledSQLiteBackend(SQLiteHistoryBackend):
+    """写线程在release之前不落盘"""
+
+    def __init__(self, *args, **kwargs):
+        self.release = threading.Event()
+        super().__init__(*args, **kwargs)
+
+    def _write_batch(self, batch):
+        self.release.wait()
+        super()._write_batch(batch)
+
+
+def test_load_serves_pending_writes_without_waiting(tmp_path):
+    backend = StalledSQLiteBackend(str(tmp_path / "history.db"), flush_interval=0.01)
+    try:
+        backend.append("c1", "user", "你好")
+        backend.append("c1", "assistant", "你好呀")
+        backend.trim("c1", 1)
+        backend.replace("c2", [("system", "提示")])
+        backend.append("c2", "user", "在吗")
+        assert backend.load("c1") == [("assistant", "你好呀")]
+        assert backend.load("c2") == [("system", "提示"), ("user", "在吗")]
+        assert sorted(backend.conversation_ids()) == ["c1", "c2"]
+    finally:
+        backend.release.set()
+        backend.close()
+    reopened = SQLiteHistoryBackend(str(tmp_path / "history.db"))
+    try:
+        assert reopened.load("c1") == [("assistant", "你好呀")]
+        assert reopened.load("c2") == [("system", "提示"), ("user", "在吗")]
+    finally:
+        reopened.close()
+
+
+def failing_once(monkeypatch, target, name):
+    original = getattr(target, name)
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise OSError("disk error")
+        return original(*args, **kwargs)
+    monkeypatch.setattr(target, name, wrapper)
+    return calls
+
+
+class FlakyConnection:
+    """第一次提交失败的写连接"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+        if self.commits == 1:
+            raise OSError("disk error")
+        self.conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class FlakySQLiteBackend(SQLiteHistoryBackend):
+    def _open_writer(self):
+        super()._open_writer()
+        self._writer = FlakyConnection(self._writer)
+
+
+def test_sqlite_failed_batch_is_rolled_back_and_retried(tmp_path):
+    backend = FlakySQLiteBackend(str(tmp_path / "history.db"), flush_interval=0.01)
+    try:
+        backend.append("c1", "user", "你好")
+        backend.append("c1", "assistant", "你好呀")
+        backend.flush()
+        stats = backend.stats()
+        assert (stats["write_errors"], stats["failed_ops"], stats["written_ops"]) == (1, 0, 2)
+        assert backend._load("c1") == [("user", "你好"), ("assistant", "你好呀")]
+    finally:
+        backend.close()
+
+
+@pytest.mark.parametrize("retries, expected", [(3, [("user", "第一条"), ("user", "第二条")]), (0, [("user", "第一条")])])
+def test_jsonl_partial_write_is_truncated(tmp_path, monkeypatch, retries, expected):
+    directory = str(tmp_path / "log")
+    backend = JsonlHistoryBackend(directory, flush_interval=0.01, write_retries=retries)
+    try:
+        backend.append("c1", "user", "第一条")
+        backend.flush()
+        # 数据已写入文件，fsync失败
+        failing_once(monkeypatch, history_backend.os, "fsync")
+        backend.append("c1", "user", "第二条")
+        backend.flush()
+        monkeypatch.undo()
+        assert backend.stats()["failed_ops"] == (0 if retries else 1)
+        backend.append("c1", "assistant", "收到")
+        backend.flush()
+        assert backend.load("c1") == expected + [("assistant", "收到")]
+    finally:
+        backend.close()
+    reopened = JsonlHistoryBackend(directory)
+    try:
+        assert reopened.load("c1") == expected + [("assistant", "收到")]
+    finally:
+        reopened.close()
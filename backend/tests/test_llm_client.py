@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+
+import llm_client
+from benchmarks.common import ThreadedServer, free_port
+from benchmarks.fake_dashscope import FakeDashScope
+from llm_client import LLMClient, LLMTimeoutError, LLMUnavailableError
+
+MESSAGES = [{"role": "user", "content": "帮我投一个侦查"}]
+PRIMARY = "qwen-plus"
+FALLBACK = "qwen-turbo"
+LAST_RESORT = "qwen-max"
+
+
+@pytest.fixture
+def dashscope(monkeypatch):
+    llm_client.load_dashscope()
+    import dashscope
+
+    monkeypatch.setattr(dashscope, "api_key", "fake-key")
+    return dashscope
+
+
+@pytest.fixture
+def fake(dashscope, monkeypatch):
+    """注入故障的模拟DashScope，默认无延迟、不出错"""
+    fake = FakeDashScope(latency=0, chunk_interval=0)
+    with ThreadedServer(fake.app) as server:
+        monkeypatch.setattr(dashscope, "base_http_api_url", server.url + "/api/v1")
+        yield fake
+
+
+def make_client(**kwargs) -> LLMClient:
+    kwargs.setdefault("retry_base_delay", 0.001)
+    kwargs.setdefault("retry_max_delay", 0.01)
+    return LLMClient(max_concurrency=8, timeout=5, **kwargs)
+
+
+async def collect(client: LLMClient, **kwargs) -> str:
+    return "".join([delta async for delta in client.stream(MESSAGES, model=PRIMARY, **kwargs)])
+
+
+async def test_retries_transient_errors(fake):
+    client = make_client(retry_attempts=2)
+    fake.fail_next(503, 429)
+    response = await client.generate(MESSAGES, model=PRIMARY)
+
+    assert response.status_code == 200
+    assert fake.calls == 3
+    assert client.stats()["retries"] == 2
+
+
+async def test_returns_last_error_after_retries_exhausted(fake):
+    client = make_client(retry_attempts=2)
+    fake.fail_next(503, 503, 502, 503)
+    response = await client.generate(MESSAGES, model=PRIMARY)
+
+    assert response.status_code == 502
+    assert fake.calls == 3
+    assert client.stats()["retries"] == 2
+
+
+async def test_does_not_retry_client_errors(fake):
+    client = make_client(retry_attempts=2)
+    fake.fail_next(400)
+    response = await client.generate(MESSAGES, model=PRIMARY)
+
+    assert response.status_code == 400
+    assert fake.calls == 1
+    assert client.stats()["retries"] == 0
+
+
+async def test_timeout_is_not_retried(fake):
+    client = make_client(retry_attempts=2, fallback_models=[FALLBACK])
+    fake.latency = 0.5
+    with pytest.raises(LLMTimeoutError):
+        await client.generate(MESSAGES, model=PRIMARY, timeout=0.1)
+
+    assert fake.model_calls == {PRIMARY: 1}
+    stats = client.stats()
+    assert (stats["retries"], stats["fallbacks"]) == (0, 0)
+    assert stats["breakers"][PRIMARY]["consecutive_failures"] == 1
+
+
+async def test_stream_retries_before_first_delta(fake):
+    client = make_client(retry_attempts=1)
+    fake.fail_next(503)
+
+    assert await collect(client) == fake.reply
+    assert fake.calls == 2
+    assert client.stats()["retries"] == 1
+
+
+async def test_stream_timeout_is_not_retried(fake):
+    client = make_client(retry_attempts=2)
+    fake.latency = 0.5
+    with pytest.raises(LLMTimeoutError):
+        await collect(client, timeout=0.1)
+    assert fake.calls == 1
+
+
+async def test_breaker_opens_then_recovers_with_single_probe(fake):
+    client = make_client(breaker_failure_threshold=2, breaker_reset_timeout=0.3)
+    fake.fail_next(503, 503)
+    for _ in range(2):
+        assert (await client.generate(MESSAGES, model=PRIMARY)).status_code == 503
+    assert client.stats()["breakers"][PRIMARY]["state"] == "open"
+
+    # 熔断期间不调用上游，立即失败
+    with pytest.raises(LLMUnavailableError):
+        await client.generate(MESSAGES, model=PRIMARY)
+    assert fake.calls == 2
+
+    # 熔断到期后只放行一个探测调用，其余调用在探测完成前仍被拒绝
+    await asyncio.sleep(0.3)
+    fake.latency = 0.2
+    results = await asyncio.gather(
+        *(client.generate(MESSAGES, model=PRIMARY) for _ in range(3)), return_exceptions=True
+    )
+    assert fake.calls == 3
+    assert sum(1 for result in results if isinstance(result, LLMUnavailableError)) == 2
+    assert [result.status_code for result in results if not isinstance(result, Exception)] == [200]
+
+    breaker = client.stats()["breakers"][PRIMARY]
+    assert (breaker["state"], breaker["opens"], breaker["rejections"]) == ("closed", 1, 3)
+    fake.latency = 0
+    assert (await client.generate(MESSAGES, model=PRIMARY)).status_code == 200
+    assert fake.calls == 4
+
+
+async def test_falls_back_in_configured_order(fake):
+    client = make_client(retry_attempts=1, fallback_models=[FALLBACK, LAST_RESORT])
+    fake.fail_next(503, 503, model=PRIMARY)
+    fake.fail_next(500, 500, model=FALLBACK)
+    response = await client.generate(MESSAGES, model=PRIMARY)
+
+    assert response.status_code == 200
+    assert list(fake.model_calls.items()) == [(PRIMARY, 2), (FALLBACK, 2), (LAST_RESORT, 1)]
+    stats = client.stats()
+    assert (stats["retries"], stats["fallbacks"]) == (2, 2)
+
+
+async def test_skips_open_breaker_and_uses_fallback(fake):
+    client = make_client(breaker_failure_threshold=1, breaker_reset_timeout=60, fallback_models=[FALLBACK])
+    fake.fail_next(503, model=PRIMARY)
+    assert (await client.generate(MESSAGES, model=PRIMARY)).status_code == 200
+    assert (await client.generate(MESSAGES, model=PRIMARY)).status_code == 200
+
+    assert fake.model_calls == {PRIMARY: 1, FALLBACK: 2}
+    assert client.stats()["breakers"][PRIMARY]["rejections"] == 1
+
+
+async def test_unavailable_when_all_breakers_open(fake):
+    client = make_client(breaker_failure_threshold=1, breaker_reset_timeout=60, fallback_models=[FALLBACK])
+    fake.fail_next(503, model=PRIMARY)
+    fake.fail_next(503, model=FALLBACK)
+    assert (await client.generate(MESSAGES, model=PRIMARY)).status_code == 503
+
+    with pytest.raises(LLMUnavailableError):
+        await client.generate(MESSAGES, model=PRIMARY)
+    with pytest.raises(LLMUnavailableError):
+        await collect(client)
+    assert fake.calls == 2
+
+
+async def test_unavailable_when_no_model_is_reachable(dashscope, monkeypatch):
+    monkeypatch.setattr(dashscope, "base_http_api_url", f"http://127.0.0.1:{free_port()}/api/v1")
+    client = make_client(retry_attempts=1, fallback_models=[FALLBACK])
+
+    with pytest.raises(LLMUnavailableError):
+        await client.generate(MESSAGES, model=PRIMARY)
+    stats = client.stats()
+    assert (stats["retries"], stats["fallbacks"]) == (2, 1)
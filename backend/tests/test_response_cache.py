@@ -0,0 +1,27 @@
+from response_cache import ResponseCache
+
+
+def make_key(cache, conversation_id, message, context):
+    return cache.make_key(conversation_id, "digest", "qwen-turbo|default", message, context)
+
+
+def test_same_question_hits_after_normalization():
+    cache = ResponseCache()
+    context = [{"role": "user", "content": "[用户 甲(1)]: 开团了"}, {"role": "assistant", "content": "欢迎"}]
+    cache.put(make_key(cache, "g1", "在吗？", context), "在的")
+    assert cache.get(make_key(cache, "g1", "在吗", context)) == "在的"
+
+
+def test_conversations_with_different_context_miss():
+    cache = ResponseCache()
+    cache.put(make_key(cache, "g1", "继续", [{"role": "assistant", "content": "你推开了地下室的门"}]), "地下室很黑")
+    assert cache.get(make_key(cache, "g2", "继续", [{"role": "assistant", "content": "你登上了甲板"}])) is None
+    # 同一会话里上文不同也不命中
+    assert cache.get(make_key(cache, "g1", "继续", [{"role": "assistant", "content": "你登上了甲板"}])) is None
+
+
+def test_other_conversation_misses_even_with_same_context():
+    cache = ResponseCache()
+    cache.put(make_key(cache, "g1", "在吗", []), "在的")
+    assert cache.get(make_key(cache, "g2", "在吗", [])) is None
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,53 @@
+import sqlite3
+import time
+
+from conversation_store import ConversationStore
+from shared_state import SQLiteSharedState
+
+
+def user_messages(store, conversation_id):
+    return [message["content"] for message in store.build_context(conversation_id) if message["role"] == "user"]
+
+
+def test_writes_do_not_wait_for_other_workers(tmp_path):
+    path = str(tmp_path / "shared.db")
+    first = ConversationStore(max_history=10, backend=SQLiteSharedState(path, busy_timeout=5.0))
+    second = ConversationStore(max_history=10, backend=SQLiteSharedState(path))
+    # 模拟另一个worker长时间持有写锁
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        start = time.perf_counter()
+        first.add_message("c1", "system", "提示")
+        first.add_message("c1", "user", "你好")
+        assert time.perf_counter() - start < 0.5
+        assert user_messages(first, "c1") == ["你好"]
+    finally:
+        blocker.execute("COMMIT")
+        blocker.close()
+    first.backend.flush()
+    assert user_messages(second, "c1") == ["你好"]
+    first.close()
+    second.close()
+
+
+def test_concurrent_writers_converge(tmp_path):
+    path = str(tmp_path / "shared.db")
+    workers = [ConversationStore(max_history=10, backend=SQLiteSharedState(path)) for _ in range(2)]
+    workers[0].add_message("c1", "user", "第一条")
+    workers[0].backend.flush()
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    # 两个worker都在对方的写入提交前追加消息
+    workers[0].add_message("c1", "user", "甲")
+    workers[1].add_message("c1", "user", "乙")
+    blocker.execute("COMMIT")
+    blocker.close()
+    for worker in workers:
+        worker.backend.flush()
+    views = [user_messages(worker, "c1") for worker in workers]
+    assert views[0] == views[1]
+    assert sorted(views[0]) == ["乙", "甲", "第一条"]
+    assert sum(worker.backend.stats()["conflicts"] for worker in workers) == 1
+    for worker in workers:
+        worker.close()
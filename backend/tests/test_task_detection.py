@@ -0,0 +1,44 @@
+import pytest
+
+from task_detection import TASK_END_MARKER, TASK_START_MARKER, TaskInfoStreamParser, parse_task_info
+
+
+def stream(reply: str, chunk_size: int):
+    parser = TaskInfoStreamParser()
+    sent = "".join(parser.feed(reply[i:i + chunk_size]) for i in range(0, len(reply), chunk_size))
+    tail, clean, task_info = parser.finish()
+    return sent + tail, clean, task_info
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1000])
+def test_stream_matches_parse_task_info(chunk_size):
+    reply = ("  好的，我会每天早上8点提醒你吃药。\n\n" + TASK_START_MARKER
+             + '{"has_task": true, "task_type": "daily", "task_value": "08:00"}' + TASK_END_MARKER)
+    sent, clean, task_info = stream(reply, chunk_size)
+    assert (clean, task_info) == parse_task_info(reply)
+    assert sent == clean == "好的，我会每天早上8点提醒你吃药。"
+    assert task_info["task_value"] == "08:00"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_reply_without_block_keeps_marker_like_text(chunk_size):
+    reply = "数组写法是[TASK]，不是任务块 [TASK_DETECTION"
+    sent, clean, task_info = stream(reply, chunk_size)
+    assert sent == clean == reply
+    assert task_info is None
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1000])
+def test_malformed_block_is_dropped(chunk_size):
+    reply = "好的。" + TASK_START_MARKER + '{"has_task": true/false}' + TASK_END_MARKER
+    sent, clean, task_info = stream(reply, chunk_size)
+    assert sent == clean == "好的。"
+    assert task_info is None
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1000])
+def test_block_without_end_marker_is_dropped(chunk_size):
+    reply = "好的，已设置提醒。 " + TASK_START_MARKER + '{"has_task": true, "task_type": "da'
+    sent, clean, task_info = stream(reply, chunk_size)
+    assert sent == clean == "好的，已设置提醒。"
+    assert task_info is None
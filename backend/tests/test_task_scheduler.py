@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from task_scheduler import LEADER_LEASE, TaskScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2026, 1, 1, 8, 0).timestamp()
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_unacked_deliveries_expire(tmp_path):
+    clock = FakeClock()
+    scheduler = TaskScheduler(str(tmp_path / "tasks.db"), lease=60, misfire_grace=300, clock=clock)
+    task_id = scheduler.add_task("group_1", "u1", "甲", {"task_type": "cron", "task_value": "* * * * *"})["task_id"]
+    clock.now += 60
+    assert scheduler.fire_due() == 1
+    assert [d["task_id"] for d in scheduler.claim_deliveries()] == [task_id]
+    # 租期过后重新下发
+    clock.now += 61
+    assert len(scheduler.claim_deliveries()) == 1
+    # 超过misfire_grace仍未确认的不再下发，下次触发时删除
+    clock.now += 300
+    assert scheduler.claim_deliveries() == []
+    scheduler.fire_due()
+    stats = scheduler.stats()
+    assert (stats["expired_deliveries"], stats["pending_deliveries"]) == (1, 0)
+
+
+async def test_only_the_leader_schedules_tasks_from_all_workers(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / "tasks.db")
+    first = TaskScheduler(path, clock=clock)
+    second = TaskScheduler(path, clock=clock)
+    assert first.try_lead()
+    assert not second.try_lead()
+    # 非主调度worker新建的任务由主调度同步后触发
+    task_id = second.add_task("group_1", "u1", "甲", {"task_type": "daily", "task_value": "08:05"})["task_id"]
+    clock.now += 60
+    assert first.try_lead()
+    clock.now += 300
+    assert first.fire_due() == 1
+    assert [d["task_id"] for d in second.claim_deliveries()] == [task_id]
+    # 主调度退出后其他worker立即接管
+    await first.close()
+    assert second.try_lead()
+    assert second.stats()["leader"]
+    await second.close()
+
+
+def test_leader_lease_expires(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / "tasks.db")
+    first = TaskScheduler(path, clock=clock)
+    second = TaskScheduler(path, clock=clock)
+    assert first.try_lead()
+    clock.now += LEADER_LEASE - 1
+    assert not second.try_lead()
+    clock.now += 2
+    assert second.try_lead()
+    assert not first.try_lead()
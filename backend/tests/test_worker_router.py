@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks.common import free_port
+from worker_router import WorkerRouter
+
+
+def fake_worker(name: str, failure=None):
+    """模拟worker的/chat/batch：正常时逐条回复"名称:消息"，failure为(状态码, 响应)时整批失败，为秒数时延迟响应"""
+    received = []
+
+    async def chat_batch(request: web.Request):
+        items = (await request.json())["requests"]
+        received.extend(item["message"] for item in items)
+        if isinstance(failure, float):
+            await asyncio.sleep(failure)
+        elif failure is not None:
+            status, body = failure
+            if isinstance(body, str):
+                return web.Response(status=status, text=body)
+            return web.json_response(body, status=status)
+        results = [{"reply": f"{name}:{item['message']}", "success": True, "error": None, "task_info": None,
+                    "coalesced": False, "cached": False, "status": 200} for item in items]
+        return web.json_response({"success": True, "results": results, "succeeded": len(items), "failed": 0})
+
+    app = web.Application()
+    app.router.add_post("/chat/batch", chat_batch)
+    return app, received
+
+
+@pytest.fixture
+async def cluster():
+    """启动两个模拟worker和路由进程，返回 (路由客户端, 路由, 各worker收到的消息)"""
+    servers, clients = [], []
+
+    async def start(failure=None, timeout: float = 10):
+        apps = [fake_worker("w0"), fake_worker("w1", failure)]
+        for app, _ in apps:
+            server = TestServer(app)
+            await server.start_server()
+            servers.append(server)
+        router = WorkerRouter([str(server.make_url("")).rstrip("/") for server in servers[-2:]], timeout=timeout)
+        client = TestClient(TestServer(router.create_app()))
+        await client.start_server()
+        clients.append(client)
+        return client, router, [received for _, received in apps]
+
+    yield start
+    for client in clients:
+        await client.close()
+    for server in servers:
+        await server.close()
+
+
+def batch_for(router: WorkerRouter, per_worker: int = 2):
+    """构造交替落在两个worker上的批次，返回 (请求体, 每条消息所在的worker)"""
+    items, owners, counts = [], [], [0, 0]
+    index = 0
+    while min(counts) < per_worker:
+        conversation_id = f"group_{index}"
+        owner = router.pick(conversation_id)
+        index += 1
+        if counts[owner] >= per_worker:
+            continue
+        counts[owner] += 1
+        items.append({"user_id": "u", "message": f"m{len(items)}", "conversation_id": conversation_id})
+        owners.append(owner)
+    return {"requests": items}, owners
+
+
+async def test_splits_batch_and_keeps_order(cluster):
+    client, router, received = await cluster()
+    body, owners = batch_for(router)
+    resp = await client.post("/chat/batch", json=body)
+    data = await resp.json()
+
+    assert resp.status == 200
+    assert data["success"] and data["succeeded"] == len(owners)
+    assert [result["reply"] for result in data["results"]] == [
+        f"w{owner}:m{index}" for index, owner in enumerate(owners)
+    ]
+    assert sorted(received[0] + received[1]) == sorted(item["message"] for item in body["requests"])
+    assert router.stats()["split_batches"] == 1
+
+
+@pytest.mark.parametrize("failure, status, error", [
+    ((500, "Internal Server Error"), 500, "Internal Server Error"),
+    ((400, {"detail": "单次最多20条消息"}), 400, "单次最多20条消息"),
+    ((429, {"error": "rate limited"}), 429, "rate limited"),
+])
+async def test_failed_sub_batch_only_fails_its_items(cluster, failure, status, error):
+    client, router, received = await cluster(failure)
+    body, owners = batch_for(router)
+    resp = await client.post("/chat/batch", json=body)
+    data = await resp.json()
+
+    assert resp.status == 200
+    assert (data["success"], data["succeeded"], data["failed"]) == (False, owners.count(0), owners.count(1))
+    for index, (owner, result) in enumerate(zip(owners, data["results"])):
+        if owner == 0:
+            assert (result["success"], result["status"], result["reply"]) == (True, 200, f"w0:m{index}")
+        else:
+            assert (result["success"], result["status"], result["error"], result["reply"]) == (False, status, error, "")
+    # 正常worker上的消息只处理了一次
+    assert len(received[0]) == owners.count(0)
+
+
+async def test_timed_out_sub_batch_returns_504_items(cluster):
+    client, router, _ = await cluster(failure=1.0, timeout=0.3)
+    body, owners = batch_for(router, per_worker=1)
+    data = await (await client.post("/chat/batch", json=body)).json()
+
+    assert [result["status"] for result in data["results"]] == [200 if owner == 0 else 504 for owner in owners]
+
+
+async def test_all_workers_unreachable_returns_503():
+    router = WorkerRouter([f"http://127.0.0.1:{free_port()}", f"http://127.0.0.1:{free_port()}"])
+    client = TestClient(TestServer(router.create_app()))
+    await client.start_server()
+    try:
+        body, _ = batch_for(router, per_worker=1)
+        resp = await client.post("/chat/batch", json=body)
+        assert resp.status == 503
+        assert (await resp.json())["success"] is False
+    finally:
+        await client.close()
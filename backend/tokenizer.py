@@ -0,0 +1,35 @@
+import logging
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+TokenCounter = Callable[[str], int]
+
+
+def estimate_tokens(text: str) -> int:
+    """基于字符的快速token估算：CJK字符按1个token计，其余字符约4个计1个token
+
+    CJK字符的UTF-8编码为3字节，借助编码长度差在C层面统计宽字符数，避免逐字符的Python循环。
+    """
+    length = len(text)
+    wide = (len(text.encode('utf-8')) - length) // 2
+    return wide + (length - wide + 3) // 4
+
+
+def get_token_counter(name: str = "char", model: str = "qwen-turbo") -> TokenCounter:
+    """获取token计数函数
+
+    char: 字符估算（默认，无额外依赖）
+    dashscope: DashScope SDK自带的本地Qwen分词器（需要安装tiktoken），不可用时回退到字符估算
+    """
+    name = (name or "char").lower()
+    if name == "dashscope":
+        try:
+            from dashscope import get_tokenizer
+            tokenizer = get_tokenizer(model)
+            return lambda text: len(tokenizer.encode(text))
+        except Exception as e:
+            logger.warning(f"无法加载DashScope分词器，回退到字符估算: {e}")
+    elif name != "char":
+        logger.warning(f"未知的分词器 {name}，使用字符估算")
+    return estimate_tokens
@@ -0,0 +1,253 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# 不转发的逐跳头部
+HOP_HEADERS = {"host", "content-length", "transfer-encoding", "connection", "keep-alive"}
+# 检查worker进程存活的间隔（秒）
+SUPERVISE_INTERVAL = 1.0
+
+
+class WorkerProcess:
+    """监听本机端口的uvicorn worker子进程，退出后由路由进程重启"""
+
+    def __init__(self, port: int, app: str = "main:app"):
+        self.port = port
+        self.app = app
+        self.process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", self.app, "--host", "127.0.0.1", "--port", str(self.port)],
+            env=os.environ.copy()
+        )
+
+    def ensure_running(self):
+        if self.process is not None and self.process.poll() is not None:
+            logger.error(f"worker(端口{self.port})已退出（返回码{self.process.returncode}），正在重启")
+            self.restarts += 1
+            self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class WorkerRouter:
+    """会话亲和路由：按conversation_id的哈希把请求固定转发到同一个worker，没有会话ID的请求轮询分发
+
+    目标worker无法连接时依次尝试下一个worker（开启共享状态时对话历史仍然一致）。
+    /chat/batch按每条消息的会话拆分给各自的worker，合并结果后按原顺序返回；
+    某个子批次失败时只有其中的消息以该状态码返回错误，其他worker的结果照常返回。
+    """
+
+    def __init__(self, worker_urls: List[str], timeout: float = 600):
+        self.worker_urls = worker_urls
+        self.timeout = timeout
+        self._round_robin = itertools.cycle(range(len(worker_urls)))
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.forwarded = [0] * len(worker_urls)
+        self.failovers = 0
+        self.split_batches = 0
+
+    def pick(self, conversation_id: Optional[str]) -> int:
+        if conversation_id is None:
+            return next(self._round_robin)
+        return zlib.crc32(conversation_id.encode("utf-8")) % len(self.worker_urls)
+
+    @staticmethod
+    def conversation_id_of(request: web.Request, body: bytes) -> Optional[str]:
+        """从JSON请求体中取会话ID，缺省与ChatRequest一致为default；非JSON请求返回None"""
+        if request.method != "POST" or not body or request.content_type != "application/json":
+            return None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        return str(data.get("conversation_id", "default"))
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        if request.path == "/router/stats":
+            return web.json_response(self.stats())
+        body = await request.read()
+        if request.path == "/chat/batch" and request.method == "POST":
+            response = await self.handle_batch(request, body)
+            if response is not None:
+                return response
+        index = self.pick(self.conversation_id_of(request, body))
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+        last_error = None
+        for attempt in range(len(self.worker_urls)):
+            target = (index + attempt) % len(self.worker_urls)
+            try:
+                upstream = await self._session.request(
+                    request.method, self.worker_urls[target] + request.path_qs, headers=headers, data=body
+                )
+            except aiohttp.ClientConnectorError as e:
+                last_error = e
+                self.failovers += 1
+                continue
+            self.forwarded[target] += 1
+            async with upstream:
+                response = web.StreamResponse(status=upstream.status, headers={
+                    k: v for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS
+                })
+                await response.prepare(request)
+                # 逐块转发，保证SSE流式响应不被缓冲
+                async for chunk in upstream.content.iter_any():
+                    await response.write(chunk)
+                await response.write_eof()
+                return response
+        logger.error(f"所有worker均不可用: {last_error}")
+        return web.json_response({"success": False, "error": "后端worker不可用"}, status=503)
+
+    async def _post_json(self, index: int, request: web.Request, payload: Dict) -> Tuple[int, Dict]:
+        """向指定worker发送JSON请求，无法连接时依次尝试下一个worker"""
+        last_error = None
+        for attempt in range(len(self.worker_urls)):
+            target = (index + attempt) % len(self.worker_urls)
+            try:
+                async with self._session.post(self.worker_urls[target] + request.path_qs, json=payload) as upstream:
+                    self.forwarded[target] += 1
+                    text = await upstream.text()
+                    try:
+                        return upstream.status, json.loads(text)
+                    except ValueError:
+                        return upstream.status, {"detail": text}
+            except aiohttp.ClientConnectorError as e:
+                last_error = e
+                self.failovers += 1
+        raise last_error
+
+    async def handle_batch(self, request: web.Request, body: bytes) -> Optional[web.Response]:
+        """按会话把批量请求拆分到各自的worker；无法拆分时返回None，按普通请求转发由worker报错"""
+        try:
+            items = json.loads(body)["requests"]
+            conversation_ids = [str(item.get("conversation_id", "default")) for item in items]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        if len(items) > config.CHAT_BATCH_MAX_ITEMS:
+            # 超出上限的批次整体交给一个worker，由它返回400
+            return None
+        positions: Dict[int, List[int]] = {}
+        for position, conversation_id in enumerate(conversation_ids):
+            positions.setdefault(self.pick(conversation_id), []).append(position)
+        replies = await asyncio.gather(*(
+            self._post_json(index, request, {"requests": [items[p] for p in group]})
+            for index, group in positions.items()
+        ), return_exceptions=True)
+        if all(isinstance(reply, aiohttp.ClientConnectorError) for reply in replies):
+            logger.error(f"所有worker均不可用: {replies[0]}")
+            return web.json_response({"success": False, "error": "后端worker不可用"}, status=503)
+        results: List[Optional[Dict]] = [None] * len(items)
+        for group, reply in zip(positions.values(), replies):
+            sub_results = self._sub_batch_results(reply, len(group))
+            for position, result in zip(group, sub_results):
+                results[position] = result
+        succeeded = sum(1 for result in results if result.get("success"))
+        self.split_batches += 1
+        return web.json_response({
+            "success": succeeded == len(results),
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+        })
+
+    @staticmethod
+    def _sub_batch_results(reply, count: int) -> List[Dict]:
+        """子批次的逐条结果；子批次整体失败时（worker不可用或返回非200），其中每条消息都以该状态返回错误
+
+        其他worker已经调用LLM并写入历史，它们的结果不受影响。
+        """
+        if isinstance(reply, asyncio.TimeoutError):
+            status, error = 504, "后端worker响应超时"
+        elif isinstance(reply, aiohttp.ClientError):
+            status, error = 503, "后端worker不可用"
+        elif isinstance(reply, BaseException):
+            raise reply
+        else:
+            status, data = reply
+            if status == 200:
+                results = data.get("results") if isinstance(data, dict) else None
+                if isinstance(results, list) and len(results) == count:
+                    return results
+                status, error = 502, "worker返回的批量结果格式错误"
+            else:
+                detail = (data.get("detail") or data.get("error")) if isinstance(data, dict) else data
+                error = detail if isinstance(detail, str) else json.dumps(detail, ensure_ascii=False)
+        logger.error(f"子批次处理失败（{status}）: {error}")
+        return [{
+            "reply": "", "success": False, "error": error, "task_info": None,
+            "coalesced": False, "cached": False, "status": status,
+        } for _ in range(count)]
+
+    async def _on_startup(self, app: web.Application):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def _on_cleanup(self, app: web.Application):
+        await self._session.close()
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.worker_urls,
+            "forwarded": self.forwarded,
+            "failovers": self.failovers,
+            "split_batches": self.split_batches,
+        }
+
+
+def run_affinity(host: str, port: int, workers: int):
+    """启动workers个worker子进程（端口port+1起）并在port上运行会话亲和路由"""
+    processes = [WorkerProcess(port + 1 + i) for i in range(workers)]
+    for process in processes:
+        process.start()
+    router = WorkerRouter([process.url for process in processes])
+    app = router.create_app()
+
+    async def supervise(app: web.Application):
+        async def loop():
+            while True:
+                await asyncio.sleep(SUPERVISE_INTERVAL)
+                for process in processes:
+                    process.ensure_running()
+        task = asyncio.get_running_loop().create_task(loop())
+        yield
+        task.cancel()
+
+    app.cleanup_ctx.append(supervise)
+    try:
+        web.run_app(app, host=host, port=port, print=None)
+    finally:
+        for process in processes:
+            process.stop()
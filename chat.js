@@ -51,6 +51,10 @@ try {
     API_BASE_URL: 'http://localhost:1478',  // FastAPI服务地址
     TIMEOUT: 30000,  // 请求超时时间（毫秒）
     MAX_RETRIES: 3,   // 最大重试次数
+    BATCH_WINDOW: 200,  // 批量发送模式下默认的排队窗口（毫秒）
+    BATCH_MAX_SIZE: 20,  // 批量发送模式下单次最多发送的消息数
+    TASK_POLL_WAIT: 25,  // 后端定时任务长轮询的等待秒数
+    TASK_POLL_RETRY: 5000,  // 后端定时任务轮询失败后的重试间隔（毫秒）
   };
 
   // 工具函数：安全的获取用户ID
@@ -161,10 +165,7 @@ try {
           console.log(`执行定时任务: ${taskInfo.task_description}`);
           
           // 构建任务通知消息（简化格式，避免特殊字符问题）
-          let notificationMsg = `[定时任务提醒]\n\n`;
-          notificationMsg += `任务: ${taskInfo.task_description}\n`;
-          notificationMsg += `内容: ${taskInfo.task_action}\n`;
-          notificationMsg += `时间: ${new Date().toLocaleString()}\n`;
+          const notificationMsg = formatTaskNotification(taskInfo.task_description, taskInfo.task_action);
           
           // 使用保存的原始上下文发送消息
           // 这是最简单也是最可靠的方式
@@ -215,6 +216,307 @@ try {
     }
   }
 
+  // 工具函数：获取批量发送配置
+  function getBatchMode() {
+    try {
+      return seal.ext.getBoolConfig(ext, "batch_mode");
+    } catch (error) {
+      console.log('获取批量发送配置失败:', error);
+      return false;
+    }
+  }
+
+  function getBatchWindow() {
+    try {
+      return seal.ext.getIntConfig(ext, "batch_window_ms") || CONFIG.BATCH_WINDOW;
+    } catch (error) {
+      console.log('获取批量发送窗口失败:', error);
+      return CONFIG.BATCH_WINDOW;
+    }
+  }
+
+  // 工具函数：获取后端定时任务配置（需后端开启SCHEDULER_ENABLED）
+  function getBackendTasks() {
+    try {
+      return seal.ext.getBoolConfig(ext, "backend_tasks");
+    } catch (error) {
+      console.log('获取后端定时任务配置失败:', error);
+      return false;
+    }
+  }
+
+  // 构建定时任务提醒消息
+  function formatTaskNotification(description, action) {
+    let notificationMsg = `[定时任务提醒]\n\n`;
+    notificationMsg += `任务: ${description}\n`;
+    notificationMsg += `内容: ${action}\n`;
+    notificationMsg += `时间: ${new Date().toLocaleString()}\n`;
+    return notificationMsg;
+  }
+
+  // 后端定时任务：按会话ID构造临时上下文发送提醒
+  function deliverBackendTask(delivery) {
+    const endPoints = seal.getEndPoints();
+    if (!endPoints || endPoints.length === 0) {
+      console.log('没有可用的账号，无法发送定时任务提醒');
+      return false;
+    }
+    const message = seal.newMessage();
+    if (delivery.conversation_id.startsWith('group_')) {
+      message.messageType = 'group';
+      message.groupId = delivery.conversation_id.slice('group_'.length);
+    } else {
+      message.messageType = 'private';
+    }
+    message.sender.userId = delivery.user_id;
+    const tempCtx = seal.createTempCtx(endPoints[0], message);
+    seal.replyToSender(tempCtx, message, formatTaskNotification(delivery.task_description, delivery.task_action));
+    return true;
+  }
+
+  // 长轮询后端的到期任务，发送后确认；未确认的提醒由后端在租期过后重新下发
+  let taskPollRunning = false;
+
+  async function pollBackendTasks() {
+    if (!getBackendTasks()) {
+      taskPollRunning = false;
+      return;
+    }
+    taskPollRunning = true;
+    let delay = 0;
+    try {
+      const response = await fetch(`${CONFIG.API_BASE_URL}/tasks/due?wait=${CONFIG.TASK_POLL_WAIT}`);
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+      const data = await response.json();
+      const delivered = [];
+      (data.deliveries || []).forEach(delivery => {
+        try {
+          if (deliverBackendTask(delivery)) {
+            delivered.push(delivery.delivery_id);
+          }
+        } catch (error) {
+          console.log('发送定时任务提醒失败:', error);
+        }
+      });
+      if (delivered.length > 0) {
+        await fetch(`${CONFIG.API_BASE_URL}/tasks/ack`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ delivery_ids: delivered })
+        });
+      }
+    } catch (error) {
+      console.log('获取后端定时任务失败:', error);
+      delay = CONFIG.TASK_POLL_RETRY;
+    }
+    setTimeout(pollBackendTasks, delay);
+  }
+
+  function ensureTaskPolling() {
+    if (!taskPollRunning && getBackendTasks()) {
+      pollBackendTasks();
+    }
+  }
+
+  // 查看后端保存的当前会话定时任务
+  async function listBackendTasks(ctx, msg) {
+    try {
+      const response = await fetch(`${CONFIG.API_BASE_URL}/tasks`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ conversation_id: getConversationId(ctx) })
+      });
+      if (!response.ok) {
+        seal.replyToSender(ctx, msg, `❌ 获取定时任务失败：HTTP ${response.status}\n${await readErrorDetail(response)}`);
+        return;
+      }
+      const data = await response.json();
+      if (!data.success) {
+        seal.replyToSender(ctx, msg, `❌ 获取定时任务失败：${data.error || '未知错误'}`);
+        return;
+      }
+      if (data.tasks.length === 0) {
+        seal.replyToSender(ctx, msg, '📋 当前会话暂无定时任务\n\n💡 你可以通过自然语言与AI对话来创建定时任务，例如：\n• .chat 每天早上8点提醒我起床\n• .chat 每小时提醒我喝水\n\n⚠️ 注意：创建定时任务需要60级或以上权限');
+        return;
+      }
+      let taskListMsg = '📋 当前会话的定时任务（后端调度）：\n\n';
+      data.tasks.forEach((task, index) => {
+        taskListMsg += `${index + 1}. ${task.task_description}\n`;
+        taskListMsg += `   ⏰ 时间：${task.task_value}\n`;
+        taskListMsg += `   📝 类型：${task.task_type === 'daily' ? '每日任务' : '定时任务'}\n`;
+        taskListMsg += `   👤 创建者：${task.user_name}\n`;
+        taskListMsg += `   🔔 下次提醒：${task.next_fire}\n\n`;
+      });
+      taskListMsg += '🔧 管理命令：\n';
+      taskListMsg += '• .chat task clear - 清除当前会话的任务（需要60级权限）';
+      seal.replyToSender(ctx, msg, taskListMsg);
+    } catch (error) {
+      console.log('获取后端定时任务错误:', error);
+      seal.replyToSender(ctx, msg, `❌ 获取定时任务失败\n错误：${error.message}\n请检查网络连接和后端服务`);
+    }
+  }
+
+  // 删除后端保存的当前会话定时任务
+  async function clearBackendTasks(ctx, msg) {
+    try {
+      const response = await fetch(`${CONFIG.API_BASE_URL}/tasks/delete`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ conversation_id: getConversationId(ctx) })
+      });
+      if (!response.ok) {
+        seal.replyToSender(ctx, msg, `❌ 清除定时任务失败：HTTP ${response.status}\n${await readErrorDetail(response)}`);
+        return;
+      }
+      const data = await response.json();
+      if (data.success) {
+        seal.replyToSender(ctx, msg, `✅ 已清除当前会话的 ${data.deleted} 个定时任务`);
+      } else {
+        seal.replyToSender(ctx, msg, `❌ 清除定时任务失败：${data.error || '未知错误'}`);
+      }
+    } catch (error) {
+      console.log('清除后端定时任务错误:', error);
+      seal.replyToSender(ctx, msg, `❌ 清除定时任务失败\n错误：${error.message}\n请检查网络连接和后端服务`);
+    }
+  }
+
+  // 处理一条聊天结果（/chat的响应或/chat/batch中的一项）
+  function handleChatResult(ctx, msg, userPermission, data) {
+    if (data && data.success && data.coalesced) {
+      // 该消息已与同群的其他消息合并处理，回复由最后一条消息发送
+      return;
+    }
+    if (data && data.success && data.reply) {
+      
+      // 检查是否有定时任务信息
+      if (data.task_info && userPermission >= 60) {
+        console.log('检测到定时任务:', data.task_info);
+        
+        // 请求带上backend_tasks时后端保存任务并返回task_id，由后端调度，不再本地注册；
+        // 未开启backend_tasks时后端不保存任务，仍在本地注册
+        const savedByBackend = !!data.task_info.task_id;
+        if (savedByBackend) {
+          ensureTaskPolling();
+        }
+        if (savedByBackend || registerScheduledTask(ctx, msg, data.task_info)) {
+          // 任务注册成功，添加成功提示
+          const taskSuccessMsg = `\n\n✅ 定时任务创建成功！\n`;
+          const taskDetails = `📋 任务类型：${data.task_info.task_type === 'daily' ? '每日任务' : '定时任务'}\n`;
+          const taskTime = `⏰ 执行时间：${data.task_info.task_value}\n`;
+          const taskDesc = `📝 任务描述：${data.task_info.task_description}`;
+          const nextFire = data.task_info.next_fire ? `\n🔔 下次提醒：${data.task_info.next_fire}` : '';
+          
+          seal.replyToSender(ctx, msg, data.reply + taskSuccessMsg + taskDetails + taskTime + taskDesc + nextFire);
+        } else {
+          // 任务注册失败
+          seal.replyToSender(ctx, msg, data.reply + '\n\n❌ 定时任务创建失败，请稍后重试。');
+        }
+      } else {
+        // 没有任务信息，直接发送AI回复
+        seal.replyToSender(ctx, msg, data.reply);
+      }
+      
+    } else {
+      const errorMsg = (data && data.error) || '未知错误';
+      seal.replyToSender(ctx, msg, `AI回复失败：${errorMsg}\n\n建议：\n1. 检查API密钥配置\n2. 确认网络连接正常\n3. 使用 .chat test 测试服务`);
+    }
+  }
+
+  function replyHttpError(ctx, msg, status, errorDetail) {
+    if (status === 429 || status === 503) {
+      // 限流或服务繁忙：后端已给出稍后重试的提示
+      seal.replyToSender(ctx, msg, `⏳ ${errorDetail}`);
+      return;
+    }
+    seal.replyToSender(ctx, msg, `AI服务错误（HTTP ${status}）：${errorDetail}\n\n请检查后端服务状态`);
+  }
+
+  async function readErrorDetail(response) {
+    try {
+      const errorData = await response.json();
+      return errorData.detail || errorData.error || response.statusText;
+    } catch (e) {
+      return response.statusText;
+    }
+  }
+
+  function replyRequestError(ctx, msg, error) {
+    console.log('聊天请求错误:', error);
+    let errorMsg = '无法连接到AI服务\n\n';
+    if (error.name === 'TypeError' && error.message.includes('fetch')) {
+      errorMsg += '网络连接错误，请检查：\n';
+      errorMsg += '1. 后端服务是否启动\n';
+      errorMsg += '2. API地址是否正确\n';
+      errorMsg += '3. 防火墙或网络限制';
+    } else if (error.name === 'AbortError') {
+      errorMsg += '请求超时，请稍后重试';
+    } else {
+      errorMsg += `错误详情：${error.message}`;
+    }
+    errorMsg += '\n\n使用 .chat test 测试连接';
+    seal.replyToSender(ctx, msg, errorMsg);
+  }
+
+  // 批量发送：消息先进入队列，窗口结束或达到上限时通过/chat/batch一次发送
+  let chatQueue = [];
+  let chatFlushTimer = null;
+
+  function enqueueChatRequest(ctx, msg, chatData) {
+    chatQueue.push({ ctx, msg, chatData });
+    if (chatQueue.length >= CONFIG.BATCH_MAX_SIZE) {
+      flushChatQueue();
+    } else if (!chatFlushTimer) {
+      chatFlushTimer = setTimeout(flushChatQueue, getBatchWindow());
+    }
+  }
+
+  async function flushChatQueue() {
+    if (chatFlushTimer) {
+      clearTimeout(chatFlushTimer);
+      chatFlushTimer = null;
+    }
+    const pending = chatQueue;
+    chatQueue = [];
+    if (pending.length === 0) {
+      return;
+    }
+    try {
+      const response = await fetch(`${CONFIG.API_BASE_URL}/chat/batch`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ requests: pending.map(item => item.chatData) })
+      });
+      
+      if (!response.ok) {
+        const errorDetail = await readErrorDetail(response);
+        pending.forEach(item => replyHttpError(item.ctx, item.msg, response.status, errorDetail));
+        return;
+      }
+      const data = await response.json();
+      // 结果与请求顺序一致，每条消息单独处理成功或失败
+      pending.forEach((item, index) => {
+        const result = data.results[index];
+        if (result && result.status && result.status !== 200) {
+          replyHttpError(item.ctx, item.msg, result.status, result.error || '未知错误');
+        } else {
+          handleChatResult(item.ctx, item.msg, item.chatData.user_permission, result);
+        }
+      });
+    } catch (error) {
+      pending.forEach(item => replyRequestError(item.ctx, item.msg, error));
+    }
+  }
+
   // 发送AI聊天请求的核心函数
   async function sendChatRequest(ctx, msg, userMessage) {
     try {
@@ -228,9 +530,15 @@ try {
         user_name: userName,
         message: userMessage,
         conversation_id: conversationId,
-        user_permission: userPermission
+        user_permission: userPermission,
+        backend_tasks: getBackendTasks()
       };
       
+      if (getBatchMode()) {
+        enqueueChatRequest(ctx, msg, chatData);
+        return;
+      }
+      
       const response = await fetch(`${CONFIG.API_BASE_URL}/chat`, {
         method: 'POST',
         headers: {
@@ -240,60 +548,12 @@ try {
       });
       
       if (response.ok) {
-        const data = await response.json();
-        if (data && data.success && data.reply) {
-          
-          // 检查是否有定时任务信息
-          if (data.task_info && userPermission >= 60) {
-            console.log('检测到定时任务:', data.task_info);
-            
-            // 尝试注册定时任务
-            if (registerScheduledTask(ctx, msg, data.task_info)) {
-              // 任务注册成功，添加成功提示
-              const taskSuccessMsg = `\n\n✅ 定时任务创建成功！\n`;
-              const taskDetails = `📋 任务类型：${data.task_info.task_type === 'daily' ? '每日任务' : '定时任务'}\n`;
-              const taskTime = `⏰ 执行时间：${data.task_info.task_value}\n`;
-              const taskDesc = `📝 任务描述：${data.task_info.task_description}`;
-              
-              seal.replyToSender(ctx, msg, data.reply + taskSuccessMsg + taskDetails + taskTime + taskDesc);
-            } else {
-              // 任务注册失败
-              seal.replyToSender(ctx, msg, data.reply + '\n\n❌ 定时任务创建失败，请稍后重试。');
-            }
-          } else {
-            // 没有任务信息，直接发送AI回复
-            seal.replyToSender(ctx, msg, data.reply);
-          }
-          
-        } else {
-          const errorMsg = (data && data.error) || '未知错误';
-          seal.replyToSender(ctx, msg, `AI回复失败：${errorMsg}\n\n建议：\n1. 检查API密钥配置\n2. 确认网络连接正常\n3. 使用 .chat test 测试服务`);
-        }
+        handleChatResult(ctx, msg, userPermission, await response.json());
       } else {
-        let errorDetail = '';
-        try {
-          const errorData = await response.json();
-          errorDetail = errorData.detail || errorData.error || response.statusText;
-        } catch (e) {
-          errorDetail = response.statusText;
-        }
-        seal.replyToSender(ctx, msg, `AI服务错误（HTTP ${response.status}）：${errorDetail}\n\n请检查后端服务状态`);
+        replyHttpError(ctx, msg, response.status, await readErrorDetail(response));
       }
     } catch (error) {
-      console.log('聊天请求错误:', error);
-      let errorMsg = '无法连接到AI服务\n\n';
-      if (error.name === 'TypeError' && error.message.includes('fetch')) {
-        errorMsg += '网络连接错误，请检查：\n';
-        errorMsg += '1. 后端服务是否启动\n';
-        errorMsg += '2. API地址是否正确\n';
-        errorMsg += '3. 防火墙或网络限制';
-      } else if (error.name === 'AbortError') {
-        errorMsg += '请求超时，请稍后重试';
-      } else {
-        errorMsg += `错误详情：${error.message}`;
-      }
-      errorMsg += '\n\n使用 .chat test 测试连接';
-      seal.replyToSender(ctx, msg, errorMsg);
+      replyRequestError(ctx, msg, error);
     }
   }
 
@@ -417,6 +677,8 @@ try {
                     statusMsg += `警告：${data.warning}`;
                   }
                   seal.replyToSender(ctx, msg, statusMsg);
+                } else if (data && data.status === 'warming') {
+                  seal.replyToSender(ctx, msg, 'AI服务正在启动预热，请稍后再试');
                 } else {
                   seal.replyToSender(ctx, msg, 'AI服务状态异常，请检查后端配置');
                 }
@@ -523,6 +785,10 @@ try {
             case 'list':
             case '列表':
             case '查看': {
+              if (getBackendTasks()) {
+                listBackendTasks(ctx, msg);
+                return seal.ext.newCmdExecuteResult(true);
+              }
               if (registeredTasks.length === 0) {
                 seal.replyToSender(ctx, msg, '📋 暂无已注册的定时任务\n\n💡 你可以通过自然语言与AI对话来创建定时任务，例如：\n• .chat 每天早上8点提醒我起床\n• .chat 每小时提醒我喝水\n\n⚠️ 注意：创建定时任务需要60级或以上权限');
                 return seal.ext.newCmdExecuteResult(true);
@@ -564,6 +830,11 @@ try {
                 return seal.ext.newCmdExecuteResult(true);
               }
               
+              if (getBackendTasks()) {
+                clearBackendTasks(ctx, msg);
+                return seal.ext.newCmdExecuteResult(true);
+              }
+              
               if (registeredTasks.length === 0) {
                 seal.replyToSender(ctx, msg, '📋 暂无定时任务需要清除');
                 return seal.ext.newCmdExecuteResult(true);
@@ -955,6 +1226,12 @@ try {
     // 注册配置项
     seal.ext.registerStringConfig(ext, "bot_qq", "", "骰娘QQ号", "用于无指令聊天功能，填入骰娘的QQ号（纯数字，不带前缀）");
     seal.ext.registerBoolConfig(ext, "free_chat", false, "无指令聊天", "开启后可以通过@骰娘进行无指令聊天");
+    seal.ext.registerBoolConfig(ext, "batch_mode", false, "批量发送", "开启后消息先排队一小段时间，再通过/chat/batch一次发送，减少HTTP往返");
+    seal.ext.registerIntConfig(ext, "batch_window_ms", CONFIG.BATCH_WINDOW, "批量发送窗口", "批量发送模式下消息排队的毫秒数");
+    seal.ext.registerBoolConfig(ext, "backend_tasks", false, "后端定时任务", "开启后定时任务由后端保存和调度（需后端开启SCHEDULER_ENABLED），重启不丢失");
+    
+    // 启用后端定时任务时开始轮询到期提醒
+    ensureTaskPolling();
     
     console.log('AI聊天机器人插件加载完成 v2.0.0 - 支持智能定时任务');
     console.log(`API地址: ${CONFIG.API_BASE_URL}`);